@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Model analysis pipeline shared by the web app and the model workers
+build_prompt -> model -> apply_mileage_logic -> persist
+"""
+import datetime
+import json
+import logging
+from typing import Optional, Tuple
+
+from schemas import AnalyzeRequest
+from models_logic import build_prompt, call_model_async, apply_mileage_logic
+from rate_limits import record_result
+
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_for(request: AnalyzeRequest) -> str:
+    """Model prompt for a request"""
+    return build_prompt(
+        request.make,
+        request.model,
+        request.sub_model,
+        request.year,
+        request.fuel_type,
+        request.transmission,
+        request.mileage_range
+    )
+
+
+async def analyze_with_model(request: AnalyzeRequest) -> Tuple[dict, Optional[str]]:
+    """
+    Ask the model and adjust its answer for mileage (nothing is stored)
+    Returns (result, mileage_note)
+    """
+    result = await call_model_async(prompt_for(request))
+    return apply_mileage_logic(result, request.mileage_range)
+
+
+def result_row(request: AnalyzeRequest, user_id: str, result: dict) -> dict:
+    """Storage row of a model answer"""
+    return {
+        "date": datetime.date.today().isoformat(),
+        "user_id": user_id,
+        "make": request.make,
+        "model": request.model,
+        "sub_model": request.sub_model or "",
+        "year": request.year,
+        "fuel": request.fuel_type,
+        "transmission": request.transmission,
+        "mileage_range": request.mileage_range,
+        "base_score_calculated": result.get("base_score_calculated", ""),
+        "score_breakdown": json.dumps(result.get("score_breakdown", {}), ensure_ascii=False),
+        "avg_cost": result.get("avg_repair_cost_ILS", ""),
+        "issues": "; ".join(result.get("common_issues", []) or []),
+        "search_performed": bool(result.get("search_performed", True)),
+        "reliability_summary": result.get("reliability_summary", ""),
+        "issues_with_costs": json.dumps(result.get("issues_with_costs", []), ensure_ascii=False),
+        "sources": json.dumps(result.get("sources", []), ensure_ascii=False),
+        "recommended_checks": json.dumps(result.get("recommended_checks", []), ensure_ascii=False),
+        "common_competitors_brief": json.dumps(result.get("common_competitors_brief", []), ensure_ascii=False),
+    }
+
+
+def save_result(request: AnalyzeRequest, user_id: str, result: dict):
+    """Store a model answer (counted against today's quotas); never raises"""
+    try:
+        record_result(result_row(request, user_id, result))
+    except Exception as e:
+        # Don't fail the request if saving fails
+        logger.error("Saving model result failed: %r", e)
@@ -3,29 +3,55 @@
 FastAPI main application
 Car Reliability Analyzer API Server
 """
+import asyncio
 import datetime
 import json
-from typing import Optional
-from fastapi import FastAPI, HTTPException, Header, status
+import logging
+from typing import Dict, List, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Header, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from starlette.background import BackgroundTask
 import pandas as pd
 
-from settings import ALLOWED_ORIGINS, REQUIRED_HEADERS
+from settings import (
+    ALLOWED_ORIGINS, REQUIRED_HEADERS, GLOBAL_DAILY_LIMIT, USER_DAILY_LIMIT,
+    SINGLE_FLIGHT_CROSS_WORKER, SINGLE_FLIGHT_WAIT_SEC, SINGLE_FLIGHT_POLL_SEC,
+    CACHE_STALE_DAYS, STALE_REFRESH_PER_MIN, STALE_REFRESH_BURST, CACHE_OUTAGE_DAYS,
+    BATCH_MAX_ITEMS, BATCH_CONCURRENCY, JOB_QUEUE, JOB_POLL_SEC,
+)
 from schemas import (
     AnalyzeRequest, AnalyzeResponse, AnalysisResult, QuotaInfo,
+    BatchAnalyzeRequest, BatchItemResult, JobResponse,
     HistoryResponse, HistoryItem, LeadRequest, QuotaResponse,
     RoiRequest, RoiResponse
 )
 from auth import get_user_id_from_header
-from rate_limits import check_rate_limits, get_remaining_quota
-from cache_lookup import get_cached_from_sheet
-from models_logic import build_prompt, call_model_with_retry, apply_mileage_logic
-from sheets_layer import sheet_to_df, append_row_to_sheet
+from rate_limits import (
+    check_rate_limits, get_remaining_quota,
+    reserve_model_call, release_model_call,
+)
+from cache_lookup import get_cached_from_sheet, vehicle_key, normalize_text
+from catalog import ensure_loaded, validate_vehicle
+from mileage import MILEAGE_TEXT_FIELDS
+from models_logic import stream_model_async, parse_model_json, apply_mileage_logic, model_stats, model_wait
+from analysis import prompt_for, analyze_with_model, save_result
+from json_stream import JsonFieldStream
+from breaker import ModelUnavailable
+from sheets_layer import start_write_behind, flush_write_behind
+from storage import get_store
+from context import RequestContext
+from io_pool import run_blocking, pool_stats, shutdown_pool
+from singleflight import SingleFlight
+from jobs import get_queue, DONE, FAILED
+from limiter import take_token
 from leads import save_lead
 from roi import calculate_roi
 
 
+logger = logging.getLogger(__name__)
+
 # Create FastAPI app
 app = FastAPI(
     title="Car Reliability Analyzer API",
@@ -34,6 +60,17 @@ app = FastAPI(
 )
 
 
+# Concurrent identical cache misses share one model call
+model_flights = SingleFlight()
+
+# How often a waiting model request checks whether its client went away
+DISCONNECT_POLL_SEC = 0.5
+
+# Rows written by background refreshes of stale cache entries
+STALE_REFRESH_USER = "stale-refresh"
+_refresh_tasks = set()
+
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -44,17 +81,41 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def on_startup():
+    """Start background workers, load the catalog and open the results store"""
+    start_write_behind()
+    ensure_loaded()
+    await run_blocking(get_store)
+    if JOB_QUEUE:
+        await run_blocking(get_queue)
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Flush queued sheet writes before the worker exits"""
+    await run_blocking(flush_write_behind)
+    shutdown_pool()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.datetime.now().isoformat(),
+        "io_pool": pool_stats(),
+        "single_flight": model_flights.stats(),
+        "models": model_stats(),
+        "jobs": await run_blocking(get_queue().stats) if JOB_QUEUE else None
+    }
 
 
 @app.get("/v1/quota")
 async def get_quota(authorization: Optional[str] = Header(None)):
     """Get current quota status"""
-    user_id = get_user_id_from_header(authorization)
-    user_left, global_left = get_remaining_quota(user_id)
+    user_id = await run_blocking(get_user_id_from_header, authorization)
+    user_left, global_left = await run_blocking(get_remaining_quota, user_id)
     
     return QuotaResponse(
         user_left_today=user_left,
@@ -65,18 +126,181 @@ async def get_quota(authorization: Optional[str] = Header(None)):
 @app.post("/v1/analyze")
 async def analyze_reliability(
     request: AnalyzeRequest,
+    http_request: Request,
     authorization: Optional[str] = Header(None)
 ) -> AnalyzeResponse:
     """Analyze car reliability"""
     
+    # Impossible vehicles are rejected before auth, quotas or storage
+    _validate_request(request)
+    
     # Get user ID
-    user_id = get_user_id_from_header(authorization)
+    user_id = await run_blocking(get_user_id_from_header, authorization)
+    
+    # Every stage below reads storage through this one context
+    ctx = RequestContext(user_id)
     
     # Check rate limits
-    can_proceed, user_cnt, global_cnt = check_rate_limits(user_id)
+    user_cnt, global_cnt = await _check_daily_limits(user_id, ctx)
+    
+    # Try cache first (a stale hit is served now and refreshed behind it)
+    cached, used_fallback, mileage_matched = await _lookup_cache(request, ctx)
+    if cached:
+        if cached.get("stale"):
+            _schedule_refresh(request)
+        return _cache_response(request, user_id, ctx, cached, used_fallback, mileage_matched)
+    
+    # Model workers answer it in the background; the client polls the job
+    if JOB_QUEUE:
+        return await _enqueue_job(request, user_id, ctx)
+    
+    # Identical concurrent misses share one model call; a client that goes
+    # away stops waiting (and the call, if it was the last one waiting)
+    response, _ = await _until_disconnected(
+        http_request, _resolve_miss(request, user_id, ctx, (user_cnt, global_cnt))
+    )
+    return response
+
+
+def _validate_request(request: AnalyzeRequest):
+    """Raise 422 for a make/model/year the catalog says cannot exist"""
+    reason = validate_vehicle(request.make, request.model, request.year)
+    if reason:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=reason)
+
+
+async def _resolve_miss(request: AnalyzeRequest, user_id: str, ctx: RequestContext,
+                        counts: Tuple[int, int]) -> Tuple[AnalyzeResponse, bool]:
+    """
+    Answer a cache miss, calling the model at most once per flight
+    Returns (response, called_model); called_model is True when this request
+    made (and was charged for) the model call
+    """
+    key = _flight_key(request)
+    
+    while True:
+        # Another worker may already be asking the model the same question;
+        # wait for it and serve its stored answer instead
+        if SINGLE_FLIGHT_CROSS_WORKER and not model_flights.running(key):
+            if await _wait_for_peer(_lock_name(key)):
+                cached, used_fallback, mileage_matched = await _lookup_cache(request, RequestContext(user_id))
+                if cached:
+                    return _cache_response(request, user_id, ctx, cached, used_fallback, mileage_matched), False
+        
+        try:
+            (result, mileage_note), shared = await model_flights.do(
+                key, lambda: _run_model(request, user_id, ctx), private=(HTTPException, _PeerRunning)
+            )
+            break
+        except _PeerRunning:
+            continue
+        except HTTPException:
+            raise
+        except ModelUnavailable as e:
+            return await _outage_response(request, user_id, ctx, e), False
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"AI model failed: {repr(e)}"
+            )
+    return _model_response(request, ctx, result, mileage_note, counts, counted=not shared), not shared
+
+
+async def _enqueue_job(request: AnalyzeRequest, user_id: str, ctx: RequestContext):
+    """Queue a model analysis (once per flight key) and answer 202 with its job"""
+    queue = get_queue()
+    key = _lock_name(_flight_key(request))
+    
+    # A job that just finished is reused too: its saved row may not be in
+    # this worker's snapshot yet, and a new job would bill a second call
+    existing = await run_blocking(queue.active, key)
+    if existing is not None:
+        job_id, job_state = existing
+    else:
+        # The job carries this reservation; a failing worker releases it
+        try:
+            await _reserve_model_call(user_id, ctx)
+        except ModelUnavailable as e:
+            return await _outage_response(request, user_id, ctx, e)
+        try:
+            job_id, job_state, created = await run_blocking(queue.enqueue, key, user_id, jsonable_encoder(request))
+        except BaseException:
+            await run_blocking(release_model_call, user_id)
+            raise
+        if not created:
+            # Another request queued the same analysis first
+            await run_blocking(release_model_call, user_id)
+    
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=jsonable_encoder(JobResponse(job_id=job_id, status=job_state)),
+        headers={"Location": f"/v1/jobs/{job_id}", "Retry-After": str(max(1, int(JOB_POLL_SEC * 4)))}
+    )
+
+
+async def _job_status(job_id: str, user_id: str) -> JobResponse:
+    """Current state of a job; 404 if unknown or pruned"""
+    job = await run_blocking(get_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    
+    if job["status"] == DONE:
+        request = AnalyzeRequest(**json.loads(job["request"]))
+        payload = json.loads(job["result"])
+        # Quota of the user polling; the job's call is already counted
+        ctx = RequestContext(user_id)
+        _, user_cnt, global_cnt = await run_blocking(check_rate_limits, user_id, ctx)
+        response = _model_response(request, ctx, payload["result"], payload["mileage_note"],
+                                   (user_cnt, global_cnt), counted=False)
+        return JobResponse(job_id=job_id, status=DONE, response=response)
+    
+    return JobResponse(job_id=job_id, status=job["status"], detail=job["error"])
+
+
+@app.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str, authorization: Optional[str] = Header(None)) -> JobResponse:
+    """Poll a queued analysis"""
+    user_id = await run_blocking(get_user_id_from_header, authorization)
+    return await _job_status(job_id, user_id)
+
+
+@app.get("/v1/jobs/{job_id}/events")
+async def job_events(job_id: str, authorization: Optional[str] = Header(None)):
+    """
+    Follow a queued analysis as server-sent events
+    Events: "status" on every change, then "result" (the JobResponse) or "error"
+    """
+    user_id = await run_blocking(get_user_id_from_header, authorization)
+    first = await _job_status(job_id, user_id)
+    
+    async def events():
+        job, last = first, None
+        while True:
+            if job.status != last:
+                yield _sse("status", {"status": job.status})
+                last = job.status
+            if job.status in (DONE, FAILED):
+                yield _sse("result" if job.status == DONE else "error", jsonable_encoder(job))
+                return
+            await asyncio.sleep(JOB_POLL_SEC)
+            try:
+                job = await _job_status(job_id, user_id)
+            except HTTPException as e:
+                yield _sse("error", {"job_id": job_id, "detail": e.detail})
+                return
+    
+    return _sse_response(events())
+
+
+async def _check_daily_limits(user_id: str, ctx: RequestContext) -> Tuple[int, int]:
+    """
+    Raise 429 if the user or the service is out of daily quota
+    Returns (user_count, global_count)
+    """
+    can_proceed, user_cnt, global_cnt = await run_blocking(check_rate_limits, user_id, ctx)
     
     if not can_proceed:
-        if global_cnt >= 1000:
+        if global_cnt >= GLOBAL_DAILY_LIMIT:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Global daily limit reached. Please try again tomorrow."
@@ -86,114 +310,477 @@ async def analyze_reliability(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="User daily limit reached. Please try again tomorrow."
             )
+    return user_cnt, global_cnt
+
+
+async def _outage_response(request: AnalyzeRequest, user_id: str, ctx: RequestContext,
+                           error: ModelUnavailable) -> AnalyzeResponse:
+    """Upstream is down or saturated: an old answer beats no answer"""
+    cached, used_fallback, mileage_matched = await _lookup_cache(request, ctx, CACHE_OUTAGE_DAYS)
+    if cached:
+        return _cache_response(request, user_id, ctx, cached, used_fallback, mileage_matched)
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="AI model temporarily unavailable. Please try again shortly.",
+        headers={"Retry-After": str(max(1, int(error.retry_after + 0.999)))}
+    )
+
+
+def _model_response(request: AnalyzeRequest, ctx: RequestContext, result: dict, mileage_note: Optional[str],
+                    counts: Tuple[int, int], counted: bool) -> AnalyzeResponse:
+    """Response serving a fresh model answer"""
+    result = dict(result)
     
-    # Try cache first
-    cached = None
-    used_fallback = False
-    mileage_matched = False
-    km_warn = False
-    mileage_note = None
+    # Quota after this request, derived from the counts read at its start
+    # plus the model call it reserved, if it made one (no second storage read)
+    user_cnt, global_cnt = ctx.quota or counts
+    if counted:
+        user_cnt, global_cnt = user_cnt + 1, global_cnt + 1
+    user_left = USER_DAILY_LIMIT - user_cnt
+    global_left = GLOBAL_DAILY_LIMIT - global_cnt
     
+    # Prepare response
+    result["last_date"] = datetime.date.today().isoformat()
+    result["cached_mileage_range"] = request.mileage_range
+    
+    return AnalyzeResponse(
+        source="model",
+        used_fallback=False,
+        km_warn=False,
+        mileage_note=mileage_note,
+        result=AnalysisResult(**result),
+        quota=QuotaInfo(
+            user_left_today=max(0, user_left),
+            global_left_today=max(0, global_left)
+        )
+    )
+
+
+async def _lookup_cache(request: AnalyzeRequest, ctx: RequestContext,
+                        stale_days: int = CACHE_STALE_DAYS) -> Tuple[Optional[dict], bool, bool]:
+    """
+    Cached answer for a request, stale up to stale_days past CACHE_MAX_DAYS
+    Returns (cached, used_fallback, mileage_matched)
+    """
+    return await run_blocking(_cache_lookup, request, ctx, stale_days)
+
+
+def _cache_lookup(request: AnalyzeRequest, ctx: RequestContext,
+                  stale_days: int = CACHE_STALE_DAYS) -> Tuple[Optional[dict], bool, bool]:
+    """Blocking part of _lookup_cache"""
     try:
         cached, _, used_fallback, mileage_matched = get_cached_from_sheet(
             request.make,
             request.model,
             request.sub_model,
             request.year,
-            request.mileage_range
+            request.mileage_range,
+            ctx=ctx,
+            stale_days=stale_days
         )
     except Exception:
-        cached = None
+        return None, False, False
+    return cached, used_fallback, mileage_matched
+
+
+def _cache_response(request: AnalyzeRequest, user_id: str, ctx: RequestContext, cached: dict,
+                    used_fallback: bool, mileage_matched: bool) -> AnalyzeResponse:
+    """Response serving a cached result"""
+    # The cached base score is un-adjusted: adjust it for this request's mileage
+    cached, mileage_note = apply_mileage_logic(cached, request.mileage_range)
+    km_warn = not mileage_matched
     
-    if cached:
-        # Apply mileage logic to cached result
-        cached, mileage_note = apply_mileage_logic(cached, request.mileage_range)
-        km_warn = not mileage_matched
-        
-        # Get remaining quota
-        user_left, global_left = get_remaining_quota(user_id)
-        
-        return AnalyzeResponse(
-            source="cache",
-            used_fallback=used_fallback,
-            km_warn=km_warn,
-            mileage_note=mileage_note,
-            result=AnalysisResult(**cached),
-            quota=QuotaInfo(
-                user_left_today=max(0, user_left),
-                global_left_today=max(0, global_left)
-            )
+    # Get remaining quota
+    user_left, global_left = get_remaining_quota(user_id, ctx)
+    
+    return AnalyzeResponse(
+        source="cache",
+        used_fallback=used_fallback,
+        km_warn=km_warn,
+        stale=bool(cached.get("stale")),
+        approximate_fields=list(MILEAGE_TEXT_FIELDS) if km_warn else [],
+        mileage_note=mileage_note,
+        result=AnalysisResult(**cached),
+        quota=QuotaInfo(
+            user_left_today=max(0, user_left),
+            global_left_today=max(0, global_left)
         )
+    )
+
+
+def _flight_key(request: AnalyzeRequest) -> tuple:
+    """Requests with the same key get the same model answer"""
+    return (
+        vehicle_key(request.make, request.model),
+        normalize_text(request.sub_model or ""),
+        int(request.year),
+        normalize_text(request.fuel_type),
+        normalize_text(request.transmission),
+        normalize_text(request.mileage_range),
+    )
+
+
+def _lock_name(key: tuple) -> str:
+    """Cross-worker lock name of a flight key"""
+    return "analyze:" + json.dumps(key, ensure_ascii=False)
+
+
+async def _wait_for_peer(lock_name: str) -> bool:
+    """Wait while another worker holds lock_name; True if one did"""
+    store = get_store()
+    deadline = asyncio.get_running_loop().time() + SINGLE_FLIGHT_WAIT_SEC
+    waited = False
+    try:
+        while await run_blocking(store.is_locked, lock_name):
+            waited = True
+            if asyncio.get_running_loop().time() >= deadline:
+                break
+            await asyncio.sleep(SINGLE_FLIGHT_POLL_SEC)
+    except Exception as e:
+        logger.warning("Flight lock check failed: %r", e)
+    return waited
+
+
+async def _until_disconnected(http_request: Request, awaitable):
+    """Await awaitable, cancelling it if the client disconnects first"""
+    task = asyncio.ensure_future(awaitable)
     
-    # Call AI model
+    async def watch():
+        while not task.done():
+            if await http_request.is_disconnected():
+                task.cancel()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SEC)
+    
+    watcher = asyncio.ensure_future(watch())
     try:
-        prompt = build_prompt(
-            request.make,
-            request.model,
-            request.sub_model,
-            request.year,
-            request.fuel_type,
-            request.transmission,
-            request.mileage_range
+        return await task
+    finally:
+        watcher.cancel()
+
+
+class _PeerRunning(Exception):
+    """Another worker took the flight lock first"""
+
+
+def _schedule_refresh(request: AnalyzeRequest):
+    """Refresh a stale cache entry in the background, within the refresh budget"""
+    key = _flight_key(request)
+    if STALE_REFRESH_PER_MIN <= 0 or model_flights.running(key):
+        return
+    task = asyncio.ensure_future(_refresh(request, key))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _refresh(request: AnalyzeRequest, key: tuple):
+    """Call the model for a stale entry and store the answer"""
+    try:
+        if not await run_blocking(take_token, "stale-refresh", STALE_REFRESH_PER_MIN, STALE_REFRESH_BURST):
+            return
+        # Refreshes are not charged to the user, but still respect the global cap
+        _, global_left = await run_blocking(get_remaining_quota, STALE_REFRESH_USER)
+        if global_left <= 0:
+            return
+        await model_flights.do(
+            key, lambda: _run_model(request, STALE_REFRESH_USER, None, reserve=False),
+            private=(HTTPException, _PeerRunning)
         )
-        result = call_model_with_retry(prompt)
+    except _PeerRunning:
+        pass
     except Exception as e:
+        logger.warning("Stale cache refresh failed: %r", e)
+
+
+async def _run_model(request: AnalyzeRequest, user_id: str, ctx: Optional[RequestContext],
+                     reserve: bool = True) -> Tuple[dict, Optional[str]]:
+    """
+    Reserve quota, call the model and store its answer (once per flight)
+    Returns (result, mileage_note)
+    """
+    lock_name = _lock_name(_flight_key(request))
+    locked = False
+    if SINGLE_FLIGHT_CROSS_WORKER:
+        try:
+            locked = await run_blocking(get_store().try_lock, lock_name, SINGLE_FLIGHT_WAIT_SEC)
+        except Exception as e:
+            # Without the lock, run the call anyway
+            logger.warning("Flight lock failed: %r", e)
+            locked = None
+        if locked is False:
+            raise _PeerRunning()
+    
+    try:
+        return await _call_and_store(request, user_id, ctx, reserve)
+    finally:
+        if locked:
+            try:
+                await run_blocking(get_store().unlock, lock_name)
+            except Exception as e:
+                logger.warning("Flight unlock failed: %r", e)
+
+
+async def _call_and_store(request: AnalyzeRequest, user_id: str, ctx: Optional[RequestContext],
+                          reserve: bool = True) -> Tuple[dict, Optional[str]]:
+    """
+    Reserve quota, call the model and store its answer
+    Returns (result, mileage_note)
+    """
+    if reserve:
+        await _reserve_model_call(user_id, ctx)
+    
+    # Call AI model (answer adjusted for mileage)
+    try:
+        result, mileage_note = await analyze_with_model(request)
+    except BaseException:
+        # Failed or cancelled: the reserved call did not happen
+        if reserve:
+            await run_blocking(release_model_call, user_id)
+        raise
+    
+    # Save result
+    await run_blocking(save_result, request, user_id, result)
+    
+    return result, mileage_note
+
+
+async def _reserve_model_call(user_id: str, ctx: Optional[RequestContext]):
+    """Reserve quota for one model call, or raise ModelUnavailable / 429"""
+    # With every circuit open, do not spend quota on a call that cannot run
+    wait = model_wait()
+    if wait > 0:
+        raise ModelUnavailable("All model circuits are open", wait)
+    
+    # Reserve quota for the model call before making it, so concurrent
+    # requests cannot all pass the check before any row is written
+    reserved, reason, retry_after = await run_blocking(reserve_model_call, user_id, ctx)
+    if not reserved:
+        if reason == "rate":
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please slow down.",
+                headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+            )
         raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"AI model failed: {repr(e)}"
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=("Global daily limit reached. Please try again tomorrow." if reason == "global"
+                    else "User daily limit reached. Please try again tomorrow.")
         )
+
+
+@app.post("/v1/analyze/stream")
+async def analyze_reliability_stream(
+    request: AnalyzeRequest,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Analyze car reliability, streaming the answer as server-sent events
+    Events: "meta" (source), "field" per completed top-level field of the
+    model answer, "result" (the full AnalyzeResponse) and "error"
+    Quota and limit errors are returned before the stream opens
+    """
+    _validate_request(request)
+    user_id = await run_blocking(get_user_id_from_header, authorization)
+    ctx = RequestContext(user_id)
+    counts = await _check_daily_limits(user_id, ctx)
     
-    # Apply mileage adjustment
-    result, mileage_note = apply_mileage_logic(result, request.mileage_range)
+    cached, used_fallback, mileage_matched = await _lookup_cache(request, ctx)
+    if not cached:
+        try:
+            await _reserve_model_call(user_id, ctx)
+            # The stream releases the reservation if it fails; one that never
+            # starts (client gone before the first event) is released after
+            reservation = {"started": False}
+            return _sse_response(
+                _stream_model(request, user_id, ctx, counts, reservation),
+                background=BackgroundTask(_release_unstarted, user_id, reservation)
+            )
+        except ModelUnavailable as e:
+            cached_response = await _outage_response(request, user_id, ctx, e)
+    else:
+        if cached.get("stale"):
+            _schedule_refresh(request)
+        cached_response = _cache_response(request, user_id, ctx, cached, used_fallback, mileage_matched)
     
-    # Save to sheet
-    try:
-        row = {
-            "date": datetime.date.today().isoformat(),
-            "user_id": user_id,
-            "make": request.make,
-            "model": request.model,
-            "sub_model": request.sub_model or "",
-            "year": request.year,
-            "fuel": request.fuel_type,
-            "transmission": request.transmission,
-            "mileage_range": request.mileage_range,
-            "base_score_calculated": result.get("base_score_calculated", ""),
-            "score_breakdown": json.dumps(result.get("score_breakdown", {}), ensure_ascii=False),
-            "avg_cost": result.get("avg_repair_cost_ILS", ""),
-            "issues": "; ".join(result.get("common_issues", []) or []),
-            "search_performed": bool(result.get("search_performed", True)),
-            "reliability_summary": result.get("reliability_summary", ""),
-            "issues_with_costs": json.dumps(result.get("issues_with_costs", []), ensure_ascii=False),
-            "sources": json.dumps(result.get("sources", []), ensure_ascii=False),
-            "recommended_checks": json.dumps(result.get("recommended_checks", []), ensure_ascii=False),
-            "common_competitors_brief": json.dumps(result.get("common_competitors_brief", []), ensure_ascii=False),
-        }
-        append_row_to_sheet(row)
-    except Exception as e:
-        # Don't fail the request if saving fails
-        pass
+    async def replay():
+        yield _sse("meta", {"source": "cache", "stale": cached_response.stale})
+        yield _sse("result", jsonable_encoder(cached_response))
     
-    # Get remaining quota after this request
-    user_left, global_left = get_remaining_quota(user_id)
+    return _sse_response(replay())
+
+
+@app.post("/v1/analyze/batch")
+async def analyze_batch(
+    batch: BatchAnalyzeRequest,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Analyze many vehicles in one request, streamed back as NDJSON
+    Items with the same normalized key are answered once. Invalid items
+    come first (422 lines), then cache hits, then model answers in completion
+    order (BatchItemResult lines), then a summary line. Only model calls
+    actually made are charged
+    """
+    if not batch.items or len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"A batch needs 1 to {BATCH_MAX_ITEMS} items."
+        )
     
-    # Prepare response
-    result["last_date"] = datetime.date.today().isoformat()
-    result["cached_mileage_range"] = request.mileage_range
+    user_id = await run_blocking(get_user_id_from_header, authorization)
+    ctx = RequestContext(user_id)
+    counts = await _check_daily_limits(user_id, ctx)
     
-    return AnalyzeResponse(
-        source="model",
-        used_fallback=False,
-        km_warn=False,
-        mileage_note=mileage_note,
-        result=AnalysisResult(**result),
-        quota=QuotaInfo(
-            user_left_today=max(0, user_left - 1),
-            global_left_today=max(0, global_left - 1)
+    groups: Dict[tuple, List[int]] = {}
+    invalid: Dict[str, List[int]] = {}
+    for i, item in enumerate(batch.items):
+        reason = validate_vehicle(item.make, item.model, item.year)
+        if reason:
+            invalid.setdefault(reason, []).append(i)
+            continue
+        groups.setdefault(_flight_key(item), []).append(i)
+    rejected = [BatchItemResult(indexes=indexes, status=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=reason)
+                for reason, indexes in invalid.items()]
+    unique = [(batch.items[indexes[0]], indexes) for indexes in groups.values()]
+    
+    # Every lookup reads the same storage snapshot through ctx
+    hits = await run_blocking(lambda: [_cache_lookup(item, ctx) for item, _ in unique])
+    
+    return StreamingResponse(
+        _batch_lines(user_id, ctx, counts, len(batch.items), unique, hits, rejected),
+        media_type="application/x-ndjson"
+    )
+
+
+async def _batch_lines(user_id: str, ctx: RequestContext, counts: Tuple[int, int], total: int,
+                       unique: List[Tuple[AnalyzeRequest, List[int]]], hits: list,
+                       rejected: List[BatchItemResult]):
+    """NDJSON lines of a batch: invalid items, cache hits, then misses as their model calls finish"""
+    user_cnt, global_cnt = ctx.quota or counts
+    calls = 0
+    
+    def quota() -> QuotaInfo:
+        return QuotaInfo(
+            user_left_today=max(0, USER_DAILY_LIMIT - user_cnt - calls),
+            global_left_today=max(0, GLOBAL_DAILY_LIMIT - global_cnt - calls)
         )
+    
+    def line(item: BatchItemResult) -> str:
+        return json.dumps(jsonable_encoder(item), ensure_ascii=False) + "\n"
+    
+    for item in rejected:
+        yield line(item)
+    
+    misses = []
+    for (item, indexes), (cached, used_fallback, mileage_matched) in zip(unique, hits):
+        if not cached:
+            misses.append((item, indexes))
+            continue
+        if cached.get("stale"):
+            _schedule_refresh(item)
+        response = _cache_response(item, user_id, ctx, cached, used_fallback, mileage_matched)
+        yield line(BatchItemResult(indexes=indexes, status=200, response=response))
+    
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def resolve(item: AnalyzeRequest, indexes: List[int]):
+        async with slots:
+            try:
+                response, called = await _resolve_miss(item, user_id, ctx, counts)
+                return indexes, response, called, None
+            except HTTPException as e:
+                return indexes, None, False, e
+    
+    tasks = [asyncio.ensure_future(resolve(item, indexes)) for item, indexes in misses]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indexes, response, called, error = await next_done
+            calls += called
+            if error is not None:
+                yield line(BatchItemResult(indexes=indexes, status=error.status_code, detail=str(error.detail)))
+                continue
+            response.quota = quota()
+            yield line(BatchItemResult(indexes=indexes, status=200, response=response))
+    finally:
+        # The client went away: stop the calls still running
+        for task in tasks:
+            task.cancel()
+    
+    summary = {
+        "done": True,
+        "items": total,
+        "unique": len(unique),
+        "rejected": sum(len(item.indexes) for item in rejected),
+        "cached": len(unique) - len(misses),
+        "model_calls": calls,
+        "quota": jsonable_encoder(quota()),
+    }
+    yield json.dumps(summary) + "\n"
+
+
+def _sse(event: str, data) -> str:
+    """One server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_response(events, background: Optional[BackgroundTask] = None) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background
     )
 
 
+async def _release_unstarted(user_id: str, reservation: dict):
+    """After a model stream's response: release its reservation if the stream never ran"""
+    if not reservation["started"]:
+        reservation["started"] = True
+        await run_blocking(release_model_call, user_id)
+
+
+async def _stream_model(request: AnalyzeRequest, user_id: str, ctx: RequestContext, counts: Tuple[int, int],
+                        reservation: dict):
+    """
+    Events of a streamed model answer (quota already reserved)
+    Fields go out as soon as they parse; the base score goes out already
+    adjusted for mileage. The full answer is stored at the end. From its
+    first event the stream owns the reservation (see _release_unstarted)
+    """
+    reservation["started"] = True
+    parser = JsonFieldStream()
+    chunks = []
+    completed = False
+    try:
+        yield _sse("meta", {"source": "model"})
+        async for text in stream_model_async(prompt_for(request)):
+            chunks.append(text)
+            for name, value in parser.feed(text):
+                if name == "base_score_calculated":
+                    adjusted, note = apply_mileage_logic({name: value}, request.mileage_range)
+                    value = adjusted[name]
+                    if note:
+                        yield _sse("field", {"name": "mileage_note", "value": note})
+                yield _sse("field", {"name": name, "value": value})
+        
+        result = parse_model_json("".join(chunks))
+        if not isinstance(result, dict):
+            raise ValueError("Model returned no JSON object")
+        result, mileage_note = apply_mileage_logic(result, request.mileage_range)
+        response = _model_response(request, ctx, result, mileage_note, counts, counted=True)
+        completed = True
+    except Exception as e:
+        yield _sse("error", {"detail": f"AI model failed: {repr(e)}"})
+        return
+    finally:
+        if not completed:
+            # Shielded: the release finishes even if a disconnect cancels this await
+            await asyncio.shield(run_blocking(release_model_call, user_id))
+    
+    await run_blocking(save_result, request, user_id, result)
+    yield _sse("result", jsonable_encoder(response))
+
+
 @app.get("/v1/history")
 async def get_history(
     limit: int = 100,
@@ -202,31 +789,20 @@ async def get_history(
 ) -> HistoryResponse:
     """Get analysis history for the user"""
     
-    user_id = get_user_id_from_header(authorization)
+    user_id = await run_blocking(get_user_id_from_header, authorization)
     
     if user_id == "anonymous":
         # Return empty history for anonymous users
         return HistoryResponse(items=[], total=0)
     
     try:
-        df = sheet_to_df()
-        
-        if df.empty:
-            return HistoryResponse(items=[], total=0)
-        
-        # Filter by user_id
-        user_df = df[df["user_id"].astype(str) == user_id]
+        user_df = await run_blocking(get_store().user_results, user_id)
         
         if user_df.empty:
             return HistoryResponse(items=[], total=0)
         
-        # Sort by date descending
-        if "date" in user_df.columns:
-            try:
-                user_df["date"] = pd.to_datetime(user_df["date"], errors="coerce")
-                user_df = user_df.sort_values("date", ascending=False)
-            except Exception:
-                pass
+        # Sort by date descending (dates are already typed by the store)
+        user_df = user_df.sort_values("date", ascending=False)
         
         total = len(user_df)
         
@@ -273,7 +849,7 @@ async def get_history(
 async def export_history_csv(authorization: Optional[str] = Header(None)):
     """Export user history as CSV"""
     
-    user_id = get_user_id_from_header(authorization)
+    user_id = await run_blocking(get_user_id_from_header, authorization)
     
     if user_id == "anonymous":
         raise HTTPException(
@@ -282,15 +858,13 @@ async def export_history_csv(authorization: Optional[str] = Header(None)):
         )
     
     try:
-        df = sheet_to_df()
+        user_df = await run_blocking(get_store().user_results, user_id)
         
-        if df.empty:
+        if user_df.empty:
             # Return empty CSV
             csv_data = pd.DataFrame(columns=REQUIRED_HEADERS).to_csv(index=False)
         else:
-            # Filter by user_id
-            user_df = df[df["user_id"].astype(str) == user_id]
-            csv_data = user_df.to_csv(index=False)
+            csv_data = user_df[REQUIRED_HEADERS].to_csv(index=False)
         
         return StreamingResponse(
             iter([csv_data]),
@@ -314,10 +888,10 @@ async def create_lead(
 ):
     """Submit a lead"""
     
-    user_id = get_user_id_from_header(authorization)
+    user_id = await run_blocking(get_user_id_from_header, authorization)
     
     try:
-        success = save_lead(lead, user_id)
+        success = await run_blocking(save_lead, lead, user_id)
         
         if success:
             return {"status": "success", "message": "Lead saved successfully"}
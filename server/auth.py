@@ -1,12 +1,89 @@
 # -*- coding: utf-8 -*-
 """
 Google OAuth authentication
+Verified tokens are remembered until they expire, and Google's signing
+certs are fetched over one pooled session and kept as long as Google's
+cache headers allow
 """
+import hashlib
+import re
+import threading
+import time
 from typing import Optional, Tuple
+
+from requests import Session
+from requests.adapters import HTTPAdapter
 from google.auth.transport import requests
 from google.oauth2 import id_token
 
-from settings import GOOGLE_OAUTH_AUDIENCE
+from settings import GOOGLE_OAUTH_AUDIENCE, AUTH_CACHE_SIZE
+from lru import LruCache
+
+
+# Used when a certs response carries no max-age
+DEFAULT_CERTS_TTL_SEC = 300
+
+
+class _CachingRequest(requests.Request):
+    """
+    Transport over a long-lived pooled session that answers repeated GETs
+    (the cert endpoint) from memory until their Cache-Control max-age ends
+    """
+
+    def __init__(self):
+        session = Session()
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        super().__init__(session=session)
+        self._cached = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ttl(headers) -> float:
+        match = re.search(r"max-age=(\d+)", headers.get("Cache-Control", ""))
+        if not match:
+            return DEFAULT_CERTS_TTL_SEC
+        try:
+            age = int(headers.get("Age", 0))
+        except ValueError:
+            age = 0
+        return max(0, int(match.group(1)) - age)
+
+    def __call__(self, url, method="GET", **kwargs):
+        if method != "GET":
+            return super().__call__(url, method=method, **kwargs)
+
+        # One thread refreshes while the others wait for its answer
+        with self._lock:
+            cached = self._cached.get(url)
+            if cached is not None and cached[1] > time.time():
+                return cached[0]
+            response = super().__call__(url, method=method, **kwargs)
+            if response.status == 200:
+                self._cached[url] = (response, time.time() + self._ttl(response.headers))
+            return response
+
+    def forget(self):
+        """Drop cached responses (Google rotated its keys)"""
+        with self._lock:
+            self._cached.clear()
+
+
+_transport = _CachingRequest()
+
+# sha256(token) -> (user_id, email, exp)
+_verified = LruCache(AUTH_CACHE_SIZE)
+
+
+def _verify(token: str) -> dict:
+    """Claims of a valid Google ID token for our audience (raises otherwise)"""
+    try:
+        return id_token.verify_oauth2_token(token, _transport, GOOGLE_OAUTH_AUDIENCE)
+    except ValueError as e:
+        if "Certificate for key id" not in str(e):
+            raise
+        # Signed with a key newer than our cached certs: fetch them again
+        _transport.forget()
+        return id_token.verify_oauth2_token(token, _transport, GOOGLE_OAUTH_AUDIENCE)
 
 
 def verify_google_id_token(token: str) -> Tuple[Optional[str], Optional[str]]:
@@ -22,17 +99,22 @@ def verify_google_id_token(token: str) -> Tuple[Optional[str], Optional[str]]:
         if token.startswith("Bearer "):
             token = token[7:]
         
+        # Same token as a recent request: reuse its verification until exp
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        cached = _verified.get(key)
+        if cached is not None:
+            if cached[2] > time.time():
+                return cached[0], cached[1]
+            _verified.pop(key)
+        
         # Verify the token
-        idinfo = id_token.verify_oauth2_token(
-            token,
-            requests.Request(),
-            GOOGLE_OAUTH_AUDIENCE
-        )
+        idinfo = _verify(token)
         
         # Extract user info
         user_id = idinfo.get("sub") or idinfo.get("email")
         email = idinfo.get("email")
         
+        _verified.put(key, (user_id, email, float(idinfo.get("exp", 0))))
         return user_id, email
     except Exception as e:
         # Token verification failed
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Cache lookup over a large results frame: the single-pass n-gram scorer
+against the per-threshold difflib scan it replaced
+
+    python bench/bench_cache_lookup.py [rows] [queries]
+
+Prints ms per lookup, difflib ratio() calls per lookup, and whether both
+paths picked the same rows.
+"""
+import difflib
+import os
+import random
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import cache_lookup
+from cache_lookup import MATCH_THRESHOLDS, similarity
+from catalog import _load_dict
+from settings import CAR_CATALOG_PATH
+from text_utils import normalize_text
+
+
+SUB_MODELS = ["", "האצ'בק", "סדאן", "GLI", "Hybrid", "1.6 טורבו", "סטיישן"]
+
+
+def build_frame(rng: random.Random, pairs, rows: int) -> pd.DataFrame:
+    """Results rows with some label drift: dropped year ranges, case and typos in the make"""
+    out = []
+    for _ in range(rows):
+        make, model = rng.choice(pairs)
+        if rng.random() < 0.1:
+            model = model.split(" (")[0]
+        if rng.random() < 0.03:
+            make = make.lower() + rng.choice(["", "a", " "])
+        out.append({"make": make, "model": model, "sub_model": rng.choice(SUB_MODELS),
+                    "year": rng.randint(2005, 2024), "date": "2026-10-01"})
+    return pd.DataFrame(out)
+
+
+def scan_hits(recent, year, make, model, sub_model, th):
+    """The matcher before the index: difflib over every row, per threshold"""
+    mk, md, sm = normalize_text(make), normalize_text(model), normalize_text(sub_model or "")
+    cand = recent[
+        (pd.to_numeric(recent["year"], errors="coerce").astype("Int64") == int(year)) &
+        (recent["make"].apply(lambda x: similarity(x, mk) >= th)) &
+        (recent["model"].apply(lambda x: similarity(x, md) >= th))
+    ]
+    if sm:
+        cand = cand[cand["sub_model"].apply(lambda x: similarity(x, sm) >= th)]
+    return cand
+
+
+def scan_cascade(recent, query):
+    (make, model), sub_model, year = query
+    for sub in ([sub_model, None] if sub_model else [None]):
+        for th in MATCH_THRESHOLDS:
+            hits = scan_hits(recent, year, make, model, sub, th)
+            if not hits.empty:
+                return set(hits.index), sub
+    return set(), None
+
+
+def indexed_cascade(recent, query):
+    (make, model), sub_model, year = query
+    scores = cache_lookup.score_candidates(recent, year, make, model, sub_model)
+    for sub in ([sub_model, None] if sub_model else [None]):
+        hits = cache_lookup.cascade_hits(recent, scores["row"] if sub else scores["row_no_sub"])
+        if not hits.empty:
+            return set(hits.index), sub
+    return set(), None
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    warnings.simplefilter("ignore")
+    
+    catalog = _load_dict(CAR_CATALOG_PATH)
+    if not catalog:
+        sys.exit(f"car catalog not found at {CAR_CATALOG_PATH}")
+    pairs = [(make, model) for make, models in catalog.items() for model in models if len(make) < 40]
+    
+    rng = random.Random(7)
+    recent = build_frame(rng, pairs, rows)
+    queries = [(rng.choice(pairs), rng.choice(SUB_MODELS), rng.randint(2005, 2024)) for _ in range(count)]
+    
+    calls = {"n": 0}
+    ratio = difflib.SequenceMatcher.ratio
+    
+    def counting(self):
+        calls["n"] += 1
+        return ratio(self)
+    difflib.SequenceMatcher.ratio = counting
+    
+    results = {}
+    # The indexed path runs twice: cold (first lookup fills the n-gram index) and warm
+    for name, fn in (("difflib scan", scan_cascade), ("n-gram index", indexed_cascade),
+                     ("n-gram index, warm", indexed_cascade)):
+        calls["n"] = 0
+        start = time.perf_counter()
+        results[name] = [fn(recent, q) for q in queries]
+        elapsed = (time.perf_counter() - start) / count
+        print(f"{name:20s} {elapsed * 1000:8.1f} ms/lookup {calls['n'] / count:10.1f} ratio calls/lookup")
+    
+    same = results["difflib scan"] == results["n-gram index"] == results["n-gram index, warm"]
+    print(f"rows={rows} lookups={count} identical decisions: {same}")
+
+
+if __name__ == "__main__":
+    main()
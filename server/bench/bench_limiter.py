@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Contention on the host-wide limiter: several processes acquiring quota
+from one SQLite file, as Gunicorn workers do
+
+    python bench/bench_limiter.py [processes] [acquires per process] [users]
+
+Prints granted/denied counts, throughput, and the worst per-process p50
+and p99 acquire latency. Daily caps are raised and the buckets switched off
+unless set in the environment, so every acquire is a write transaction.
+"""
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for name, value in (("GLOBAL_DAILY_LIMIT", "1000000000"), ("USER_DAILY_LIMIT", "1000000000"),
+                    ("RATE_LIMIT_USER_PER_MIN", "0"), ("RATE_LIMIT_GLOBAL_PER_MIN", "0")):
+    os.environ.setdefault(name, value)
+
+import limiter
+
+
+DAY = "2026-01-01"
+
+
+def worker(args):
+    db, count, users, offset = args
+    lim = limiter.SharedLimiter(db)
+    granted = denied = 0
+    latencies = []
+    for i in range(count):
+        user_id = users[(i + offset) % len(users)]
+        start = time.perf_counter()
+        try:
+            lim.acquire(user_id, DAY)
+            granted += 1
+        except limiter.Denied:
+            denied += 1
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return granted, denied, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    procs = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    users = [f"user{i}" for i in range(int(sys.argv[3]) if len(sys.argv) > 3 else 100)]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "limits.db")
+        limiter.SharedLimiter(db)
+        start = time.perf_counter()
+        with mp.Pool(procs) as pool:
+            results = pool.map(worker, [(db, count, users, w) for w in range(procs)])
+        elapsed = time.perf_counter() - start
+    
+    granted = sum(r[0] for r in results)
+    denied = sum(r[1] for r in results)
+    print(f"procs={procs} acquires={procs * count} granted={granted} denied={denied} "
+          f"throughput={procs * count / elapsed:.0f}/s "
+          f"p50={max(r[2] for r in results) * 1e6:.0f}us p99={max(r[3] for r in results) * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Upstream protection for model calls
+A circuit breaker per model stops calling a model that keeps failing or
+stalling, and an AIMD limit bounds how many calls a worker has in flight
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from settings import (
+    BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE, BREAKER_SLOW_SEC,
+    BREAKER_OPEN_SEC, MODEL_CONCURRENCY_MIN, MODEL_CONCURRENCY_MAX,
+)
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# The limit is halved at most once per this many seconds, so one burst of
+# failures shrinks it once
+DECREASE_COOLDOWN_SEC = 1.0
+
+
+class ModelUnavailable(RuntimeError):
+    """No model call was made: circuits open or too many calls in flight"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by error rate and latency"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self._outcomes = deque(maxlen=BREAKER_WINDOW)
+        self._lock = threading.Lock()
+
+    def _retry_after(self, now: float) -> float:
+        return max(0.0, self.opened_at + BREAKER_OPEN_SEC - now)
+
+    def allow(self):
+        """Let one call through or raise ModelUnavailable"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and self._retry_after(now) <= 0:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self.probing:
+                # One probe decides whether the model is back
+                self.probing = True
+                return
+            raise ModelUnavailable(f"{self.name} circuit {self.state}", self._retry_after(now) or 1.0)
+
+    def wait(self) -> float:
+        """Seconds until allow() would let a call through (0 if it would now)"""
+        with self._lock:
+            if self.state == OPEN:
+                return self._retry_after(time.monotonic())
+            return 1.0 if self.state == HALF_OPEN and self.probing else 0.0
+
+    def record(self, ok: bool, seconds: float = 0.0):
+        """Outcome of an allowed call; a slow success counts as a failure"""
+        failed = not ok or seconds > BREAKER_SLOW_SEC
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append(failed)
+            if (self.state == CLOSED and len(self._outcomes) >= BREAKER_MIN_CALLS
+                    and sum(self._outcomes) >= BREAKER_ERROR_RATE * len(self._outcomes)):
+                self._open()
+
+    def abandon(self):
+        """An allowed call ended without an outcome (cancelled)"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+
+    def _open(self):
+        logger.warning("Circuit for %s opened", self.name)
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "recent_failures": sum(self._outcomes), "recent_calls": len(self._outcomes)}
+
+
+class AimdLimit:
+    """
+    Concurrency limit on in-flight calls: grows by one per limit's worth of
+    healthy calls, halves on a failure or a slow call
+    """
+
+    def __init__(self, minimum: int = MODEL_CONCURRENCY_MIN, maximum: int = MODEL_CONCURRENCY_MAX):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self.rejected = 0
+        self._decreased_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot or raise ModelUnavailable"""
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                raise ModelUnavailable(f"Too many model calls in flight ({self.in_flight})", 1.0)
+            self.in_flight += 1
+
+    def release(self, ok: Optional[bool], seconds: float = 0.0):
+        """Free a slot; ok is None when the call was cancelled"""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if ok is None:
+                return
+            if ok and seconds <= BREAKER_SLOW_SEC:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            elif now - self._decreased_at >= DECREASE_COOLDOWN_SEC:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._decreased_at = now
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"limit": int(self.limit), "in_flight": self.in_flight, "rejected": self.rejected}
@@ -5,20 +5,19 @@ Cache lookup and similarity matching
 import re
 import json
 import difflib
+import threading
+import numpy as np
 import pandas as pd
-from typing import Optional, Tuple, Any, Dict
+from typing import Optional, Tuple, Any, Dict, List
 
-from settings import CACHE_MAX_DAYS
-from sheets_layer import sheet_to_df
-
-
-def normalize_text(s: Any) -> str:
-    """Normalize text for comparison"""
-    if s is None:
-        return ""
-    s = re.sub(r"\(.*?\)", " ", str(s))
-    s = re.sub(r"\s+", " ", s).strip().lower()
-    return s
+from settings import CACHE_MAX_DAYS, PARSED_CACHE_SIZE, REQUIRED_HEADERS
+from storage import get_store
+from fuzzy_index import NgramIndex
+from text_utils import normalize_text
+from frames import NORMALIZED_COLUMNS
+from lru import LruCache
+from catalog import resolve_vehicle_id
+from mileage import mileage_bucket, unadjusted_score, bucket_distance
 
 
 def similarity(a: str, b: str) -> float:
@@ -27,9 +26,12 @@ def similarity(a: str, b: str) -> float:
 
 
 def mileage_is_close(requested: str, stored: str, thr: float = 0.92) -> bool:
-    """Check if mileage ranges are similar"""
+    """Check if mileage ranges fall in the same bucket (similar text, if either has none)"""
     if requested is None or stored is None:
         return False
+    a, b = mileage_bucket(str(requested)), mileage_bucket(str(stored))
+    if a is not None and b is not None:
+        return a == b
     return similarity(str(requested), str(stored)) >= thr
 
 
@@ -59,136 +61,357 @@ def parse_year_range_from_model_label(model_label: str) -> Tuple[Optional[int],
     return (int(m.group(1)), int(m.group(2))) if m else (None, None)
 
 
-def match_hits_core(recent: pd.DataFrame, year: int, make: str, model: str, 
-                    sub_model: Optional[str], th: float) -> pd.DataFrame:
-    """Core matching logic for cache hits"""
+# N-gram indexes over the distinct normalized make/model/sub_model strings
+_fuzzy: Dict[str, NgramIndex] = {
+    "make": NgramIndex(),
+    "model": NgramIndex(),
+    "sub_model": NgramIndex(),
+}
+
+
+# Similarity thresholds tried in order (strict first)
+MATCH_THRESHOLDS = (0.97, 0.93)
+
+
+def column_scores(frame: pd.DataFrame, column: str, query: str, floor: float) -> pd.Series:
+    """
+    Similarity of each row's normalized value to the normalized query
+    Each distinct value is scored once, and the scores are mapped back onto
+    the rows; the n-gram index skips values that cannot reach floor, and
+    those score 0. Uses the precomputed <column>_norm column when present.
+    """
+    idx = _fuzzy[column]
+    norm_col = NORMALIZED_COLUMNS[column]
+    
+    if norm_col in frame.columns:
+        values = frame[norm_col]
+    else:
+        raw = frame[column]
+        values = raw.map({v: normalize_text(v) for v in raw.unique()})
+    
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        cats = values.cat.categories
+        for c in cats:
+            idx.add(c)
+        scores = idx.matches(query, floor)
+        by_code = np.array([scores.get(c, 0.0) for c in cats] + [0.0])
+        # Code -1 (missing) picks the trailing 0.0
+        return pd.Series(by_code[values.cat.codes.to_numpy()], index=frame.index)
+    
+    for norm in values.unique():
+        idx.add(norm)
+    scores = idx.matches(query, floor)
+    return values.map(scores).fillna(0.0).astype(float)
+
+
+def score_candidates(recent: pd.DataFrame, year: int, make: str, model: str,
+                     sub_model: Optional[str], floor: float = min(MATCH_THRESHOLDS)) -> pd.DataFrame:
+    """
+    Score every row against the request in a single pass
+    Returns a frame aligned with recent: per-column scores, "row" (the
+    weakest of make/model/sub_model, the score a row must clear) and
+    "row_no_sub" (make/model only, for the fallback). Rows of another
+    year score 0.
+    """
     mk, md, sm = normalize_text(make), normalize_text(model), normalize_text(sub_model or "")
-    use_sub = len(sm) > 0
     
-    cand = recent[
-        (pd.to_numeric(recent["year"], errors="coerce").astype("Int64") == int(year)) &
-        (recent["make"].apply(lambda x: similarity(x, mk) >= th)) &
-        (recent["model"].apply(lambda x: similarity(x, md) >= th))
-    ]
+    year_ok = pd.to_numeric(recent["year"], errors="coerce").astype("Int64") == int(year)
+    scores = pd.DataFrame(index=recent.index)
+    scores["make"] = column_scores(recent, "make", mk, floor)
+    scores["model"] = column_scores(recent, "model", md, floor)
+    scores["row_no_sub"] = scores[["make", "model"]].min(axis=1).where(year_ok.fillna(False), 0.0)
     
-    if use_sub and "sub_model" in recent.columns:
-        cand = cand[cand["sub_model"].apply(lambda x: similarity(x, sm) >= th)]
+    if sm and "sub_model" in recent.columns:
+        scores["sub_model"] = column_scores(recent, "sub_model", sm, floor)
+        scores["row"] = scores[["row_no_sub", "sub_model"]].min(axis=1)
+    else:
+        scores["row"] = scores["row_no_sub"]
     
+    return scores
+
+
+def _sorted_by_date(cand: pd.DataFrame) -> pd.DataFrame:
+    """Candidates oldest first"""
+    cand = cand.copy()
     if "date" in cand.columns:
         try:
             cand["date"] = pd.to_datetime(cand["date"], errors="coerce")
             cand = cand.sort_values("date")
         except Exception:
             pass
-    
     return cand
 
 
-def get_cached_from_sheet(make: str, model: str, sub_model: str, year: int, 
-                         mileage_range: str, max_days: int = CACHE_MAX_DAYS) -> Tuple[Optional[dict], pd.DataFrame, bool, bool]:
+def cascade_hits(recent: pd.DataFrame, scores: pd.Series) -> pd.DataFrame:
+    """Rows at the strictest threshold that has any hit"""
+    for th in MATCH_THRESHOLDS:
+        cand = recent[scores >= th]
+        if not cand.empty:
+            return _sorted_by_date(cand)
+    return recent.iloc[0:0]
+
+
+def match_hits_core(recent: pd.DataFrame, year: int, make: str, model: str, 
+                    sub_model: Optional[str], th: float) -> pd.DataFrame:
+    """Core matching logic for cache hits"""
+    scores = score_candidates(recent, year, make, model, sub_model, floor=th)
+    return _sorted_by_date(recent[scores["row"] >= th])
+
+
+def row_to_parsed(r: dict) -> dict:
     """
-    Search for cached results in Google Sheet
-    Returns: (parsed_row, df, used_fallback, mileage_matched)
+    Turn a stored row into an AnalysisResult payload (parses the JSON columns)
+    Rows hold the score as adjusted for their own mileage; the payload holds
+    the un-adjusted base score, to be adjusted for the requested mileage
     """
-    df = sheet_to_df()
+    score_breakdown = safe_json_parse(r.get("score_breakdown"), {}) or {}
+    issues_with_costs = safe_json_parse(r.get("issues_with_costs"), []) or []
+    recommended_checks = safe_json_parse(r.get("recommended_checks"), []) or []
+    competitors = safe_json_parse(r.get("common_competitors_brief"), []) or []
+    sources = safe_json_parse(r.get("sources"), []) or r.get("sources", "")
     
-    if df.empty:
-        return None, df, False, False
+    base_calc = r.get("base_score_calculated")
+    if base_calc in [None, "", "nan"]:
+        legacy_base = r.get("base_score")
+        try:
+            base_calc = int(round(float(legacy_base)))
+        except Exception:
+            base_calc = None
+    base_calc = unadjusted_score(base_calc, r.get("mileage_range", ""))
     
+    issues_raw = r.get("issues", [])
+    if isinstance(issues_raw, str) and issues_raw:
+        if ";" in issues_raw:
+            issues_list = [x.strip() for x in issues_raw.split(";") if x.strip()]
+        elif "," in issues_raw:
+            issues_list = [x.strip() for x in issues_raw.split(",") if x.strip()]
+        else:
+            issues_list = [issues_raw.strip()]
+    elif isinstance(issues_raw, list):
+        issues_list = [str(x).strip() for x in issues_raw if str(x).strip()]
+    else:
+        issues_list = []
+    
+    last_dt = r.get("date")
+    last_date_str = ""
+    if isinstance(last_dt, pd.Timestamp):
+        last_date_str = str(last_dt.date())
+    elif last_dt:
+        last_date_str = str(last_dt)[:10]
+    
+    return {
+        "score_breakdown": score_breakdown,
+        "base_score_calculated": base_calc,
+        "common_issues": issues_list,
+        "avg_repair_cost_ILS": r.get("avg_cost"),
+        "issues_with_costs": issues_with_costs,
+        "reliability_summary": r.get("reliability_summary") or "",
+        "sources": sources if isinstance(sources, list) else [sources] if sources else [],
+        "recommended_checks": recommended_checks,
+        "common_competitors_brief": competitors,
+        "last_date": last_date_str,
+        "cached_mileage_range": r.get("mileage_range", "")
+    }
+
+
+# Parsed payloads of stored rows, so popular hits skip JSON parsing/repair
+_parsed_rows = LruCache(PARSED_CACHE_SIZE)
+
+
+def row_identity(r: dict) -> int:
+    """Identity of a stored row, stable across typed and raw representations"""
+    parts = []
+    for h in REQUIRED_HEADERS:
+        v = r.get(h, "")
+        if h == "date":
+            v = str(v)[:10] if not pd.isna(v) else ""
+        elif h == "year":
+            try:
+                v = int(float(v))
+            except Exception:
+                v = ""
+        parts.append(str(v))
+    return hash(tuple(parts))
+
+
+def parsed_row(r: dict) -> dict:
+    """Memoized row_to_parsed(); returns a fresh top-level dict on every call"""
+    key = row_identity(r)
+    parsed = _parsed_rows.get(key)
+    if parsed is None:
+        parsed = row_to_parsed(r)
+        _parsed_rows.put(key, parsed)
+    return dict(parsed)
+
+
+def _row_year(value) -> Optional[int]:
+    """Model year of a stored row as int"""
     try:
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        df["year"] = pd.to_numeric(df["year"], errors="coerce").astype("Int64")
+        return int(float(value))
     except Exception:
-        pass
+        return None
+
+
+# Exact-match index over all stored rows, keyed by catalog vehicle ID when
+# the make/model resolves and by normalized text otherwise:
+# (vehicle, sub_model, year) and (vehicle, year) -> row records
+_exact_lock = threading.Lock()
+_exact_version: Optional[int] = None
+_exact_full: Dict[tuple, List[dict]] = {}
+_exact_partial: Dict[tuple, List[dict]] = {}
+
+
+def vehicle_key(make: Any, model: Any) -> tuple:
+    """Cache key of a make/model: its catalog ID, else its normalized text"""
+    vid = resolve_vehicle_id(make, model)
+    if vid is not None:
+        return (vid,)
+    return (normalize_text(make), normalize_text(model))
+
+
+def _index_rows(df: pd.DataFrame, parse: bool = False, into: Optional[tuple] = None):
+    """
+    Add stored rows to the exact-match index (caller holds _exact_lock)
+    With parse=True (newly appended rows) their payloads are parsed up front;
+    into=(full, partial, fuzzy) fills new indexes instead of the live ones
+    """
+    full, partial, fuzzy = into or (_exact_full, _exact_partial, _fuzzy)
+    for r in df.to_dict("records"):
+        if parse:
+            try:
+                parsed_row(r)
+            except Exception:
+                pass
+        year = _row_year(r.get("year"))
+        if year is None:
+            continue
+        if "make_norm" in r:
+            mk, md, sm = r["make_norm"], r["model_norm"], r["sub_model_norm"]
+        else:
+            mk, md = normalize_text(r.get("make")), normalize_text(r.get("model"))
+            sm = normalize_text(r.get("sub_model") or "")
+        fuzzy["make"].add(mk)
+        fuzzy["model"].add(md)
+        fuzzy["sub_model"].add(sm)
+        vk = vehicle_key(r.get("make"), r.get("model"))
+        full.setdefault((vk, sm, year), []).append(r)
+        partial.setdefault((vk, year), []).append(r)
+
+
+def _refresh_exact_index(store):
+    """Bring the exact-match index up to the store's (or request context's) version"""
+    global _exact_version, _exact_full, _exact_partial, _fuzzy
+    
+    with _exact_lock:
+        version = store.version()
+        # A request context may hold a version older than the index already is
+        if _exact_version is not None and version <= _exact_version:
+            return
+        
+        delta = store.results_since(_exact_version, version) if _exact_version is not None else None
+        if delta is None:
+            # Build new indexes and swap them in: column_scores() may be
+            # using the current fuzzy index without holding _exact_lock
+            full, partial = {}, {}
+            fuzzy = {column: NgramIndex() for column in _fuzzy}
+            _index_rows(store.load_results(), into=(full, partial, fuzzy))
+            _exact_full, _exact_partial, _fuzzy = full, partial, fuzzy
+        else:
+            _index_rows(delta, parse=True)
+        _exact_version = version
+
+
+def exact_hits(year: int, make: str, model: str, sub_model: Optional[str],
+               cutoff: pd.Timestamp, ctx=None) -> pd.DataFrame:
+    """O(1) lookup of rows of the same vehicle and year (and sub_model, if given)"""
+    _refresh_exact_index(ctx or get_store())
     
+    vk, sm = vehicle_key(make, model), normalize_text(sub_model or "")
+    with _exact_lock:
+        if sm:
+            rows = list(_exact_full.get((vk, sm, int(year)), []))
+        else:
+            rows = list(_exact_partial.get((vk, int(year)), []))
+    
+    if not rows:
+        return pd.DataFrame()
+    
+    hits = pd.DataFrame(rows)
+    hits = hits[pd.to_datetime(hits["date"], errors="coerce") >= cutoff]
+    return hits.sort_values("date")
+
+
+def get_cached_from_sheet(make: str, model: str, sub_model: str, year: int, 
+                         mileage_range: str, max_days: int = CACHE_MAX_DAYS,
+                         ctx=None, stale_days: int = 0) -> Tuple[Optional[dict], pd.DataFrame, bool, bool]:
+    """
+    Search for cached results in the results store (through ctx, if given)
+    With stale_days, a miss among fresh rows falls back to rows up to
+    stale_days older, and the result is marked "stale"
+    Returns: (parsed_row, df, used_fallback, mileage_matched)
+    """
+    source = ctx or get_store()
     cutoff = pd.Timestamp.now() - pd.Timedelta(days=max_days)
-    recent = df[df["date"] >= cutoff] if "date" in df.columns else df
+    stale_cutoff = cutoff - pd.Timedelta(days=max(0, stale_days))
     
     used_fallback = False
     mileage_matched = False
+    df = pd.DataFrame()
+    loaded = None
+    scores = None
+    
+    def load_recent() -> pd.DataFrame:
+        # Rows are dated by day, so the first whole day after the cutoff
+        df = source.recent_results(year, stale_cutoff.ceil("D").date())
+        return df[df["date"] >= stale_cutoff]
     
-    # Try matching with sub_model
-    hits = pd.DataFrame()
-    for th in (0.97, 0.93):
-        hits = match_hits_core(recent, year, make, model, sub_model, th)
+    def find_hits(sub: Optional[str], since: pd.Timestamp) -> pd.DataFrame:
+        nonlocal df, loaded, scores
+        # Exact keys first; fuzzy matching only on a miss
+        hits = exact_hits(year, make, model, sub, since, ctx)
         if not hits.empty:
-            break
+            return hits
+        if loaded is None:
+            loaded = load_recent()
+        recent = loaded[loaded["date"] >= since] if since > stale_cutoff else loaded
+        df = recent
+        if recent.empty:
+            return recent
+        # One score table (over the stale window too) serves every step
+        if scores is None:
+            scores = score_candidates(loaded, year, make, model, sub_model)
+        column = scores["row"] if sub else scores["row_no_sub"]
+        return cascade_hits(recent, column.loc[recent.index])
     
-    # Fallback without sub_model
-    if hits.empty and sub_model:
-        used_fallback = True
-        for th in (0.97, 0.93):
-            hits = match_hits_core(recent, year, make, model, None, th)
-            if not hits.empty:
-                break
+    def search(since: pd.Timestamp) -> Tuple[pd.DataFrame, bool]:
+        # Try matching with sub_model, then fall back without it
+        hits = find_hits(sub_model, since)
+        if hits.empty and sub_model:
+            return find_hits(None, since), True
+        return hits, False
+    
+    hits, used_fallback = search(cutoff)
+    stale = False
+    if hits.empty and stale_cutoff < cutoff:
+        hits, used_fallback = search(stale_cutoff)
+        stale = not hits.empty
     
     if hits.empty:
         return None, df, used_fallback, mileage_matched
     
     req_mil = str(mileage_range or "")
     
-    def row_mil_sim(row):
-        stored = str(row.get("mileage_range", "") or "")
-        return similarity(req_mil, stored)
-    
+    # Any mileage serves: the nearest bucket first, newest among equals
     hits = hits.copy()
-    hits["__mil_sim"] = hits.apply(row_mil_sim, axis=1)
-    hits = hits.sort_values(["__mil_sim", "date"], ascending=[False, False])
+    hits["__mil_dist"] = hits["mileage_range"].astype(str).map(lambda stored: bucket_distance(req_mil, stored))
+    hits = hits.sort_values(["__mil_dist", "date"], ascending=[True, False])
     
     best = hits.iloc[0]
     mileage_matched = mileage_is_close(req_mil, best.get("mileage_range", ""))
     
-    def row_to_parsed(r: dict):
-        score_breakdown = safe_json_parse(r.get("score_breakdown"), {}) or {}
-        issues_with_costs = safe_json_parse(r.get("issues_with_costs"), []) or []
-        recommended_checks = safe_json_parse(r.get("recommended_checks"), []) or []
-        competitors = safe_json_parse(r.get("common_competitors_brief"), []) or []
-        sources = safe_json_parse(r.get("sources"), []) or r.get("sources", "")
-        
-        base_calc = r.get("base_score_calculated")
-        if base_calc in [None, "", "nan"]:
-            legacy_base = r.get("base_score")
-            try:
-                base_calc = int(round(float(legacy_base)))
-            except Exception:
-                base_calc = None
-        
-        issues_raw = r.get("issues", [])
-        if isinstance(issues_raw, str) and issues_raw:
-            if ";" in issues_raw:
-                issues_list = [x.strip() for x in issues_raw.split(";") if x.strip()]
-            elif "," in issues_raw:
-                issues_list = [x.strip() for x in issues_raw.split(",") if x.strip()]
-            else:
-                issues_list = [issues_raw.strip()]
-        elif isinstance(issues_raw, list):
-            issues_list = [str(x).strip() for x in issues_raw if str(x).strip()]
-        else:
-            issues_list = []
-        
-        last_dt = r.get("date")
-        last_date_str = ""
-        if isinstance(last_dt, pd.Timestamp):
-            last_date_str = str(last_dt.date())
-        elif last_dt:
-            last_date_str = str(last_dt)[:10]
-        
-        return {
-            "score_breakdown": score_breakdown,
-            "base_score_calculated": base_calc,
-            "common_issues": issues_list,
-            "avg_repair_cost_ILS": r.get("avg_cost"),
-            "issues_with_costs": issues_with_costs,
-            "reliability_summary": r.get("reliability_summary") or "",
-            "sources": sources if isinstance(sources, list) else [sources] if sources else [],
-            "recommended_checks": recommended_checks,
-            "common_competitors_brief": competitors,
-            "last_date": last_date_str,
-            "cached_mileage_range": r.get("mileage_range", "")
-        }
-    
-    parsed_row = row_to_parsed(best.to_dict())
-    parsed_row["is_aggregate"] = False
-    parsed_row["count"] = int(len(hits))
-    
-    return parsed_row, df, used_fallback, mileage_matched
+    result = parsed_row(best.to_dict())
+    result["is_aggregate"] = False
+    result["count"] = int(len(hits))
+    result["stale"] = stale
+    
+    return result, df, used_fallback, mileage_matched
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Vehicle catalog - canonical vehicle IDs from car_models_dict
+Every normalized make/model alias resolves to a compact integer ID, so
+requests and stored rows labelled "Model (years)", "Model" or either half
+of "A / B" land on the same cache key. The production years of each label
+are indexed too, so impossible requests are rejected before any I/O
+"""
+import os
+import re
+import datetime
+import threading
+import importlib.util
+from typing import Optional, Dict, List, Set, Tuple
+
+from settings import CAR_CATALOG_PATH, CATALOG_STRICT_MAKES
+from text_utils import normalize_text
+
+
+_catalog_lock = threading.Lock()
+_loaded = False
+# vehicle_id -> (make, model label)
+_vehicles: List[Tuple[str, str]] = []
+# (normalized make, normalized model alias) -> vehicle_id, None when ambiguous
+_aliases: Dict[Tuple[str, str], Optional[int]] = {}
+# vehicle_id -> production year ranges (end None = still made); empty when unknown
+_years: List[Tuple[Tuple[int, Optional[int]], ...]] = []
+_makes: Set[str] = set()
+
+# Oldest model year accepted for any vehicle
+MIN_YEAR = 1900
+
+_YEARS_RE = re.compile(r"\(([^()]*)\)\s*$")
+_RANGE_RE = re.compile(r"(\d{4})\s*-\s*(\d{4})?(?!\d)")
+
+
+def _load_dict(path: str) -> dict:
+    """Import israeli_car_market_full_compilation from a file path"""
+    if not path or not os.path.exists(path):
+        return {}
+    spec = importlib.util.spec_from_file_location("car_models_dict", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, "israeli_car_market_full_compilation", {}) or {}
+
+
+def model_aliases(label: str) -> List[str]:
+    """Normalized names a model label is known by: the full label, then each half of 'A / B'"""
+    full = normalize_text(label)
+    aliases = [full] if full else []
+    if "/" in full:
+        aliases += [p.strip() for p in full.split("/") if p.strip()]
+    return aliases
+
+
+def parse_year_ranges(label: str) -> List[Tuple[int, Optional[int]]]:
+    """
+    Production years of a label like 'Colt (1962-2012, 2023-2025)' or 'EV3 (2025-)'
+    Returns [(start, end)], end None when open; [] if the label has no years
+    """
+    m = _YEARS_RE.search(str(label))
+    if not m:
+        return []
+    return [(int(a), int(b) if b else None) for a, b in _RANGE_RE.findall(m.group(1))]
+
+
+def _build(catalog: dict):
+    """Assign vehicle IDs and index their aliases and years"""
+    vehicles, years, full, partial = [], [], {}, {}
+    for make, labels in catalog.items():
+        mk = normalize_text(make)
+        for label in labels:
+            vid = len(vehicles)
+            vehicles.append((make, label))
+            years.append(parse_year_ranges(label))
+            names = model_aliases(label)
+            if not names:
+                continue
+            full.setdefault((mk, names[0]), vid)
+            for alias in names[1:]:
+                key = (mk, alias)
+                # A partial alias shared by two models resolves to neither
+                partial[key] = vid if partial.get(key, vid) == vid else None
+    
+    # Full labels win over partial aliases
+    partial.update(full)
+    
+    # A range ending in the catalog's latest year is still in production
+    latest = max((end for ranges in years for _, end in ranges if end), default=0)
+    years = [tuple((start, None if end is None or end >= latest else end) for start, end in ranges)
+             for ranges in years]
+    makes = {normalize_text(make) for make in catalog}
+    return vehicles, years, partial, makes
+
+
+def ensure_loaded():
+    """Load the catalog once per process"""
+    global _loaded, _vehicles, _years, _aliases, _makes
+    
+    if _loaded:
+        return
+    with _catalog_lock:
+        if _loaded:
+            return
+        try:
+            catalog = _load_dict(CAR_CATALOG_PATH)
+        except Exception:
+            catalog = {}
+        _vehicles, _years, _aliases, _makes = _build(catalog)
+        _loaded = True
+
+
+def resolve_vehicle_id(make: str, model: str) -> Optional[int]:
+    """Canonical vehicle ID of a make/model pair, or None if it is not in the catalog"""
+    ensure_loaded()
+    return _aliases.get((normalize_text(make), normalize_text(model)))
+
+
+def vehicle_label(vehicle_id: int) -> Optional[Tuple[str, str]]:
+    """(make, model label) of a vehicle ID"""
+    ensure_loaded()
+    if 0 <= vehicle_id < len(_vehicles):
+        return _vehicles[vehicle_id]
+    return None
+
+
+def validate_vehicle(make: str, model: str, year: int) -> Optional[str]:
+    """
+    Reason a make/model/year cannot exist, or None if it may
+    Models missing from the catalog pass; unknown makes pass unless
+    CATALOG_STRICT_MAKES is set
+    """
+    ensure_loaded()
+    this_year = datetime.date.today().year
+    if not MIN_YEAR <= year <= this_year + 1:
+        return f"Year must be between {MIN_YEAR} and {this_year + 1}."
+    
+    mk = normalize_text(make)
+    if mk not in _makes:
+        if CATALOG_STRICT_MAKES and _makes:
+            return f"Unknown make: {make}."
+        return None
+    
+    vid = _aliases.get((mk, normalize_text(model)))
+    if vid is None or not _years[vid]:
+        return None
+    for start, end in _years[vid]:
+        # Next year's models go on sale this year
+        if start - 1 <= year <= (end if end is not None else this_year + 1):
+            return None
+    make_name, label = _vehicles[vid]
+    return f"{make_name} {label} was not made in {year}."
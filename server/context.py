@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Request-scoped view of the results store
+Created once per request; every stage reads through it, so the store
+version is fetched once and repeated reads are served from memory
+"""
+import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import pandas as pd
+
+from storage import ResultsStore, get_store
+
+
+class RequestContext:
+    """
+    One consistent snapshot of storage for a single request
+    Quacks like a read-only ResultsStore pinned to the version seen first
+    """
+
+    def __init__(self, user_id: str, store: Optional[ResultsStore] = None):
+        self.user_id = user_id
+        self.store = store or get_store()
+        self.today = datetime.date.today().isoformat()
+        # (user_count, global_count) for today once a stage has read them
+        self.quota: Optional[Tuple[int, int]] = None
+        self.storage_reads = 0
+        self._version: Optional[int] = None
+        self._memo: Dict[tuple, Any] = {}
+
+    def _read(self, key: tuple, func: Callable, *args) -> Any:
+        """Call the store once per key"""
+        if key not in self._memo:
+            self.storage_reads += 1
+            self._memo[key] = func(*args)
+        return self._memo[key]
+
+    def version(self) -> int:
+        if self._version is None:
+            self.storage_reads += 1
+            self._version = self.store.version()
+        return self._version
+
+    def results_since(self, version: int, until: Optional[int] = None) -> Optional[pd.DataFrame]:
+        until = self.version() if until is None else until
+        return self._read(("since", version, until), self.store.results_since, version, until)
+
+    def load_results(self) -> pd.DataFrame:
+        return self._read(("all",), self.store.load_results)
+
+    def day_results(self, day: str) -> pd.DataFrame:
+        return self._read(("day", day), self.store.day_results, day)
+
+    def recent_results(self, year: int, since) -> pd.DataFrame:
+        return self._read(("recent", int(year), str(since)), self.store.recent_results, year, since)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Typed results frame shared by the storage backends
+Dates, years and normalized text are derived once when rows are ingested,
+so request handlers never re-parse them
+"""
+import pandas as pd
+
+from text_utils import normalize_text
+
+
+# Source column -> precomputed normalized-text column
+NORMALIZED_COLUMNS = {
+    "make": "make_norm",
+    "model": "model_norm",
+    "sub_model": "sub_model_norm",
+}
+
+CATEGORICAL_COLUMNS = ["make", "model", "make_norm", "model_norm", "sub_model_norm"]
+
+
+def type_results(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add typed columns to freshly ingested rows (in place)
+    date -> datetime64, year -> Int64, plus normalized make/model/sub_model
+    """
+    df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    df["year"] = pd.to_numeric(df["year"], errors="coerce").astype("Int64")
+    for col, norm in NORMALIZED_COLUMNS.items():
+        values = df[col] if col in df.columns else pd.Series("", index=df.index)
+        norm_map = {raw: normalize_text(raw) for raw in values.unique()}
+        df[norm] = values.map(norm_map)
+    return df
+
+
+def categorize(df: pd.DataFrame) -> pd.DataFrame:
+    """Store the repetitive text columns as categoricals (in place)"""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(str).astype("category")
+    return df
+
+
+def is_typed(df: pd.DataFrame) -> bool:
+    """Whether a frame already carries the typed columns"""
+    return all(c in df.columns for c in NORMALIZED_COLUMNS.values())
+
+
+def day_mask(df: pd.DataFrame, day: str) -> pd.Series:
+    """Rows dated on an ISO day"""
+    if pd.api.types.is_datetime64_any_dtype(df["date"]):
+        return df["date"] == pd.Timestamp(day)
+    return df["date"].astype(str).str[:10] == day
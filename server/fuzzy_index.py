@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Character n-gram inverted index for fuzzy string matching
+Prunes candidates by shared n-grams, then rescores the survivors with the
+same difflib ratio the cache matcher has always used
+"""
+import difflib
+import threading
+from collections import Counter
+from typing import Dict, List, Set
+
+
+PAD = "\x00"
+
+
+def ngrams(s: str, n: int = 3) -> Counter:
+    """Padded character n-grams of a string (multiset)"""
+    padded = PAD * (n - 1) + s + PAD * (n - 1)
+    return Counter(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+def ratio(a: str, b: str) -> float:
+    """difflib similarity ratio of two (already normalized) strings"""
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def min_shared_ngrams(len_a: int, len_b: int, threshold: float, n: int = 3) -> int:
+    """
+    Lower bound on shared n-grams of two strings whose ratio is >= threshold
+    ratio = 2M/(|a|+|b|) and M <= LCS, so turning a into b takes at most
+    d = (1 - threshold)(|a|+|b|) insertions/deletions, and each destroys at
+    most n of the |a|+n-1 padded n-grams of a
+    """
+    d = int((1.0 - threshold) * (len_a + len_b) + 1e-9)
+    return max(0, (len_a + n - 1) - n * d)
+
+
+class NgramIndex:
+    """Inverted index from n-grams to the distinct strings containing them"""
+
+    def __init__(self, n: int = 3):
+        self.n = n
+        self._lock = threading.Lock()
+        self._grams: Dict[str, Counter] = {}
+        self._postings: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    def __contains__(self, value: str) -> bool:
+        return value in self._grams
+
+    def add(self, value: str):
+        """Index a distinct value (no-op if already indexed)"""
+        if value in self._grams:
+            return
+        grams = ngrams(value, self.n)
+        with self._lock:
+            if value in self._grams:
+                return
+            self._grams[value] = grams
+            for g in grams:
+                self._postings.setdefault(g, set()).add(value)
+
+    def clear(self):
+        """Drop every indexed value"""
+        with self._lock:
+            self._grams.clear()
+            self._postings.clear()
+
+    def candidates(self, query: str, threshold: float) -> List[str]:
+        """
+        Indexed values that can reach threshold against query, most shared
+        n-grams first; every value scoring >= threshold is included
+        """
+        q_grams = ngrams(query, self.n)
+        shared: Counter = Counter()
+
+        with self._lock:
+            for g, cnt in q_grams.items():
+                for value in self._postings.get(g, ()):
+                    shared[value] += min(cnt, self._grams[value][g])
+
+            # Below 6/7 the bound can drop to zero for strings that pass the
+            # length filter, so values sharing no n-gram must be checked too
+            if threshold < 6.0 / 7.0:
+                for value in self._grams:
+                    shared.setdefault(value, 0)
+
+        q_len = len(query)
+        out = []
+        for value, cnt in shared.most_common():
+            v_len = len(value)
+            # Length filter: ratio <= 2*min/(|a|+|b|)
+            if q_len + v_len and 2.0 * min(q_len, v_len) / (q_len + v_len) < threshold:
+                continue
+            if cnt < max(min_shared_ngrams(q_len, v_len, threshold, self.n),
+                         min_shared_ngrams(v_len, q_len, threshold, self.n)):
+                continue
+            out.append(value)
+        return out
+
+    def matches(self, query: str, threshold: float) -> Dict[str, float]:
+        """Indexed values whose ratio against query is >= threshold, with the ratio"""
+        scored = {}
+        for value in self.candidates(query, threshold):
+            r = ratio(query, value)
+            if r >= threshold:
+                scored[value] = r
+        return scored
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Managed thread pool for blocking I/O (Sheets, SQL, OAuth)
+Keeps synchronous clients off the event loop
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any, Dict
+
+from settings import IO_POOL_SIZE
+
+
+_executor = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="blocking-io")
+
+_stats_lock = threading.Lock()
+_stats = {"submitted": 0, "running": 0, "completed": 0, "failed": 0}
+
+
+def _tracked(func: Callable, *args, **kwargs) -> Any:
+    """Run func on a pool thread, keeping the counters current"""
+    with _stats_lock:
+        _stats["running"] += 1
+    try:
+        result = func(*args, **kwargs)
+    except BaseException:
+        with _stats_lock:
+            _stats["failed"] += 1
+        raise
+    finally:
+        with _stats_lock:
+            _stats["running"] -= 1
+            _stats["completed"] += 1
+    return result
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Await a blocking call executed on the I/O pool"""
+    with _stats_lock:
+        _stats["submitted"] += 1
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(_tracked, func, *args, **kwargs))
+
+
+def pool_stats() -> Dict[str, int]:
+    """Pool size, running calls and queue depth"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["size"] = IO_POOL_SIZE
+    stats["queued"] = max(0, stats["submitted"] - stats["completed"] - stats["running"])
+    return stats
+
+
+def shutdown_pool():
+    """Stop accepting work and let running calls finish"""
+    _executor.shutdown(wait=False)
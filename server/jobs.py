@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Durable queue of model analyses shared by web and model-worker processes
+Jobs live in one SQLite (WAL) file on the host; a web worker enqueues a
+cache miss and answers 202, a model worker claims it under a lease, and
+clients poll the job until it is done
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from settings import JOB_DB, JOB_TTL_SEC, JOB_REUSE_SEC, JOB_MAX_ATTEMPTS, MODEL_TOTAL_TIMEOUT_SEC
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# A claimed job is handed to another worker if not finished by then
+LEASE_SEC = MODEL_TOTAL_TIMEOUT_SEC + 30
+
+
+class JobQueue:
+    """Jobs table with atomic enqueue (deduplicated by key) and claim"""
+
+    def __init__(self, path: str = JOB_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, key TEXT NOT NULL, user_id TEXT NOT NULL, request TEXT NOT NULL, "
+            "status TEXT NOT NULL, result TEXT, error TEXT, status_code INTEGER, "
+            "attempts INTEGER NOT NULL DEFAULT 0, lease_until REAL, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection of the calling thread (autocommit, explicit transactions)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _reusable(conn: sqlite3.Connection, key: str, now: float) -> Optional[Tuple[str, str]]:
+        """
+        (id, status) of the queued or running job for key, else of one done
+        within JOB_REUSE_SEC (its saved row may not have reached every worker)
+        """
+        row = conn.execute(
+            "SELECT id, status FROM jobs WHERE key = ? AND (status IN (?, ?) OR (status = ? AND updated >= ?)) "
+            "ORDER BY status = ?, created DESC LIMIT 1",
+            (key, QUEUED, RUNNING, DONE, now - JOB_REUSE_SEC, DONE)
+        ).fetchone()
+        return (row["id"], row["status"]) if row else None
+
+    def active(self, key: str) -> Optional[Tuple[str, str]]:
+        """(id, status) of the job answering key, if any (see _reusable)"""
+        return self._reusable(self._connect(), key, time.time())
+
+    def enqueue(self, key: str, user_id: str, request: dict) -> Tuple[str, str, bool]:
+        """
+        Queue a job unless one for key is already queued, running or just done
+        Returns (job_id, status, created)
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = self._reusable(conn, key, now)
+            if existing is not None:
+                conn.execute("COMMIT")
+                return existing + (False,)
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, key, user_id, request, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, key, user_id, json.dumps(request, ensure_ascii=False), QUEUED, now, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id, QUEUED, True
+
+    def claim(self) -> Tuple[Optional[sqlite3.Row], List[sqlite3.Row]]:
+        """
+        Take the oldest queued job (or one whose worker lost its lease)
+        Returns (job, abandoned); abandoned jobs ran out of attempts and are
+        now failed, so their owner's reservation should be released
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            abandoned = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (RUNNING, now, JOB_MAX_ATTEMPTS)
+            ).fetchall()
+            for job in abandoned:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, status_code = 503, updated = ? WHERE id = ?",
+                    (FAILED, "Model worker stopped before finishing", now, job["id"])
+                )
+            job = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY created LIMIT 1",
+                (QUEUED, RUNNING, now)
+            ).fetchone()
+            if job is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated = ? WHERE id = ?",
+                    (RUNNING, now + LEASE_SEC, now, job["id"])
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job, abandoned
+
+    def finish(self, job_id: str, result: Optional[dict] = None, error: Optional[str] = None,
+               status_code: int = 200):
+        """Record the outcome of a claimed job"""
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, status_code = ?, lease_until = NULL, updated = ? "
+            "WHERE id = ?",
+            (DONE if error is None else FAILED,
+             None if result is None else json.dumps(result, ensure_ascii=False),
+             error, status_code, time.time(), job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[sqlite3.Row]:
+        return self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def prune(self):
+        """Drop finished jobs older than JOB_TTL_SEC"""
+        self._connect().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+            (DONE, FAILED, time.time() - JOB_TTL_SEC)
+        )
+
+    def stats(self) -> dict:
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    """Job queue of this host (opened on first use)"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental parsing of a streamed JSON object
+Text arrives in arbitrary chunks; each top-level field is returned as soon
+as its value is complete, long before the closing brace
+"""
+import json
+from typing import Any, List, Tuple
+
+from json_repair import repair_json
+
+
+def _load(raw: str) -> Any:
+    """Parse one JSON value (repairing it if needed)"""
+    try:
+        return json.loads(raw)
+    except Exception:
+        try:
+            return json.loads(repair_json(raw))
+        except Exception:
+            return raw
+
+
+class JsonFieldStream:
+    """
+    Top-level fields of one JSON object, in arrival order
+    Text before the opening brace (such as a ```json fence) is skipped
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.state = "start"      # start, key, colon, value, done
+        self.key = None
+        self.value_start = None
+        self.depth = 0
+        self.in_str = False
+        self.escaped = False
+        self.fields = {}
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    def _string_end(self, start: int) -> int:
+        """Index of the quote closing the string opened at start, or -1"""
+        i = start + 1
+        while i < len(self.buf):
+            c = self.buf[i]
+            if c == "\\":
+                i += 2
+                continue
+            if c == '"':
+                return i
+            i += 1
+        return -1
+
+    def _emit(self, end: int, out: List[Tuple[str, Any]]):
+        value = _load(self.buf[self.value_start:end].strip())
+        self.fields[self.key] = value
+        out.append((self.key, value))
+        self.key = None
+        self.value_start = None
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """Add text; returns the (name, value) pairs it completed"""
+        self.buf += text
+        out = []
+        buf = self.buf
+
+        while self.pos < len(buf) and self.state != "done":
+            c = buf[self.pos]
+
+            if self.state == "start":
+                if c == "{":
+                    self.state = "key"
+                self.pos += 1
+
+            elif self.state == "key":
+                if c == '"':
+                    end = self._string_end(self.pos)
+                    if end < 0:
+                        break  # key not complete yet
+                    self.key = _load(buf[self.pos:end + 1])
+                    self.pos = end + 1
+                    self.state = "colon"
+                else:
+                    if c == "}":
+                        self.state = "done"
+                    self.pos += 1
+
+            elif self.state == "colon":
+                if c == ":":
+                    self.state = "value"
+                    self.depth, self.in_str, self.escaped = 0, False, False
+                self.pos += 1
+
+            else:  # value
+                if self.value_start is None:
+                    if c.isspace():
+                        self.pos += 1
+                        continue
+                    self.value_start = self.pos
+
+                if self.in_str:
+                    if self.escaped:
+                        self.escaped = False
+                    elif c == "\\":
+                        self.escaped = True
+                    elif c == '"':
+                        self.in_str = False
+                elif c == '"':
+                    self.in_str = True
+                elif c in "{[":
+                    self.depth += 1
+                elif c in "}]":
+                    if self.depth == 0:
+                        # Closing brace of the object itself
+                        self._emit(self.pos, out)
+                        self.state = "done"
+                    self.depth -= 1
+                elif c == "," and self.depth == 0:
+                    self._emit(self.pos, out)
+                    self.state = "key"
+                self.pos += 1
+
+        return out
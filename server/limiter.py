@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Host-wide rate limiter shared by all worker processes
+Token buckets and daily caps live in one SQLite (WAL) file, and every
+check-and-consume is a single short IMMEDIATE transaction
+"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+from settings import (
+    RATE_LIMIT_DB, RATE_LIMIT_USER_PER_MIN, RATE_LIMIT_USER_BURST,
+    RATE_LIMIT_GLOBAL_PER_MIN, RATE_LIMIT_GLOBAL_BURST,
+    GLOBAL_DAILY_LIMIT, USER_DAILY_LIMIT,
+)
+
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = "*"
+
+
+class Denied(Exception):
+    """A reservation was refused; reason is "global", "user" or "rate" """
+
+    def __init__(self, reason: str, retry_after: float = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class SharedLimiter:
+    """Token buckets plus daily caps, consistent across processes on one host"""
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily "
+            "(day TEXT NOT NULL, key TEXT NOT NULL, used INTEGER NOT NULL, PRIMARY KEY (day, key))"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection of the calling thread (autocommit, explicit transactions)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _take(conn, key: str, rate_per_min: float, burst: float, now: float) -> Tuple[bool, float]:
+        """
+        Refill and try to take one token from a bucket (inside a transaction)
+        Returns (taken, seconds_until_next_token)
+        """
+        if rate_per_min <= 0:
+            return True, 0.0
+
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate_per_min / 60.0)
+
+        if tokens < 1.0:
+            return False, (1.0 - tokens) * 60.0 / rate_per_min
+
+        conn.execute(
+            "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+            (key, tokens - 1.0, now)
+        )
+        return True, 0.0
+
+    @staticmethod
+    def _daily(conn, day: str, key: str, stored: int) -> int:
+        """Today's reservations for key, never below what storage already holds"""
+        row = conn.execute("SELECT used FROM daily WHERE day = ? AND key = ?", (day, key)).fetchone()
+        return max(stored, row[0] if row else 0)
+
+    def acquire(self, user_id: str, day: str, stored_user: int = 0, stored_global: int = 0):
+        """
+        Atomically check every limit and consume one unit of each, or raise Denied
+        stored_* are the counts storage already holds for day (seed after restarts)
+        """
+        conn = self._connect()
+        now = time.time()
+        user_key = f"u:{user_id}"
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            global_used = self._daily(conn, day, GLOBAL_KEY, stored_global)
+            if global_used >= GLOBAL_DAILY_LIMIT:
+                raise Denied("global")
+            user_used = self._daily(conn, day, user_key, stored_user)
+            if user_used >= USER_DAILY_LIMIT:
+                raise Denied("user")
+
+            taken, wait = self._take(conn, user_key, RATE_LIMIT_USER_PER_MIN, RATE_LIMIT_USER_BURST, now)
+            if not taken:
+                raise Denied("rate", wait)
+            taken, wait = self._take(conn, GLOBAL_KEY, RATE_LIMIT_GLOBAL_PER_MIN, RATE_LIMIT_GLOBAL_BURST, now)
+            if not taken:
+                raise Denied("rate", wait)
+
+            conn.executemany(
+                "INSERT INTO daily (day, key, used) VALUES (?, ?, ?) "
+                "ON CONFLICT(day, key) DO UPDATE SET used = excluded.used",
+                [(day, GLOBAL_KEY, global_used + 1), (day, user_key, user_used + 1)]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def take(self, key: str, rate_per_min: float, burst: float) -> bool:
+        """Take one token from a named bucket shared by all workers"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            taken, _ = self._take(conn, f"b:{key}", rate_per_min, burst, time.time())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return taken
+
+    def release(self, user_id: str, day: str):
+        """Give back a daily reservation whose work did not happen"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE daily SET used = MAX(0, used - 1) WHERE day = ? AND key IN (?, ?)",
+                (day, GLOBAL_KEY, f"u:{user_id}")
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def prune(self, day: str):
+        """Drop daily rows older than day and buckets idle for a day"""
+        conn = self._connect()
+        conn.execute("DELETE FROM daily WHERE day < ?", (day,))
+        conn.execute("DELETE FROM buckets WHERE updated < ?", (time.time() - 86400,))
+
+
+_limiter: Optional[SharedLimiter] = None
+_limiter_lock = threading.Lock()
+_pruned_day: Optional[str] = None
+
+
+def get_limiter() -> Optional[SharedLimiter]:
+    """Shared limiter, or None when its database cannot be opened"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                try:
+                    _limiter = SharedLimiter()
+                except Exception as e:
+                    logger.error("Shared rate limiter unavailable (%s): %r", RATE_LIMIT_DB, e)
+                    return None
+    return _limiter
+
+
+def acquire(user_id: str, day: str, stored_user: int = 0, stored_global: int = 0):
+    """Reserve one model call for user on day, or raise Denied"""
+    global _pruned_day
+    limiter = get_limiter()
+    if limiter is None:
+        return
+    if _pruned_day != day:
+        _pruned_day = day
+        try:
+            limiter.prune(day)
+        except sqlite3.Error:
+            pass
+    limiter.acquire(user_id, day, stored_user, stored_global)
+
+
+def release(user_id: str, day: str):
+    """Undo a reservation after the model call failed"""
+    limiter = get_limiter()
+    if limiter is None:
+        return
+    try:
+        limiter.release(user_id, day)
+    except sqlite3.Error as e:
+        logger.warning("Rate limiter release failed: %r", e)
+
+
+def take_token(key: str, rate_per_min: float, burst: float) -> bool:
+    """Spend one token of a host-wide budget; False when it is used up"""
+    limiter = get_limiter()
+    if limiter is None:
+        return False
+    try:
+        return limiter.take(key, rate_per_min, burst)
+    except sqlite3.Error as e:
+        logger.warning("Rate limiter budget check failed: %r", e)
+        return False
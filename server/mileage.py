@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Mileage buckets - mileage range text parsed into numeric buckets
+The score adjustment depends only on the bucket, so a stored answer for
+one mileage range can be re-adjusted for any other
+"""
+import re
+import functools
+from typing import Optional, Tuple
+
+
+# (from km, to km or None, score delta, note)
+MILEAGE_BUCKETS = (
+    (0, 50_000, 0, None),
+    (50_000, 100_000, 0, None),
+    (100_000, 150_000, -5, "הציון הותאם מעט מטה עקב קילומטראז׳ בינוני-גבוה (100–150 אלף ק״מ)."),
+    (150_000, 200_000, -10, "הציון הותאם מטה עקב קילומטראז׳ גבוה (150–200 אלף ק״מ)."),
+    (200_000, None, -15, "הציון הותאם מטה עקב קילומטראז׳ גבוה מאוד (200K+)."),
+)
+
+# Answer fields the model writes for the requested mileage; served from
+# another bucket they are only approximate
+MILEAGE_TEXT_FIELDS = ("reliability_summary", "common_issues", "issues_with_costs", "recommended_checks")
+
+_NUMBER_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(k\b|אלף)?")
+_UP_TO_RE = re.compile(r"עד|up to|under|below|<")
+_OVER_RE = re.compile(r"\+|מעל|over|above|>")
+
+
+def normalize_mileage_text(mileage_range: str) -> str:
+    """Normalize mileage text for comparison"""
+    return re.sub(r"\s+", " ", str(mileage_range or "")).strip().lower()
+
+
+def parse_mileage_km(mileage_range: str) -> Optional[Tuple[int, Optional[int]]]:
+    """
+    Kilometre range of text like 'עד 50,000 ק"מ', '100,000 - 150,000' or '200K+'
+    Returns (from_km, to_km), to_km None when open; None if there are no numbers
+    """
+    m = normalize_mileage_text(mileage_range)
+    # Thousands separators: 150,000 -> 150000
+    m = re.sub(r"(?<=\d)[,'](?=\d{3})", "", m)
+    numbers = []
+    for value, unit in _NUMBER_RE.findall(m):
+        km = float(value)
+        # "150K", "150 אלף" and a bare "150" are thousands
+        if unit or km < 1000:
+            km *= 1000
+        numbers.append(int(km))
+
+    if not numbers:
+        return None
+    if len(numbers) >= 2:
+        return min(numbers[:2]), max(numbers[:2])
+    if _OVER_RE.search(m):
+        return numbers[0], None
+    if _UP_TO_RE.search(m):
+        return 0, numbers[0]
+    return numbers[0], numbers[0]
+
+
+@functools.lru_cache(maxsize=1024)
+def mileage_bucket(mileage_range: str) -> Optional[int]:
+    """Index into MILEAGE_BUCKETS of a mileage range (by its midpoint), or None"""
+    km = parse_mileage_km(mileage_range)
+    if km is None:
+        return None
+    low, high = km
+    point = low if high is None else (low + high) / 2
+    for i, (start, end, _, _) in enumerate(MILEAGE_BUCKETS):
+        if point >= start and (end is None or point < end):
+            return i
+    return None
+
+
+def mileage_adjustment(mileage_range: str) -> Tuple[int, Optional[str]]:
+    """
+    Calculate score adjustment based on mileage
+    Returns (delta, note)
+    """
+    bucket = mileage_bucket(str(mileage_range or ""))
+    if bucket is None:
+        return 0, None
+    _, _, delta, note = MILEAGE_BUCKETS[bucket]
+    return delta, note
+
+
+def unadjusted_score(score, mileage_range: str):
+    """Base score of a score that was adjusted for mileage_range (None stays None)"""
+    if score in [None, ""]:
+        return score
+    try:
+        score = int(score)
+    except Exception:
+        return score
+    delta, _ = mileage_adjustment(mileage_range)
+    return max(0, min(100, score - delta))
+
+
+def bucket_distance(requested: str, stored: str) -> int:
+    """How many buckets apart two mileage ranges are (len(MILEAGE_BUCKETS) if unknown)"""
+    a, b = mileage_bucket(str(requested or "")), mileage_bucket(str(stored or ""))
+    if a is None or b is None:
+        return len(MILEAGE_BUCKETS)
+    return abs(a - b)
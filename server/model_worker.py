@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Model worker processes for the job queue
+Run next to the web server, on the same host: python model_worker.py
+Each process claims queued analyses and runs up to JOB_WORKER_CONCURRENCY
+of them at once: build_prompt -> model -> apply_mileage_logic -> persist
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import sqlite3
+import time
+
+from settings import JOB_WORKERS, JOB_WORKER_CONCURRENCY, JOB_POLL_SEC
+from schemas import AnalyzeRequest
+from jobs import get_queue
+from analysis import analyze_with_model, save_result
+from breaker import ModelUnavailable
+from rate_limits import release_model_call
+from io_pool import run_blocking, shutdown_pool
+from sheets_layer import start_write_behind, flush_write_behind
+
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs are pruned this often
+PRUNE_EVERY_SEC = 3600
+
+
+async def run_job(job):
+    """Run one claimed job and record its outcome"""
+    queue = get_queue()
+    user_id = job["user_id"]
+    try:
+        request = AnalyzeRequest(**json.loads(job["request"]))
+        try:
+            result, mileage_note = await analyze_with_model(request)
+        except Exception as e:
+            # The call reserved when the job was queued did not happen
+            await run_blocking(release_model_call, user_id)
+            detail = ("AI model temporarily unavailable. Please try again shortly."
+                      if isinstance(e, ModelUnavailable) else f"AI model failed: {repr(e)}")
+            await run_blocking(queue.finish, job["id"], None, detail, 503)
+            return
+        await run_blocking(save_result, request, user_id, result)
+        await run_blocking(queue.finish, job["id"], {"result": result, "mileage_note": mileage_note})
+    except Exception as e:
+        # Left running: the lease runs out and another worker retries it
+        logger.error("Job %s failed to complete: %r", job["id"], e)
+
+
+async def serve(stop: asyncio.Event):
+    """Claim and run jobs until stop is set, then finish the claimed ones"""
+    queue = get_queue()
+    running = set()
+    pruned_at = 0.0
+
+    while not stop.is_set():
+        job = None
+        if len(running) < JOB_WORKER_CONCURRENCY:
+            try:
+                job, abandoned = await run_blocking(queue.claim)
+                for lost in abandoned:
+                    await run_blocking(release_model_call, lost["user_id"])
+                if time.time() - pruned_at > PRUNE_EVERY_SEC:
+                    await run_blocking(queue.prune)
+                    pruned_at = time.time()
+            except sqlite3.Error as e:
+                logger.warning("Job queue unavailable: %r", e)
+
+        if job is not None:
+            task = asyncio.ensure_future(run_job(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            continue
+
+        try:
+            await asyncio.wait_for(stop.wait(), JOB_POLL_SEC)
+        except asyncio.TimeoutError:
+            pass
+
+    if running:
+        await asyncio.wait(running)
+
+
+def worker_main():
+    """One model-worker process"""
+    start_write_behind()
+
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        await serve(stop)
+
+    try:
+        asyncio.run(main())
+    finally:
+        flush_write_behind()
+        shutdown_pool()
+
+
+def main():
+    """Start JOB_WORKERS worker processes and wait for them"""
+    if JOB_WORKERS <= 1:
+        worker_main()
+        return
+
+    # Spawned, not forked: gRPC state must not be shared across processes
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=worker_main, name=f"model-worker-{i}") for i in range(JOB_WORKERS)]
+    for proc in procs:
+        proc.start()
+
+    def forward(signum, frame):
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for proc in procs:
+        proc.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,30 @@ AI model logic - prompt building, model calling, mileage adjustments
 """
 import re
 import json
-import time
-from typing import Tuple, Optional, Dict, Any
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Tuple, Optional, Dict, Deque, AsyncIterator
 import google.generativeai as genai
 from json_repair import repair_json
 
+from breaker import CircuitBreaker, AimdLimit, ModelUnavailable
+from mileage import mileage_adjustment
+
 from settings import (
     GEMINI_API_KEY,
     PRIMARY_MODEL,
     FALLBACK_MODEL,
     RETRIES,
-    RETRY_BACKOFF_SEC
+    RETRY_BACKOFF_SEC,
+    MODEL_ATTEMPT_TIMEOUT_SEC,
+    MODEL_TOTAL_TIMEOUT_SEC,
+    MODEL_HEDGE,
+    MODEL_HEDGE_QUANTILE,
+    MODEL_HEDGE_AFTER_SEC,
+    MODEL_HEDGE_MIN_SEC,
+    MODEL_HEDGE_BUDGET
 )
 
 
@@ -66,70 +79,285 @@ def build_prompt(make: str, model: str, sub_model: Optional[str], year: int,
 """.strip()
 
 
-def call_model_with_retry(prompt: str) -> dict:
+def parse_model_json(raw: str) -> dict:
+    """Extract the JSON object from a model reply (repairing it if needed)"""
+    raw = (raw or "").strip()
+    try:
+        m = re.search(r"\{.*\}", raw, re.DOTALL)
+        return json.loads(m.group()) if m else json.loads(raw)
+    except Exception:
+        return json.loads(repair_json(raw))
+
+
+# Observed latencies of successful calls per model, and which recent calls
+# were hedged (for the hedge budget)
+_stats_lock = threading.Lock()
+_latencies: Dict[str, Deque[float]] = {}
+_recent_calls: Deque[bool] = deque(maxlen=200)
+_hedge_counts = {"hedged": 0, "hedge_won": 0}
+
+# Upstream protection: a breaker per model, one in-flight limit per worker
+_breakers: Dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(name) for name in (PRIMARY_MODEL, FALLBACK_MODEL)
+}
+_concurrency = AimdLimit()
+
+
+def _record_latency(model_name: str, seconds: float):
+    with _stats_lock:
+        _latencies.setdefault(model_name, deque(maxlen=200)).append(seconds)
+
+
+def latency_quantile(model_name: str, q: float) -> Optional[float]:
+    """Quantile of recent successful call latencies (None until 20 are seen)"""
+    with _stats_lock:
+        samples = sorted(_latencies.get(model_name, ()))
+    if len(samples) < 20:
+        return None
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def hedge_threshold() -> float:
+    """Seconds to wait for the primary before hedging with the fallback"""
+    observed = latency_quantile(PRIMARY_MODEL, MODEL_HEDGE_QUANTILE)
+    if observed is None:
+        return MODEL_HEDGE_AFTER_SEC
+    return max(MODEL_HEDGE_MIN_SEC, observed)
+
+
+def _take_hedge() -> bool:
+    """Whether the hedge budget allows one more hedged call (and count it)"""
+    with _stats_lock:
+        allowed = sum(_recent_calls) < MODEL_HEDGE_BUDGET * len(_recent_calls) + 1
+        if allowed:
+            # Counted now, so concurrent slow calls see each other's hedges
+            _recent_calls.append(True)
+            _hedge_counts["hedged"] += 1
+        return allowed
+
+
+def model_stats() -> dict:
+    """Latency quantiles, circuit states and hedging counters for /health"""
+    out = {}
+    for name in (PRIMARY_MODEL, FALLBACK_MODEL):
+        out[name] = {"p50": latency_quantile(name, 0.5), "p90": latency_quantile(name, 0.9)}
+        out[name]["circuit"] = _breakers[name].stats()
+    out["concurrency"] = _concurrency.stats()
+    with _stats_lock:
+        out["hedging"] = dict(_hedge_counts, enabled=MODEL_HEDGE)
+    return out
+
+
+def model_wait() -> float:
+    """Seconds until some model's circuit lets a call through (0 if one would now)"""
+    return min(b.wait() for b in _breakers.values())
+
+
+async def _call_model(model_name: str, prompt: str, deadline: float) -> dict:
     """
-    Call AI model with retry logic
-    Tries PRIMARY_MODEL first, then FALLBACK_MODEL
+    Retry ladder against one model, up to RETRIES attempts before deadline
+    Each attempt is bounded by MODEL_ATTEMPT_TIMEOUT_SEC; only a reply that
+    parses to a JSON object counts as success. Raises ModelUnavailable as
+    soon as the model's circuit or the in-flight limit refuses an attempt
     """
-    if not GEMINI_API_KEY:
-        raise RuntimeError("GEMINI_API_KEY not configured")
-    
+    loop = asyncio.get_running_loop()
+    llm = genai.GenerativeModel(model_name)
+    breaker = _breakers[model_name]
     last_err = None
     
-    for model_name in [PRIMARY_MODEL, FALLBACK_MODEL]:
+    for attempt in range(1, RETRIES + 1):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise RuntimeError(f"Model call exceeded {MODEL_TOTAL_TIMEOUT_SEC}s: {repr(last_err)}")
+        
+        breaker.allow()
         try:
-            llm = genai.GenerativeModel(model_name)
+            _concurrency.acquire()
+        except ModelUnavailable:
+            breaker.abandon()
+            raise
+        
+        started = loop.time()
+        ok = None
+        try:
+            resp = await asyncio.wait_for(
+                llm.generate_content_async(prompt),
+                timeout=min(MODEL_ATTEMPT_TIMEOUT_SEC, remaining)
+            )
+            ok = True
+        except asyncio.TimeoutError:
+            ok = False
+            last_err = TimeoutError(f"{model_name} attempt {attempt} timed out")
         except Exception as e:
+            ok = False
             last_err = e
-            continue
+        finally:
+            # A cancelled attempt (ok is None) says nothing about the model
+            elapsed = loop.time() - started
+            _concurrency.release(ok, elapsed)
+            if ok is None:
+                breaker.abandon()
+            else:
+                breaker.record(ok, elapsed)
         
-        for attempt in range(1, RETRIES + 1):
+        if ok:
             try:
-                resp = llm.generate_content(prompt)
-                raw = (getattr(resp, "text", "") or "").strip()
-                
-                # Try to extract JSON
-                try:
-                    m = re.search(r"\{.*\}", raw, re.DOTALL)
-                    data = json.loads(m.group()) if m else json.loads(raw)
-                except Exception:
-                    data = json.loads(repair_json(raw))
-                
+                data = parse_model_json(getattr(resp, "text", "") or "")
+                if not isinstance(data, dict):
+                    raise ValueError(f"{model_name} returned no JSON object")
+                _record_latency(model_name, elapsed)
                 return data
             except Exception as e:
                 last_err = e
-                if attempt < RETRIES:
-                    time.sleep(RETRY_BACKOFF_SEC)
-                continue
+        
+        if attempt < RETRIES:
+            # Jittered exponential backoff, never past the deadline
+            delay = RETRY_BACKOFF_SEC * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(max(0.0, min(delay, deadline - loop.time())))
     
-    raise RuntimeError(f"Model failed after all retries: {repr(last_err)}")
+    raise RuntimeError(f"{model_name} failed after {RETRIES} attempts: {repr(last_err)}")
 
 
-def normalize_mileage_text(mileage_range: str) -> str:
-    """Normalize mileage text for comparison"""
-    return re.sub(r"\s+", " ", str(mileage_range or "")).strip().lower()
+async def _first_success(tasks: Dict[asyncio.Task, str]) -> dict:
+    """Result of whichever task succeeds first; the others are cancelled"""
+    pending = set(tasks)
+    last_err = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if tasks[task] == FALLBACK_MODEL:
+                        with _stats_lock:
+                            _hedge_counts["hedge_won"] += 1
+                    return task.result()
+                last_err = task.exception()
+        raise last_err
+    finally:
+        for task in pending:
+            task.cancel()
 
 
-def mileage_adjustment(mileage_range: str) -> Tuple[int, Optional[str]]:
+async def call_model_async(prompt: str) -> dict:
     """
-    Calculate score adjustment based on mileage
-    Returns (delta, note)
+    Call AI model with retry logic, without blocking the event loop
+    Tries PRIMARY_MODEL first, then FALLBACK_MODEL. Every attempt is bounded
+    by MODEL_ATTEMPT_TIMEOUT_SEC and the whole call by MODEL_TOTAL_TIMEOUT_SEC;
+    cancelling the caller cancels the in-flight attempt. With MODEL_HEDGE, a
+    primary slower than its observed p90 is raced against the fallback.
+    A model whose circuit is open is skipped; raises ModelUnavailable when
+    the fallback could not be tried either
     """
-    m = normalize_mileage_text(mileage_range)
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY not configured")
     
-    if not m:
-        return 0, None
+    deadline = asyncio.get_running_loop().time() + MODEL_TOTAL_TIMEOUT_SEC
+    hedged = False
+    last_err = None
     
-    if "200" in m and "+" in m:
-        return -15, "הציון הותאם מטה עקב קילומטראז׳ גבוה מאוד (200K+)."
+    primary = asyncio.ensure_future(_call_model(PRIMARY_MODEL, prompt, deadline))
+    try:
+        if MODEL_HEDGE:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_threshold())
+            if not done and _take_hedge():
+                hedged = True
+                fallback = asyncio.ensure_future(_call_model(FALLBACK_MODEL, prompt, deadline))
+                return await _first_success({primary: PRIMARY_MODEL, fallback: FALLBACK_MODEL})
+        try:
+            return await primary
+        except Exception as e:
+            last_err = e
+    finally:
+        primary.cancel()
+        if not hedged:
+            with _stats_lock:
+                _recent_calls.append(False)
     
-    if "150" in m and "200" in m:
-        return -10, "הציון הותאם מטה עקב קילומטראז׳ גבוה (150–200 אלף ק״מ)."
+    try:
+        return await _call_model(FALLBACK_MODEL, prompt, deadline)
+    except ModelUnavailable as e:
+        # Nothing left to try until a circuit closes or a slot frees up
+        raise ModelUnavailable(f"No model available: {repr(last_err)}; {repr(e)}", e.retry_after)
+    except Exception as e:
+        raise RuntimeError(f"Model failed after all retries: {repr(last_err)}; {repr(e)}")
+
+
+async def stream_model_async(prompt: str) -> AsyncIterator[str]:
+    """
+    Stream the model's reply as text chunks
+    One attempt per model: FALLBACK_MODEL is tried only while nothing has been
+    yielded yet. The first chunk and every gap between chunks are bounded by
+    MODEL_ATTEMPT_TIMEOUT_SEC, the whole reply by MODEL_TOTAL_TIMEOUT_SEC
+    """
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY not configured")
     
-    if "100" in m and "150" in m:
-        return -5, "הציון הותאם מעט מטה עקב קילומטראז׳ בינוני-גבוה (100–150 אלף ק״מ)."
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MODEL_TOTAL_TIMEOUT_SEC
+    last_err = None
+    
+    for model_name in (PRIMARY_MODEL, FALLBACK_MODEL):
+        breaker = _breakers[model_name]
+        try:
+            breaker.allow()
+        except ModelUnavailable as e:
+            last_err = e
+            continue
+        try:
+            _concurrency.acquire()
+        except ModelUnavailable:
+            breaker.abandon()
+            raise
+        
+        started = loop.time()
+        ok = None
+        yielded = False
+        try:
+            llm = genai.GenerativeModel(model_name)
+            resp = await asyncio.wait_for(
+                llm.generate_content_async(prompt, stream=True),
+                timeout=min(MODEL_ATTEMPT_TIMEOUT_SEC, deadline - loop.time())
+            )
+            chunks = resp.__aiter__()
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), min(MODEL_ATTEMPT_TIMEOUT_SEC, remaining))
+                except StopAsyncIteration:
+                    break
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # A chunk without text parts (e.g. only a finish reason)
+                    text = ""
+                if text:
+                    yielded = True
+                    yield text
+            ok = True
+        except asyncio.TimeoutError:
+            ok = False
+            last_err = TimeoutError(f"{model_name} stream timed out")
+        except Exception as e:
+            ok = False
+            last_err = e
+        finally:
+            elapsed = loop.time() - started
+            _concurrency.release(ok, elapsed)
+            if ok is None:
+                breaker.abandon()
+            else:
+                breaker.record(ok, elapsed)
+        
+        if ok:
+            return
+        if yielded:
+            raise RuntimeError(f"{model_name} stream broke off: {repr(last_err)}")
     
-    return 0, None
+    if isinstance(last_err, ModelUnavailable):
+        raise ModelUnavailable(f"No model available: {repr(last_err)}", last_err.retry_after)
+    raise RuntimeError(f"Model stream failed: {repr(last_err)}")
 
 
 def apply_mileage_logic(result_obj: dict, requested_mileage: str) -> Tuple[dict, Optional[str]]:
@@ -3,11 +3,20 @@
 Rate limiting logic for global and per-user quotas
 """
 import datetime
+import logging
+import sqlite3
+import threading
+import time
 import pandas as pd
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
-from settings import GLOBAL_DAILY_LIMIT, USER_DAILY_LIMIT, DATABASE_URL
-from sheets_layer import sheet_to_df
+from settings import GLOBAL_DAILY_LIMIT, USER_DAILY_LIMIT, DATABASE_URL, QUOTA_SYNC_SEC
+from storage import get_store
+import limiter
+from frames import day_mask
+
+
+logger = logging.getLogger(__name__)
 
 
 def within_daily_global_limit(df: pd.DataFrame, limit: int = GLOBAL_DAILY_LIMIT) -> Tuple[bool, int]:
@@ -21,7 +30,7 @@ def within_daily_global_limit(df: pd.DataFrame, limit: int = GLOBAL_DAILY_LIMIT)
         return True, 0
     
     try:
-        cnt = len(df[df["date"].astype(str) == today])
+        cnt = int(day_mask(df, today).sum())
     except Exception:
         cnt = 0
     
@@ -39,48 +48,205 @@ def within_user_daily_limit(user_id: str, df: pd.DataFrame, limit: int = USER_DA
         return True, 0
     
     try:
-        user_today = df[
-            (df["date"].astype(str) == today) & 
-            (df["user_id"].astype(str) == user_id)
-        ]
-        cnt = len(user_today)
+        user_today = day_mask(df, today) & (df["user_id"].astype(str) == user_id)
+        cnt = int(user_today.sum())
     except Exception:
         cnt = 0
     
     return (cnt < limit), cnt
 
 
-def check_rate_limits(user_id: str) -> Tuple[bool, int, int]:
+# Per-day quota counters, rebuilt from storage on first use and at day
+# rollover, then advanced by the rows appended since the last seen version.
+# Storage is read outside _counter_lock; the lock only guards applying it
+_counter_lock = threading.Lock()
+_counter_day: Optional[str] = None
+_counter_version: Optional[int] = None
+_counter_synced_at = 0.0
+_counter_syncing = False
+_global_count = 0
+_user_counts: Dict[str, int] = {}
+# Rows this worker saved and already counted, per user (sequence numbers),
+# until a sync reads them back from storage
+_local_seq = 0
+_pending: Dict[str, List[int]] = {}
+
+
+def _count_rows(df: pd.DataFrame, day: str, reset: bool):
+    """
+    Add the rows of df dated day to the counters (under _counter_lock)
+    Rows matching this worker's pending saves were counted already
+    """
+    global _global_count, _user_counts
+    if reset:
+        _global_count = 0
+        _user_counts = {}
+    if df is None or df.empty:
+        return
+    today_rows = df[day_mask(df, day)]
+    for uid, cnt in today_rows["user_id"].astype(str).value_counts().items():
+        cnt = int(cnt)
+        seen = _pending.get(uid)
+        if seen:
+            matched = min(cnt, len(seen))
+            del seen[:matched]
+            cnt -= matched
+        _global_count += cnt
+        _user_counts[uid] = _user_counts.get(uid, 0) + cnt
+
+
+def _recount(df: pd.DataFrame, day: str, seq: int):
+    """
+    Replace the counters with df, a full read of day (under _counter_lock)
+    Pending saves up to seq were in storage before the read started
+    """
+    global _global_count, _user_counts
+    keep = {uid: [n for n in seqs if n > seq] for uid, seqs in _pending.items()}
+    _pending.clear()
+    _count_rows(df, day, reset=True)
+    for uid, seqs in keep.items():
+        if seqs:
+            _pending[uid] = seqs
+            _global_count += len(seqs)
+            _user_counts[uid] = _user_counts.get(uid, 0) + len(seqs)
+
+
+def _sync_counters(source=None):
+    """
+    Bring the counters up to date with storage
+    source is the store or a request context reading it. While one thread
+    syncs, the others keep serving the current counts
+    """
+    global _counter_day, _counter_version, _counter_synced_at, _counter_syncing
+    today = datetime.date.today().isoformat()
+    now = time.monotonic()
+    
+    with _counter_lock:
+        if _counter_day == today and (_counter_syncing or now - _counter_synced_at < QUOTA_SYNC_SEC):
+            return
+        day, since, seq = _counter_day, _counter_version, _local_seq
+        _counter_syncing = True
+    
+    try:
+        store = source or get_store()
+        delta = full = None
+        version = store.version()
+        if day == today and since is not None:
+            if version > since:
+                delta = store.results_since(since, version)
+                if delta is None:
+                    full = store.day_results(today)
+        else:
+            full = store.day_results(today)
+    except Exception as e:
+        logger.warning("Quota counter sync failed: %r", e)
+        with _counter_lock:
+            _counter_syncing = False
+            if _counter_day != today:
+                # Never carry yesterday's totals into a new day
+                _pending.clear()
+                _count_rows(None, today, reset=True)
+                _counter_day, _counter_version = today, None
+        return
+    
+    with _counter_lock:
+        _counter_syncing = False
+        # Another thread applied a read meanwhile; this one is outdated
+        if _counter_day != day or _counter_version != since:
+            return
+        if full is not None:
+            _recount(full, today, seq)
+            _counter_day, _counter_version = today, version
+        elif delta is not None:
+            _count_rows(delta, today, reset=False)
+            _counter_version = version
+        _counter_synced_at = now
+
+
+def _counts(user_id: str, ctx=None) -> Tuple[int, int]:
+    """
+    Returns (user_count, global_count) for today
+    Read once per request context and reused by its later stages
+    """
+    if ctx is not None and ctx.quota is not None and ctx.user_id == user_id:
+        return ctx.quota
+    _sync_counters(source=ctx)
+    with _counter_lock:
+        counts = _user_counts.get(user_id, 0), _global_count
+    if ctx is not None and ctx.user_id == user_id:
+        ctx.quota = counts
+    return counts
+
+
+def record_result(row: dict):
+    """Store an analysis and count it against today's quotas"""
+    global _global_count, _local_seq
+    get_store().append_result(row)
+    with _counter_lock:
+        if _counter_day != str(row.get("date", ""))[:10]:
+            # Counted by the next full read of its day
+            return
+        uid = str(row.get("user_id", ""))
+        _local_seq += 1
+        _pending.setdefault(uid, []).append(_local_seq)
+        _global_count += 1
+        _user_counts[uid] = _user_counts.get(uid, 0) + 1
+
+
+def check_rate_limits(user_id: str, ctx=None) -> Tuple[bool, int, int]:
     """
     Check both global and user rate limits
     Returns (can_proceed, user_count, global_count)
     """
-    df = sheet_to_df()
+    user_cnt, global_cnt = _counts(user_id, ctx)
     
     # Check global limit
-    global_ok, global_cnt = within_daily_global_limit(df)
-    if not global_ok:
+    if global_cnt >= GLOBAL_DAILY_LIMIT:
         return False, 0, global_cnt
     
     # Check user limit
-    user_ok, user_cnt = within_user_daily_limit(user_id, df)
-    if not user_ok:
+    if user_cnt >= USER_DAILY_LIMIT:
         return False, user_cnt, global_cnt
     
     return True, user_cnt, global_cnt
 
 
-def get_remaining_quota(user_id: str) -> Tuple[int, int]:
+def get_remaining_quota(user_id: str, ctx=None) -> Tuple[int, int]:
     """
     Get remaining quota for user and globally
     Returns (user_left, global_left)
     """
-    df = sheet_to_df()
-    
-    _, global_cnt = within_daily_global_limit(df)
-    _, user_cnt = within_user_daily_limit(user_id, df)
+    user_cnt, global_cnt = _counts(user_id, ctx)
     
     user_left = max(0, USER_DAILY_LIMIT - user_cnt)
     global_left = max(0, GLOBAL_DAILY_LIMIT - global_cnt)
     
     return user_left, global_left
+
+
+def reserve_model_call(user_id: str, ctx=None) -> Tuple[bool, str, float]:
+    """
+    Atomically consume today's quota and a rate token for one model call,
+    across all workers on this host
+    Returns (reserved, reason, retry_after_sec); reason is "global", "user" or "rate"
+    """
+    today = datetime.date.today().isoformat()
+    user_cnt, global_cnt = _counts(user_id, ctx)
+    try:
+        limiter.acquire(user_id, today, user_cnt, global_cnt)
+    except limiter.Denied as d:
+        return False, d.reason, d.retry_after
+    except sqlite3.Error as e:
+        # Limiter database trouble must not take the service down; the
+        # per-worker counters still enforce the daily caps
+        logger.warning("Shared rate limiter failed, using local counters: %r", e)
+        if global_cnt >= GLOBAL_DAILY_LIMIT:
+            return False, "global", 0.0
+        if user_cnt >= USER_DAILY_LIMIT:
+            return False, "user", 0.0
+    return True, "", 0.0
+
+
+def release_model_call(user_id: str):
+    """Return a reservation whose model call failed"""
+    limiter.release(user_id, datetime.date.today().isoformat())
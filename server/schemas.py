@@ -18,6 +18,11 @@ class AnalyzeRequest(BaseModel):
     advanced_mode: bool = False
 
 
+class BatchAnalyzeRequest(BaseModel):
+    """Request schema for batch analysis"""
+    items: List[AnalyzeRequest]
+
+
 class ScoreBreakdown(BaseModel):
     """Score breakdown by category"""
     engine_transmission_score: Optional[int] = None
@@ -68,11 +73,29 @@ class AnalyzeResponse(BaseModel):
     source: str  # "cache" or "model"
     used_fallback: bool
     km_warn: bool
+    stale: bool = False  # cached past CACHE_MAX_DAYS; a refresh was requested
+    approximate_fields: List[str] = []  # written for another mileage bucket (km_warn)
     mileage_note: Optional[str] = None
     result: AnalysisResult
     quota: QuotaInfo
 
 
+class BatchItemResult(BaseModel):
+    """One NDJSON line of a batch analysis"""
+    indexes: List[int]  # positions in the request answered by this line
+    status: int
+    response: Optional[AnalyzeResponse] = None
+    detail: Optional[str] = None
+
+
+class JobResponse(BaseModel):
+    """Response schema for a queued analysis"""
+    job_id: str
+    status: str  # "queued", "running", "done" or "failed"
+    response: Optional[AnalyzeResponse] = None
+    detail: Optional[str] = None
+
+
 class HistoryItem(BaseModel):
     """Single history record"""
     date: str
@@ -4,6 +4,7 @@ Settings and environment configuration
 """
 import os
 import json
+import tempfile
 from typing import Optional
 
 # Server settings
@@ -14,26 +15,131 @@ ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID", "")
 GOOGLE_SERVICE_ACCOUNT_JSON = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON", "")
 
+# In-process snapshot of the results sheet (seconds before a re-read)
+SHEET_CACHE_TTL_SEC = float(os.getenv("SHEET_CACHE_TTL_SEC", "60"))
+# Fetch only rows appended since the last read; full re-read on this schedule
+SHEET_INCREMENTAL_SYNC = os.getenv("SHEET_INCREMENTAL_SYNC", "1") == "1"
+SHEET_FULL_RESYNC_SEC = float(os.getenv("SHEET_FULL_RESYNC_SEC", "1800"))
+
+# Write-behind queue for sheet appends (batched by size or time, spilled to disk)
+SHEET_WRITE_BEHIND = os.getenv("SHEET_WRITE_BEHIND", "1") == "1"
+SHEET_WRITE_BATCH_SIZE = int(os.getenv("SHEET_WRITE_BATCH_SIZE", "50"))
+SHEET_WRITE_FLUSH_SEC = float(os.getenv("SHEET_WRITE_FLUSH_SEC", "2"))
+SHEET_WRITE_QUEUE_MAX = int(os.getenv("SHEET_WRITE_QUEUE_MAX", "1000"))
+SHEET_WRITE_MAX_BACKOFF_SEC = float(os.getenv("SHEET_WRITE_MAX_BACKOFF_SEC", "60"))
+# A batch failing this many times is retried row by row; rows that still
+# fail go to a dead-letter file (dead-<pid>.jsonl) in the spill directory
+SHEET_WRITE_MAX_ATTEMPTS = int(os.getenv("SHEET_WRITE_MAX_ATTEMPTS", "8"))
+SHEET_WRITE_SPILL_DIR = os.getenv(
+    "SHEET_WRITE_SPILL_DIR", os.path.join(tempfile.gettempdir(), "reliability_sheet_spill")
+)
+
+# Thread pool for blocking I/O (Sheets, SQL, OAuth)
+IO_POOL_SIZE = int(os.getenv("IO_POOL_SIZE", "32"))
+
+# Vehicle catalog the UI picks from (car_models_dict.py at the repo root by default)
+CAR_CATALOG_PATH = os.getenv(
+    "CAR_CATALOG_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "car_models_dict.py")
+)
+# Reject makes the catalog does not list (years of listed models are always checked)
+CATALOG_STRICT_MAKES = os.getenv("CATALOG_STRICT_MAKES", "0") == "1"
+
 # Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 
 # Auth (Google OAuth)
 GOOGLE_OAUTH_CLIENT_ID = os.getenv("GOOGLE_OAUTH_CLIENT_ID", "")
 GOOGLE_OAUTH_AUDIENCE = os.getenv("GOOGLE_OAUTH_AUDIENCE", "")
+# Verified ID tokens remembered until their exp (entries per worker)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
 
 # Rate Limits
 GLOBAL_DAILY_LIMIT = int(os.getenv("GLOBAL_DAILY_LIMIT", "1000"))
 USER_DAILY_LIMIT = int(os.getenv("USER_DAILY_LIMIT", "5"))
+# How long quota counters trust themselves before checking storage for rows
+# written by other workers
+QUOTA_SYNC_SEC = float(os.getenv("QUOTA_SYNC_SEC", "5"))
+# Host-wide limiter shared by all workers (SQLite WAL file); token buckets
+# refill per minute on top of the daily caps, 0 disables a bucket
+RATE_LIMIT_DB = os.getenv(
+    "RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "reliability_limits.db")
+)
+RATE_LIMIT_USER_PER_MIN = float(os.getenv("RATE_LIMIT_USER_PER_MIN", "0"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "0"))
+RATE_LIMIT_GLOBAL_PER_MIN = float(os.getenv("RATE_LIMIT_GLOBAL_PER_MIN", "0"))
+RATE_LIMIT_GLOBAL_BURST = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "30"))
 CACHE_MAX_DAYS = int(os.getenv("CACHE_MAX_DAYS", "45"))
+# Entries up to this many days past CACHE_MAX_DAYS are served as stale while
+# a background model call refreshes them (0 disables)
+CACHE_STALE_DAYS = int(os.getenv("CACHE_STALE_DAYS", "30"))
+# While no model can be called (circuits open), answers up to this old are
+# served as stale instead of failing the request
+CACHE_OUTAGE_DAYS = int(os.getenv("CACHE_OUTAGE_DAYS", "365"))
+# Host-wide budget for those refreshes (token bucket, per minute)
+STALE_REFRESH_PER_MIN = float(os.getenv("STALE_REFRESH_PER_MIN", "0.5"))
+STALE_REFRESH_BURST = float(os.getenv("STALE_REFRESH_BURST", "5"))
+# Parsed cached results kept in memory (LRU entries per worker)
+PARSED_CACHE_SIZE = int(os.getenv("PARSED_CACHE_SIZE", "4096"))
+# Identical concurrent cache misses share one model call per worker; with
+# SINGLE_FLIGHT_CROSS_WORKER the SQL store also lets workers wait for a peer
+SINGLE_FLIGHT_CROSS_WORKER = os.getenv("SINGLE_FLIGHT_CROSS_WORKER", "0") == "1"
+SINGLE_FLIGHT_WAIT_SEC = float(os.getenv("SINGLE_FLIGHT_WAIT_SEC", "90"))
+SINGLE_FLIGHT_POLL_SEC = float(os.getenv("SINGLE_FLIGHT_POLL_SEC", "0.5"))
+# /v1/analyze/batch: items per request, and model calls one batch runs at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# Job queue: with JOB_QUEUE, /v1/analyze answers a cache miss with 202 and a
+# job id, and model_worker.py processes on the same host run the model calls
+JOB_QUEUE = os.getenv("JOB_QUEUE", "0") == "1"
+JOB_DB = os.getenv("JOB_DB", os.path.join(tempfile.gettempdir(), "reliability_jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "8"))
+JOB_POLL_SEC = float(os.getenv("JOB_POLL_SEC", "0.5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_TTL_SEC = float(os.getenv("JOB_TTL_SEC", "86400"))
+# A job done this recently answers a repeat of its analysis, until web
+# workers' results snapshots (SHEET_CACHE_TTL_SEC) hold the saved row
+JOB_REUSE_SEC = float(os.getenv("JOB_REUSE_SEC", "60"))
 
-# PostgreSQL (optional)
+# SQL storage (optional): postgresql://... or sqlite:///path/to/results.db
 DATABASE_URL: Optional[str] = os.getenv("DATABASE_URL")
+# "sheets" or "sql"; defaults to "sql" when DATABASE_URL is set
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "").lower()
+# With SQL storage, replicate new rows to the sheet in the background
+SHEETS_MIRROR = os.getenv("SHEETS_MIRROR", "1") == "1"
+# Copy the sheet into an empty SQL results table on first start
+SQL_BACKFILL_FROM_SHEET = os.getenv("SQL_BACKFILL_FROM_SHEET", "1") == "1"
 
 # Model configuration
 PRIMARY_MODEL = "gemini-2.5-flash"
 FALLBACK_MODEL = "gemini-1.5-flash-latest"
 RETRIES = 2
 RETRY_BACKOFF_SEC = 1.5
+# Per-attempt and overall model deadlines; the overall one stays below the
+# Gunicorn worker timeout
+MODEL_ATTEMPT_TIMEOUT_SEC = float(os.getenv("MODEL_ATTEMPT_TIMEOUT_SEC", "45"))
+MODEL_TOTAL_TIMEOUT_SEC = float(os.getenv("MODEL_TOTAL_TIMEOUT_SEC", "100"))
+# Hedging: when the primary is slower than its observed latency quantile
+# (MODEL_HEDGE_AFTER_SEC until enough calls are seen, never below
+# MODEL_HEDGE_MIN_SEC), race the fallback; at most MODEL_HEDGE_BUDGET of
+# recent calls may be hedged
+MODEL_HEDGE = os.getenv("MODEL_HEDGE", "0") == "1"
+MODEL_HEDGE_QUANTILE = float(os.getenv("MODEL_HEDGE_QUANTILE", "0.9"))
+MODEL_HEDGE_AFTER_SEC = float(os.getenv("MODEL_HEDGE_AFTER_SEC", "20"))
+MODEL_HEDGE_MIN_SEC = float(os.getenv("MODEL_HEDGE_MIN_SEC", "3"))
+MODEL_HEDGE_BUDGET = float(os.getenv("MODEL_HEDGE_BUDGET", "0.1"))
+# Circuit breaker per model: opens when at least BREAKER_ERROR_RATE of the
+# last BREAKER_WINDOW calls (and BREAKER_MIN_CALLS) failed or took longer than
+# BREAKER_SLOW_SEC, then lets one probe through after BREAKER_OPEN_SEC
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_SEC = float(os.getenv("BREAKER_SLOW_SEC", "30"))
+BREAKER_OPEN_SEC = float(os.getenv("BREAKER_OPEN_SEC", "30"))
+# In-flight model calls per worker: AIMD limit between these bounds
+MODEL_CONCURRENCY_MIN = int(os.getenv("MODEL_CONCURRENCY_MIN", "2"))
+MODEL_CONCURRENCY_MAX = int(os.getenv("MODEL_CONCURRENCY_MAX", "16"))
 
 # Headers for Google Sheets
 REQUIRED_HEADERS = [
@@ -2,20 +2,78 @@
 """
 Google Sheets integration layer
 """
+import os
+import re
+import json
+import time
+import atexit
+import random
+import logging
+import threading
+from collections import deque
 import pandas as pd
-from typing import Optional
+from typing import Optional, List, Tuple
 import gspread
+from gspread.utils import numericise_all
 from google.oauth2.service_account import Credentials
 
+from frames import type_results, categorize, CATEGORICAL_COLUMNS
+
 from settings import (
     GOOGLE_SHEET_ID,
     REQUIRED_HEADERS,
+    SHEET_CACHE_TTL_SEC,
+    SHEET_INCREMENTAL_SYNC,
+    SHEET_FULL_RESYNC_SEC,
+    SHEET_WRITE_BEHIND,
+    SHEET_WRITE_BATCH_SIZE,
+    SHEET_WRITE_FLUSH_SEC,
+    SHEET_WRITE_QUEUE_MAX,
+    SHEET_WRITE_MAX_BACKOFF_SEC,
+    SHEET_WRITE_MAX_ATTEMPTS,
+    SHEET_WRITE_SPILL_DIR,
     get_service_account_dict
 )
 
 
+logger = logging.getLogger(__name__)
+
 _worksheet = None
 
+# In-process snapshot of the sheet, shared by all readers in this worker
+_snapshot_lock = threading.Lock()
+_snapshot_df: Optional[pd.DataFrame] = None
+_snapshot_loaded_at = 0.0
+_snapshot_version = 0
+# (version, rows the version added) for recent versions; rows is None when
+# the change was not a plain append (full sync, rows removed)
+_changes = deque(maxlen=512)
+
+# Incremental sync state: rows ingested from the sheet, and rows we wrote
+# ourselves that a tail read has not picked up yet. Local rows are
+# [sheet_row, values]; sheet_row is _PENDING while the row waits in the
+# write-behind queue and None when the sheet did not report its position.
+_PENDING = -1
+_synced_df: Optional[pd.DataFrame] = None
+_synced_header: List[str] = []
+_last_row = 1
+_last_row_values: List[str] = []
+_last_full_sync = 0.0
+_force_full_sync = False
+_local_rows: List[list] = []
+# Local rows counted in the snapshot version but not yet in _snapshot_df;
+# the next read adds them all at once
+_unmerged: List[list] = []
+
+# Columns a tail read fetches (A:S); the sheet may have more after them
+_TAIL_WIDTH = len(REQUIRED_HEADERS)
+_tail_disabled_logged = False
+
+# Failed syncs back off: the last snapshot is served until _next_sync_at
+SYNC_MAX_BACKOFF_SEC = 300
+_sync_failures = 0
+_next_sync_at = 0.0
+
 
 def connect_sheet():
     """Connect to Google Sheet and ensure headers are correct"""
@@ -54,32 +112,573 @@ def connect_sheet():
         raise RuntimeError(f"Failed to connect to Google Sheets: {repr(e)}")
 
 
-def sheet_to_df() -> pd.DataFrame:
-    """Read Google Sheet into DataFrame"""
-    ws = connect_sheet()
-    
-    try:
-        recs = ws.get_all_records()
-        df = pd.DataFrame(recs) if recs else pd.DataFrame(columns=REQUIRED_HEADERS)
-    except Exception as e:
-        # Return empty dataframe on error
-        return pd.DataFrame(columns=REQUIRED_HEADERS)
+def _trim_row(row) -> List[str]:
+    """Raw row values without trailing blanks, as the Sheets API returns them"""
+    row = [str(v) for v in row]
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def _rows_to_df(header: List[str], rows: List[list]) -> pd.DataFrame:
+    """Build a typed DataFrame from raw sheet values (cells parsed like get_all_records())"""
+    width = len(header)
+    recs = [numericise_all((r + [""] * width)[:width]) for r in rows]
+    df = pd.DataFrame(recs, columns=header) if recs else pd.DataFrame(columns=header)
     
     # Ensure all required columns exist
     for h in REQUIRED_HEADERS:
         if h not in df.columns:
             df[h] = ""
     
-    return df
+    return type_results(df)
+
+
+def _full_sync(ws):
+    """Download the whole sheet and reset the incremental sync state"""
+    global _synced_df, _synced_header, _last_row, _last_row_values
+    global _last_full_sync, _force_full_sync, _local_rows
+    
+    values = ws.get_all_values()
+    header = [str(c).strip().lower() for c in values[0]] if values else list(REQUIRED_HEADERS)
+    rows = values[1:] if values else []
+    
+    _synced_df = _rows_to_df(header, rows)
+    _synced_header = header
+    _last_row = 1 + len(rows)
+    _last_row_values = _trim_row(values[-1][:_TAIL_WIDTH]) if values else []
+    _last_full_sync = time.monotonic()
+    _force_full_sync = False
+    # Everything we wrote before this read is now part of the sheet
+    _local_rows = [lr for lr in _local_rows if lr[0] == _PENDING]
+
+
+def _tail_sync(ws) -> Optional[List[list]]:
+    """
+    Fetch only the rows after the last one ingested
+    Returns the rows new to the snapshot (fetched rows that are not our own
+    writes coming back), or None when the sheet no longer matches what we
+    hold and a full resync is needed (header changed, rows deleted, edited
+    or reordered)
+    """
+    global _synced_df, _last_row, _last_row_values, _local_rows, _tail_disabled_logged
+    
+    # Only A:S is read, so the required columns must come first
+    if _synced_header[:_TAIL_WIDTH] != REQUIRED_HEADERS:
+        if not _tail_disabled_logged:
+            logger.warning("Sheet header does not start with the required columns; syncing in full")
+            _tail_disabled_logged = True
+        return None
+    
+    # The tail is read from the anchor row on, so the range never starts
+    # past the last grid row (a sheet filled by append_rows ends there)
+    header, tail = ws.batch_get([
+        "A1:S1",
+        f"A{_last_row}:S",
+    ])
+    
+    header = [str(c).strip().lower() for c in (header[0] if header else [])]
+    if header != REQUIRED_HEADERS:
+        return None
+    
+    anchor = _trim_row(tail[0]) if tail else []
+    if anchor != _last_row_values:
+        return None
+    
+    first = _last_row + 1
+    rows = [list(r) for r in tail[1:]]
+    if rows:
+        new = _rows_to_df(REQUIRED_HEADERS, rows).reindex(columns=_synced_df.columns, fill_value="")
+        _synced_df = pd.concat([_synced_df, new], ignore_index=True)
+        _last_row += len(rows)
+        _last_row_values = _trim_row(rows[-1])
+    
+    # Drop our own rows once the sheet has handed them back to us
+    kept = [lr for lr in _local_rows if lr[0] == _PENDING or (lr[0] is not None and lr[0] > _last_row)]
+    returned = {lr[0] for lr in _local_rows if lr[0] is not None and lr[0] != _PENDING and lr[0] <= _last_row}
+    _local_rows = kept
+    return [row for i, row in enumerate(rows) if first + i not in returned]
+
+
+def _sync(ws):
+    """Bring the snapshot up to date with the sheet, incrementally when possible"""
+    global _force_full_sync
+    
+    full_due = (
+        not SHEET_INCREMENTAL_SYNC
+        or _synced_df is None
+        or _force_full_sync
+        or time.monotonic() - _last_full_sync >= SHEET_FULL_RESYNC_SEC
+        or any(lr[0] is None for lr in _local_rows)
+    )
+    before = (_last_row, len(_local_rows))
+    added = None
+    if not full_due:
+        try:
+            added = _tail_sync(ws)
+        except Exception as e:
+            # Any tail error falls back to a full read
+            logger.warning("Sheet tail read failed, syncing in full: %r", e)
+    if added is None:
+        _full_sync(ws)
+    elif (_last_row, len(_local_rows)) == before and _snapshot_df is not None:
+        # Nothing new: keep the snapshot and its version
+        return
+    _rebuild_snapshot(added)
 
 
-def append_row_to_sheet(row_dict: dict):
-    """Append a row to the sheet"""
+def _bump_version(added: Optional[List[list]]):
+    """Count a snapshot change and log the rows it added (None: not an append)"""
+    global _snapshot_version
+    
+    _snapshot_version += 1
+    _changes.append((_snapshot_version, added))
+
+
+def _rebuild_snapshot(added: Optional[List[list]] = None):
+    """
+    Compose the snapshot from synced rows plus our not-yet-synced writes
+    added: the rows this change appended, when it was only an append
+    """
+    global _snapshot_df
+    
+    _unmerged.clear()
+    df = _synced_df.copy(deep=False)
+    if _local_rows:
+        local = _rows_to_df(list(REQUIRED_HEADERS), [lr[1] for lr in _local_rows])
+        df = pd.concat([df, local.reindex(columns=df.columns, fill_value="")], ignore_index=True)
+    
+    _snapshot_df = categorize(df)
+    _bump_version(added)
+
+
+def _merge_unmerged():
+    """
+    Add tracked local rows to the snapshot frame without rebuilding it
+    (caller holds _snapshot_lock); only the new rows are parsed and categorized
+    """
+    global _snapshot_df
+    
+    if not _unmerged or _snapshot_df is None:
+        return
+    entries = list(_unmerged)
+    _unmerged.clear()
+    
+    # Readers may hold the current frame: extend a shallow copy
+    base = _snapshot_df.copy(deep=False)
+    new = _rows_to_df(list(REQUIRED_HEADERS), [e[1] for e in entries])
+    new = new.reindex(columns=base.columns, fill_value="")
+    for col in CATEGORICAL_COLUMNS:
+        if col not in base.columns or not isinstance(base[col].dtype, pd.CategoricalDtype):
+            continue
+        values = new[col].astype(str)
+        missing = pd.Index(values.unique()).difference(base[col].cat.categories)
+        if len(missing):
+            base[col] = base[col].cat.add_categories(missing)
+        new[col] = pd.Categorical(values, categories=base[col].cat.categories)
+    
+    _snapshot_df = pd.concat([base, new], ignore_index=True)
+
+
+def sheet_to_df(max_age: Optional[float] = None, copy: bool = True) -> pd.DataFrame:
+    """
+    Read Google Sheet into a typed DataFrame (see frames.type_results)
+    Served from the in-process snapshot while it is younger than max_age
+    (defaults to SHEET_CACHE_TTL_SEC); after that only new rows are fetched
+    unless a full resync is due. With copy=False the shared snapshot is
+    returned and must not be modified.
+    """
+    with _snapshot_lock:
+        if not _refresh_locked(max_age):
+            return type_results(pd.DataFrame(columns=REQUIRED_HEADERS))
+        _merge_unmerged()
+        return _snapshot_df.copy() if copy else _snapshot_df
+
+
+def _refresh_locked(max_age: Optional[float] = None) -> bool:
+    """
+    Sync the snapshot if it is older than max_age (caller holds _snapshot_lock)
+    Returns False when there is no snapshot to serve
+    """
+    global _snapshot_loaded_at, _sync_failures, _next_sync_at
+    
+    ttl = SHEET_CACHE_TTL_SEC if max_age is None else max_age
+    now = time.monotonic()
+    if _snapshot_df is not None and now - _snapshot_loaded_at < ttl:
+        return True
+    if now < _next_sync_at:
+        # Backing off after a failed sync
+        return _snapshot_df is not None
+    
+    try:
+        _sync(connect_sheet())
+    except Exception as e:
+        # Keep serving the last good snapshot, if any, and retry later
+        _sync_failures += 1
+        backoff = min(SYNC_MAX_BACKOFF_SEC, max(1.0, SHEET_CACHE_TTL_SEC) * 2 ** (_sync_failures - 1))
+        _next_sync_at = time.monotonic() + backoff * random.uniform(0.5, 1.0)
+        logger.warning("Sheet sync failed (attempt %d), retrying in %.0fs: %r", _sync_failures, backoff, e)
+        return _snapshot_df is not None
+    
+    _sync_failures = 0
+    _next_sync_at = 0.0
+    _snapshot_loaded_at = time.monotonic()
+    return True
+
+
+def snapshot_version(max_age: Optional[float] = None) -> int:
+    """
+    Version counter of the snapshot, bumped on every change to it
+    Syncs first when the snapshot is older than max_age, like sheet_to_df()
+    """
+    with _snapshot_lock:
+        _refresh_locked(max_age)
+        return _snapshot_version
+
+
+def rows_since(version: int, until: int) -> Optional[pd.DataFrame]:
+    """
+    Rows the snapshot gained after version, up to until
+    Returns None when a change in between was not a plain append (or is no
+    longer logged), and consumers must rebuild from the full snapshot
+    """
+    with _snapshot_lock:
+        logged = dict(_changes)
+        if any(logged.get(v) is None for v in range(version + 1, until + 1)):
+            return None
+        rows = [row for v in range(version + 1, until + 1) for row in logged[v]]
+    return _rows_to_df(list(REQUIRED_HEADERS), rows)
+
+
+def drop_snapshot():
+    """Free the snapshot and sync state (the next read loads the sheet again)"""
+    global _snapshot_df, _synced_df, _synced_header, _last_row, _last_row_values, _local_rows
+    
+    with _snapshot_lock:
+        _snapshot_df = None
+        _synced_df = None
+        _synced_header = []
+        _last_row = 1
+        _last_row_values = []
+        _local_rows = [lr for lr in _local_rows if lr[0] == _PENDING]
+        _unmerged.clear()
+
+
+def invalidate_snapshot(full: bool = False):
+    """Force the next sheet_to_df() call to sync, optionally with a full re-read"""
+    global _snapshot_loaded_at, _force_full_sync, _next_sync_at
+    
+    with _snapshot_lock:
+        _snapshot_loaded_at = 0.0
+        _next_sync_at = 0.0
+        if full:
+            _force_full_sync = True
+
+
+def _updated_row_range(resp) -> Optional[tuple]:
+    """Extract (first_row, last_row) from an append response's updatedRange"""
+    try:
+        rng = resp["updates"]["updatedRange"]
+        m = re.search(r"![A-Z]+(\d+)(?::[A-Z]+(\d+))?$", rng)
+        first = int(m.group(1))
+        return first, int(m.group(2) or first)
+    except Exception:
+        return None
+
+
+def _track_local_rows(entries: List[list]):
+    """
+    Show rows we are writing in the snapshot so it stays fresh without a re-read
+    Rows written before the first load wait in _local_rows and are added
+    when the load rebuilds the snapshot
+    """
+    with _snapshot_lock:
+        added = [e for e in entries if e[0] is None or e[0] == _PENDING or e[0] > _last_row]
+        if added:
+            # O(1) per write: the frame is extended on the next read
+            _local_rows.extend(added)
+            _unmerged.extend(added)
+            _bump_version([e[1] for e in added])
+
+
+def _confirm_local_rows(entries: List[list], resp):
+    """Record where the sheet put rows that were written"""
+    global _local_rows
+    
+    span = _updated_row_range(resp)
+    with _snapshot_lock:
+        for i, entry in enumerate(entries):
+            ok = span and span[1] - span[0] + 1 == len(entries)
+            entry[0] = span[0] + i if ok else None
+        
+        # A sync that ran while the write was in flight already ingested them
+        before = len(_local_rows)
+        _local_rows = [lr for lr in _local_rows if lr[0] is None or lr[0] == _PENDING or lr[0] > _last_row]
+        if len(_local_rows) != before and _synced_df is not None:
+            _rebuild_snapshot()
+
+
+def _forget_local_rows(entries: List[list]):
+    """Take rows that will never reach the sheet out of the snapshot"""
+    global _local_rows
+    
+    ids = {id(e) for e in entries}
+    with _snapshot_lock:
+        before = len(_local_rows)
+        _local_rows = [lr for lr in _local_rows if id(lr) not in ids]
+        if len(_local_rows) != before and _synced_df is not None:
+            _rebuild_snapshot()
+
+
+def _write_rows(rows: List[list], entries: List[list]):
+    """Append rows to the sheet in one call and confirm them in the snapshot"""
     ws = connect_sheet()
+    resp = ws.append_rows(rows, value_input_option="USER_ENTERED")
+    _confirm_local_rows(entries, resp)
+
+
+# Write-behind queue: rows wait here (and in a per-process spill file) until
+# the flusher thread appends them in batches
+_queue_cond = threading.Condition()
+_queue: List[tuple] = []
+_flusher: Optional[threading.Thread] = None
+_stopping = False
+
+
+def _spill_path() -> str:
+    """Spill file of this process"""
+    return os.path.join(SHEET_WRITE_SPILL_DIR, f"spill-{os.getpid()}.jsonl")
+
+
+def _spill_append(rows: List[list]):
+    """Persist queued rows before acknowledging them"""
+    os.makedirs(SHEET_WRITE_SPILL_DIR, exist_ok=True)
+    with open(_spill_path(), "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _spill_rewrite():
+    """Rewrite the spill file with what is still queued (caller holds _queue_cond)"""
+    path = _spill_path()
+    if not _queue:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for _, row in _queue:
+            f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _dead_letter(batch: List[tuple]):
+    """Set rows the sheet keeps rejecting aside, so the rows queued after them drain"""
+    os.makedirs(SHEET_WRITE_SPILL_DIR, exist_ok=True)
+    path = os.path.join(SHEET_WRITE_SPILL_DIR, f"dead-{os.getpid()}.jsonl")
+    with open(path, "a", encoding="utf-8") as f:
+        for _, row in batch:
+            f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    _forget_local_rows([entry for entry, _ in batch])
+    logger.error("Moved %d sheet rows that could not be written to %s", len(batch), path)
+
+
+def _pid_alive(pid: int) -> bool:
+    """Whether another live process owns this pid"""
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except Exception:
+        return True
+    return True
+
+
+def _recover_spilled_rows() -> Tuple[List[list], List[str]]:
+    """
+    Claim spill files left behind by dead processes
+    Returns (rows, claimed paths); the caller removes the claimed files once
+    the rows are safe in its own spill file
+    """
+    rows, claims = [], []
+    if not os.path.isdir(SHEET_WRITE_SPILL_DIR):
+        return rows, claims
+    
+    for name in sorted(os.listdir(SHEET_WRITE_SPILL_DIR)):
+        m = re.match(r"spill-(\d+)\.jsonl$", name)
+        if not m or _pid_alive(int(m.group(1))):
+            continue
+        src = os.path.join(SHEET_WRITE_SPILL_DIR, name)
+        claimed = os.path.join(SHEET_WRITE_SPILL_DIR, f"claim-{os.getpid()}-{name}")
+        try:
+            # Only one worker wins the rename
+            os.rename(src, claimed)
+        except OSError:
+            continue
+        try:
+            with open(claimed, encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError as e:
+            # Left claimed: the next process after this one retries it
+            logger.error("Could not read spilled sheet rows from %s: %r", claimed, e)
+            continue
+        for line in lines:
+            try:
+                rows.append(json.loads(line))
+            except Exception:
+                logger.warning("Skipping unreadable spilled sheet row in %s", claimed)
+        claims.append(claimed)
+    
+    # Claims interrupted by a crash are picked up under their original name
+    # (not the ones just made: a reused pid looks dead to _pid_alive)
+    for name in os.listdir(SHEET_WRITE_SPILL_DIR):
+        m = re.match(r"claim-(\d+)-(spill-\d+\.jsonl)$", name)
+        if m and os.path.join(SHEET_WRITE_SPILL_DIR, name) not in claims and not _pid_alive(int(m.group(1))):
+            try:
+                os.rename(os.path.join(SHEET_WRITE_SPILL_DIR, name),
+                          os.path.join(SHEET_WRITE_SPILL_DIR, m.group(2)))
+            except OSError:
+                pass
+    
+    return rows, claims
+
+
+def _flush_loop():
+    """Background flusher: batch queued rows into append_rows calls"""
+    failures = 0
+    
+    while True:
+        with _queue_cond:
+            while not _queue and not _stopping:
+                _queue_cond.wait()
+            # Give the batch up to SHEET_WRITE_FLUSH_SEC to fill
+            deadline = time.monotonic() + SHEET_WRITE_FLUSH_SEC
+            while not _stopping and len(_queue) < SHEET_WRITE_BATCH_SIZE:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                _queue_cond.wait(left)
+            if not _queue:
+                return
+            batch = _queue[:SHEET_WRITE_BATCH_SIZE]
+        
+        try:
+            _write_rows([row for _, row in batch], [entry for entry, _ in batch])
+        except Exception as e:
+            failures += 1
+            if _stopping:
+                # Rows stay in the spill file for the next process
+                return
+            if failures < SHEET_WRITE_MAX_ATTEMPTS:
+                delay = min(SHEET_WRITE_MAX_BACKOFF_SEC, SHEET_WRITE_FLUSH_SEC * (2 ** failures))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            
+            # Give up on the batch: write its rows one by one, so a single
+            # bad row does not hold back the rest, and set aside the failures
+            logger.error("Sheet append failed %d times: %r", failures, e)
+            rejected = []
+            for entry, row in batch:
+                try:
+                    _write_rows([row], [entry])
+                except Exception:
+                    rejected.append((entry, row))
+            if rejected:
+                _dead_letter(rejected)
+        
+        failures = 0
+        with _queue_cond:
+            del _queue[:len(batch)]
+            _spill_rewrite()
+            _queue_cond.notify_all()
+
+
+def start_write_behind():
+    """Start the flusher thread and re-queue rows spilled by dead processes"""
+    global _flusher, _stopping
+    
+    if not SHEET_WRITE_BEHIND:
+        return
     
+    with _queue_cond:
+        if _flusher is not None and _flusher.is_alive():
+            return
+        _stopping = False
+        try:
+            recovered, claims = _recover_spilled_rows()
+        except Exception as e:
+            logger.error("Recovering spilled sheet rows failed: %r", e)
+            recovered, claims = [], []
+        if recovered:
+            # Our own spill file holds the rows before the claimed files go
+            try:
+                _spill_append(recovered)
+            except OSError as e:
+                logger.error("Could not re-spill recovered sheet rows; leaving them claimed: %r", e)
+                recovered, claims = [], []
+            _queue.extend(([_PENDING, [str(v) for v in row]], row) for row in recovered)
+        for path in claims:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("Could not remove claimed spill file %s: %r", path, e)
+        _flusher = threading.Thread(target=_flush_loop, name="sheet-write-behind", daemon=True)
+        _flusher.start()
+
+
+def flush_write_behind(timeout: float = 10.0):
+    """Stop the flusher after it drains the queue (bounded by timeout)"""
+    global _stopping
+    
+    with _queue_cond:
+        if _flusher is None:
+            return
+        _stopping = True
+        _queue_cond.notify_all()
+    _flusher.join(timeout)
+
+
+def pending_writes() -> int:
+    """Number of rows waiting in the write-behind queue"""
+    return len(_queue)
+
+
+atexit.register(flush_write_behind)
+
+
+def append_row_to_sheet(row_dict: dict, track: bool = True):
+    """
+    Append a row to the sheet
+    With write-behind enabled the row is spilled to disk and queued for the
+    flusher; when the queue is full it is written inline instead.
+    With track=False (the sheet is only a mirror) the snapshot is left alone
+    """
     row = [row_dict.get(k, "") for k in REQUIRED_HEADERS]
+    entry = [_PENDING, [str(v) for v in row]]
+    
+    if SHEET_WRITE_BEHIND:
+        start_write_behind()
+        with _queue_cond:
+            if len(_queue) < SHEET_WRITE_QUEUE_MAX and not _stopping:
+                _spill_append([row])
+                _queue.append((entry, row))
+                if track:
+                    _track_local_rows([entry])
+                _queue_cond.notify_all()
+                return
     
     try:
-        ws.append_row(row, value_input_option="USER_ENTERED")
+        _write_rows([row], [entry])
     except Exception as e:
         raise RuntimeError(f"Failed to append row to sheet: {repr(e)}")
+    
+    if track:
+        _track_local_rows([entry])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Single-flight coalescing of identical concurrent work within a worker
+The first caller starts the work; duplicates arriving while it runs await
+the same task instead of repeating it
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, Type
+
+
+class SingleFlight:
+    """Per-key in-flight tasks on the running event loop"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.started = 0
+        self.joined = 0
+
+    def running(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]],
+                 private: Tuple[Type[BaseException], ...] = ()) -> Tuple[Any, bool]:
+        """
+        Run func() once for all concurrent callers of key
+        The work runs as its own task: a caller being cancelled does not cancel
+        it for the others, only the last caller leaving does. Exceptions of the
+        private types belong to the caller that started the work; duplicates
+        retry instead of sharing them
+        Returns (result, shared); shared is False for the caller that ran func
+        """
+        while True:
+            task = self._flights.get(key)
+            if task is not None and task.done() and (
+                task.cancelled() or isinstance(task.exception(), private)
+            ):
+                # Finished for its starter only and not forgotten yet
+                task = None
+            shared = task is not None
+            if task is None:
+                task = asyncio.ensure_future(func())
+                self._flights[key] = task
+                task.add_done_callback(lambda t, k=key: self._forget(k, t))
+                self.started += 1
+            else:
+                self.joined += 1
+
+            self._waiters[task] = self._waiters.get(task, 0) + 1
+            try:
+                return await asyncio.shield(task), shared
+            except asyncio.CancelledError:
+                if self._waiters[task] == 1 and not task.done():
+                    task.cancel()
+                raise
+            except private:
+                if shared:
+                    continue
+                raise
+            finally:
+                left = self._waiters.pop(task) - 1
+                if left:
+                    self._waiters[task] = left
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "started": self.started, "joined": self.joined}
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+Results storage backends
+Google Sheets (default) or SQL behind DATABASE_URL, with Sheets kept as an
+asynchronously replicated mirror when SQL is the primary store
+"""
+import re
+import sqlite3
+import threading
+import time
+import datetime
+import pandas as pd
+from typing import Optional, List
+
+from settings import (
+    DATABASE_URL,
+    STORAGE_BACKEND,
+    SHEETS_MIRROR,
+    SQL_BACKFILL_FROM_SHEET,
+    GOOGLE_SHEET_ID,
+    REQUIRED_HEADERS
+)
+from sheets_layer import sheet_to_df, append_row_to_sheet, snapshot_version, rows_since, drop_snapshot
+from frames import type_results, categorize, day_mask
+
+
+def _as_date_str(value) -> str:
+    """ISO date (YYYY-MM-DD) of a date-like value"""
+    if value is None or value is pd.NaT:
+        return ""
+    if isinstance(value, (datetime.date, pd.Timestamp)):
+        return value.isoformat()[:10]
+    return str(value or "")[:10]
+
+
+class ResultsStore:
+    """
+    Interface shared by the storage backends
+    Frames are typed (see frames.type_results) and may be shared, so
+    callers must copy before modifying them
+    """
+    
+    def load_results(self) -> pd.DataFrame:
+        """All stored analyses"""
+        raise NotImplementedError
+    
+    def append_result(self, row: dict):
+        """Store one analysis row (keys are REQUIRED_HEADERS)"""
+        raise NotImplementedError
+    
+    def count_results(self, day: str, user_id: Optional[str] = None) -> int:
+        """Number of analyses stored on a day, optionally for one user"""
+        raise NotImplementedError
+    
+    def user_results(self, user_id: str) -> pd.DataFrame:
+        """All analyses of one user"""
+        raise NotImplementedError
+    
+    def day_results(self, day: str) -> pd.DataFrame:
+        """All analyses stored on an ISO day"""
+        raise NotImplementedError
+    
+    def recent_results(self, year: int, since) -> pd.DataFrame:
+        """Analyses of a model year stored on or after a date"""
+        raise NotImplementedError
+    
+    def version(self) -> int:
+        """Changes whenever the stored results change"""
+        raise NotImplementedError
+    
+    def results_since(self, version: int, until: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """
+        Rows added after a version (up to until, default current), for
+        consumers that keep derived indexes
+        Returns None when the change is not a plain append and they must rebuild
+        """
+        return None
+    
+    def try_lock(self, key: str, ttl: float) -> bool:
+        """
+        Take a short-lived named lock shared by all workers using this store
+        Stores without shared state grant every lock (workers do not coordinate)
+        """
+        return True
+    
+    def unlock(self, key: str):
+        """Release a lock taken with try_lock"""
+    
+    def is_locked(self, key: str) -> bool:
+        """Whether some worker holds an unexpired lock on key"""
+        return False
+
+
+class SheetsResultsStore(ResultsStore):
+    """Google Sheets as the source of truth, served from the snapshot"""
+    
+    def load_results(self) -> pd.DataFrame:
+        return sheet_to_df(copy=False)
+    
+    def append_result(self, row: dict):
+        append_row_to_sheet(row)
+    
+    def results_since(self, version: int, until: Optional[int] = None) -> Optional[pd.DataFrame]:
+        # Our own appends and rows a tail sync brought in are both logged
+        current = snapshot_version() if until is None else until
+        return rows_since(version, current)
+    
+    def count_results(self, day: str, user_id: Optional[str] = None) -> int:
+        df = sheet_to_df(copy=False)
+        if df.empty:
+            return 0
+        mask = day_mask(df, day)
+        if user_id is not None:
+            mask &= df["user_id"].astype(str) == user_id
+        return int(mask.sum())
+    
+    def user_results(self, user_id: str) -> pd.DataFrame:
+        df = sheet_to_df(copy=False)
+        return df[df["user_id"].astype(str) == user_id]
+    
+    def day_results(self, day: str) -> pd.DataFrame:
+        df = sheet_to_df(copy=False)
+        return df[day_mask(df, day)] if not df.empty else df
+    
+    def recent_results(self, year: int, since) -> pd.DataFrame:
+        df = sheet_to_df(copy=False)
+        if df.empty:
+            return df
+        return df[df["year"].eq(int(year)).fillna(False) & (df["date"] >= pd.Timestamp(since))]
+    
+    def version(self) -> int:
+        return snapshot_version()
+
+
+class SqlResultsStore(ResultsStore):
+    """
+    SQLite (sqlite:///path) or PostgreSQL (postgresql://...) results table
+    Lookups and quota counts are indexed queries
+    """
+    
+    def __init__(self, url: str, mirror_to_sheets: bool = False):
+        self.url = url
+        self.mirror_to_sheets = mirror_to_sheets
+        self.is_sqlite = url.startswith("sqlite")
+        self._local = threading.local()
+        self._init_schema()
+    
+    def _connect(self):
+        """Connection of the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        
+        if self.is_sqlite:
+            path = re.sub(r"^sqlite:///?", "", self.url) or ":memory:"
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+        else:
+            try:
+                import psycopg2
+            except ImportError:
+                raise RuntimeError("psycopg2 is required for a PostgreSQL DATABASE_URL")
+            conn = psycopg2.connect(self.url)
+            conn.autocommit = True
+        
+        self._local.conn = conn
+        return conn
+    
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        """Run a statement and return its rows"""
+        if not self.is_sqlite:
+            sql = sql.replace("?", "%s")
+        conn = self._connect()
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            rows = cur.fetchall() if cur.description else []
+            if self.is_sqlite:
+                conn.commit()
+            return rows
+        finally:
+            cur.close()
+    
+    def _init_schema(self):
+        """Create the results table and its indexes"""
+        id_col = "INTEGER PRIMARY KEY AUTOINCREMENT" if self.is_sqlite else "BIGSERIAL PRIMARY KEY"
+        cols = ", ".join(
+            f"{h} INTEGER" if h == "year" else f"{h} TEXT" for h in REQUIRED_HEADERS
+        )
+        self._execute(f"CREATE TABLE IF NOT EXISTS results (id {id_col}, {cols})")
+        self._execute("CREATE INDEX IF NOT EXISTS ix_results_vehicle ON results (make, model, year, date)")
+        self._execute("CREATE INDEX IF NOT EXISTS ix_results_user ON results (user_id, date)")
+        self._execute("CREATE INDEX IF NOT EXISTS ix_results_year ON results (year, date)")
+        self._execute("CREATE INDEX IF NOT EXISTS ix_results_date ON results (date)")
+        self._execute("CREATE TABLE IF NOT EXISTS flight_locks (key TEXT PRIMARY KEY, expires DOUBLE PRECISION)")
+    
+    def _frame(self, where: str = "", params: tuple = ()) -> pd.DataFrame:
+        """Query results into a DataFrame shaped like the sheet"""
+        rows = self._execute(
+            f"SELECT {', '.join(REQUIRED_HEADERS)} FROM results {where} ORDER BY id", params
+        )
+        return categorize(type_results(pd.DataFrame(rows, columns=REQUIRED_HEADERS)))
+    
+    @staticmethod
+    def _insert_sql(placeholder: str = "?") -> str:
+        return (f"INSERT INTO results ({', '.join(REQUIRED_HEADERS)}) "
+                f"VALUES ({', '.join(placeholder for _ in REQUIRED_HEADERS)})")
+    
+    @staticmethod
+    def _row_values(row: dict) -> tuple:
+        """Column values of a row, in REQUIRED_HEADERS order"""
+        values = []
+        for h in REQUIRED_HEADERS:
+            v = row.get(h, "")
+            if h == "date":
+                v = _as_date_str(v)
+            elif h == "year":
+                try:
+                    v = int(v)
+                except Exception:
+                    v = None
+            else:
+                v = "" if v is None else str(v)
+            values.append(v)
+        return tuple(values)
+    
+    def _insert_rows(self, rows: List[dict]):
+        """Insert rows without mirroring them"""
+        sql = self._insert_sql()
+        for row in rows:
+            self._execute(sql, self._row_values(row))
+    
+    def backfill_from_sheet(self):
+        """
+        Copy the sheet into an empty results table
+        Workers starting together race for it: the copy runs under an
+        exclusive table lock, re-checks that the table is still empty, and
+        commits all rows at once, so only one worker's copy lands
+        """
+        if self._execute("SELECT COUNT(*) FROM results")[0][0]:
+            return
+        df = sheet_to_df(copy=False)
+        rows = [self._row_values(r) for r in df[REQUIRED_HEADERS].to_dict("records")]
+        # SQL serves every read from now on
+        drop_snapshot()
+        if not rows:
+            return
+        
+        conn = self._connect()
+        cur = conn.cursor()
+        try:
+            if self.is_sqlite:
+                cur.execute("BEGIN IMMEDIATE")
+            else:
+                cur.execute("BEGIN")
+                cur.execute("LOCK TABLE results IN EXCLUSIVE MODE")
+            cur.execute("SELECT COUNT(*) FROM results")
+            if not cur.fetchone()[0]:
+                cur.executemany(self._insert_sql("?" if self.is_sqlite else "%s"), rows)
+            cur.execute("COMMIT")
+        except BaseException:
+            try:
+                cur.execute("ROLLBACK")
+            except Exception:
+                pass
+            raise
+        finally:
+            cur.close()
+    
+    def load_results(self) -> pd.DataFrame:
+        return self._frame()
+    
+    def append_result(self, row: dict):
+        self._insert_rows([row])
+        if self.mirror_to_sheets:
+            try:
+                append_row_to_sheet(row, track=False)
+            except Exception:
+                # The mirror is best-effort; SQL is the source of truth
+                pass
+    
+    def count_results(self, day: str, user_id: Optional[str] = None) -> int:
+        if user_id is None:
+            rows = self._execute("SELECT COUNT(*) FROM results WHERE date = ?", (day,))
+        else:
+            rows = self._execute(
+                "SELECT COUNT(*) FROM results WHERE user_id = ? AND date = ?", (user_id, day)
+            )
+        return int(rows[0][0])
+    
+    def user_results(self, user_id: str) -> pd.DataFrame:
+        return self._frame("WHERE user_id = ?", (user_id,))
+    
+    def day_results(self, day: str) -> pd.DataFrame:
+        return self._frame("WHERE date = ?", (day,))
+    
+    def recent_results(self, year: int, since) -> pd.DataFrame:
+        return self._frame("WHERE year = ? AND date >= ?", (int(year), _as_date_str(since)))
+    
+    def version(self) -> int:
+        return int(self._execute("SELECT COALESCE(MAX(id), 0) FROM results")[0][0])
+    
+    def results_since(self, version: int, until: Optional[int] = None) -> Optional[pd.DataFrame]:
+        if until is None:
+            return self._frame("WHERE id > ?", (int(version),))
+        return self._frame("WHERE id > ? AND id <= ?", (int(version), int(until)))
+    
+    def try_lock(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        self._execute("DELETE FROM flight_locks WHERE key = ? AND expires < ?", (key, now))
+        rows = self._execute(
+            "INSERT INTO flight_locks (key, expires) VALUES (?, ?) ON CONFLICT (key) DO NOTHING RETURNING key",
+            (key, now + ttl)
+        )
+        return bool(rows)
+    
+    def unlock(self, key: str):
+        self._execute("DELETE FROM flight_locks WHERE key = ?", (key,))
+    
+    def is_locked(self, key: str) -> bool:
+        return bool(self._execute(
+            "SELECT 1 FROM flight_locks WHERE key = ? AND expires >= ?", (key, time.time())
+        ))
+
+
+_store: Optional[ResultsStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ResultsStore:
+    """Configured results store (created on first use)"""
+    global _store
+    
+    if _store is not None:
+        return _store
+    
+    with _store_lock:
+        if _store is None:
+            backend = STORAGE_BACKEND or ("sql" if DATABASE_URL else "sheets")
+            if backend == "sql":
+                if not DATABASE_URL:
+                    raise RuntimeError("STORAGE_BACKEND=sql requires DATABASE_URL")
+                mirror = SHEETS_MIRROR and bool(GOOGLE_SHEET_ID)
+                store = SqlResultsStore(DATABASE_URL, mirror_to_sheets=mirror)
+                if SQL_BACKFILL_FROM_SHEET and GOOGLE_SHEET_ID:
+                    try:
+                        store.backfill_from_sheet()
+                    except Exception:
+                        pass
+                _store = store
+            else:
+                _store = SheetsResultsStore()
+    
+    return _store
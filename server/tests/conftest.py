@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Tests import the server modules the way the app does (flat, from server/)
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Quota reservations go to a throwaway limiter file, not the host's
+os.environ.setdefault("RATE_LIMIT_DB", os.path.join(tempfile.mkdtemp(), "limits.db"))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Local fake Gemini server for the model client tests
+A grpc.aio GenerativeService on 127.0.0.1; each model name follows a plan
+of actions, one per call (the last one repeats):
+  "ok"      answer at once
+  "hang"    never answer
+  "junk"    answer at once with text that is not JSON
+  <float>   answer after that many seconds
+"""
+import asyncio
+import json
+from typing import Dict, List
+
+import grpc
+import google.ai.generativelanguage as glm
+import google.generativeai.client as gclient
+from google.ai.generativelanguage_v1beta.services.generative_service.transports.grpc_asyncio import (
+    GenerativeServiceGrpcAsyncIOTransport,
+)
+
+
+SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+ANSWER = {
+    "score_breakdown": {"engine_transmission_score": 8},
+    "base_score_calculated": 80,
+    "common_issues": ["a"],
+    "avg_repair_cost_ILS": 2500,
+    "issues_with_costs": [],
+    "reliability_summary": "ok",
+    "sources": [],
+    "recommended_checks": [],
+    "common_competitors_brief": [],
+}
+
+
+class FakeGemini:
+    """One running fake server; calls records [model, action, outcome] per request"""
+    
+    def __init__(self):
+        self.plans: Dict[str, List] = {}
+        self.calls: List[list] = []
+        self._server = None
+    
+    async def _generate(self, request, context):
+        model = request.model.split("/")[-1]
+        plan = self.plans.get(model, ["ok"])
+        action = plan.pop(0) if len(plan) > 1 else plan[0]
+        entry = [model, action, "started"]
+        self.calls.append(entry)
+        try:
+            if action == "hang":
+                await asyncio.sleep(3600)
+            elif action not in ("ok", "junk"):
+                await asyncio.sleep(action)
+        except asyncio.CancelledError:
+            entry[2] = "cancelled"
+            raise
+        entry[2] = "ok"
+        text = "no JSON here" if action == "junk" else json.dumps(dict(ANSWER, served_by=model))
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(
+            content=glm.Content(parts=[glm.Part(text=text)], role="model"), finish_reason=1
+        )])
+    
+    async def start(self):
+        """Serve on a free port and point the async Gemini client at it"""
+        self._server = grpc.aio.server()
+        handler = grpc.unary_unary_rpc_method_handler(
+            self._generate,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize,
+        )
+        self._server.add_generic_rpc_handlers(
+            (grpc.method_handlers_generic_handler(SERVICE, {"GenerateContent": handler}),)
+        )
+        port = self._server.add_insecure_port("127.0.0.1:0")
+        await self._server.start()
+        channel = grpc.aio.insecure_channel(f"127.0.0.1:{port}", options=[("grpc.enable_http_proxy", 0)])
+        gclient._client_manager.clients["generative_async"] = glm.GenerativeServiceAsyncClient(
+            transport=GenerativeServiceGrpcAsyncIOTransport(channel=channel)
+        )
+    
+    async def stop(self):
+        gclient._client_manager.clients.pop("generative_async", None)
+        await self._server.stop(None)
+    
+    def outcomes(self, model: str) -> List[str]:
+        return [outcome for name, _, outcome in self.calls if name == model]
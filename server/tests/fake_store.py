@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory results store for the request tests
+"""
+import datetime
+
+import pandas as pd
+
+import app
+import cache_lookup
+import rate_limits
+import storage
+from frames import type_results
+from schemas import AnalyzeRequest
+from settings import REQUIRED_HEADERS
+
+
+MODEL_RESULT = {
+    "base_score_calculated": 70,
+    "score_breakdown": {},
+    "common_issues": [],
+    "reliability_summary": "ok",
+    "issues_with_costs": [],
+    "sources": [],
+    "recommended_checks": [],
+    "common_competitors_brief": [],
+    "avg_repair_cost_ILS": 1500,
+}
+
+
+class FakeStore(storage.ResultsStore):
+    """In-memory results store that counts the calls made to it"""
+    
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.calls = []
+    
+    def _frame(self, rows) -> pd.DataFrame:
+        return type_results(pd.DataFrame(rows, columns=REQUIRED_HEADERS))
+    
+    def load_results(self):
+        self.calls.append("load_results")
+        return self._frame(self.rows)
+    
+    def append_result(self, row):
+        self.rows.append(row)
+    
+    def day_results(self, day):
+        self.calls.append("day_results")
+        df = self._frame(self.rows)
+        return df[df["date"] == pd.Timestamp(day)]
+    
+    def recent_results(self, year, since):
+        self.calls.append("recent_results")
+        df = self._frame(self.rows)
+        return df[df["year"].eq(int(year)).fillna(False) & (df["date"] >= pd.Timestamp(since))]
+    
+    def version(self):
+        self.calls.append("version")
+        return len(self.rows)
+    
+    def results_since(self, version, until=None):
+        self.calls.append("results_since")
+        return self._frame(self.rows[version:until])
+
+
+def make_row(date, user_id, model, year):
+    row = dict.fromkeys(REQUIRED_HEADERS, "")
+    row.update(date=date, user_id=user_id, make="Toyota", model=model, sub_model="", year=year,
+               fuel="בנזין", transmission="אוטומטית", mileage_range="50-100 אלף",
+               base_score_calculated=70, avg_cost=1500)
+    return row
+
+
+def make_request(model, year):
+    return AnalyzeRequest(make="Toyota", model=model, sub_model="", year=year, fuel_type="בנזין",
+                          transmission="אוטומטית", mileage_range="50-100 אלף")
+
+
+def install(monkeypatch) -> FakeStore:
+    """
+    Serve storage from a FakeStore of 100 Toyota Corolla rows
+    Today's rows are the 2010 and 2015 models; the rest are too old to serve
+    """
+    today = datetime.date.today().isoformat()
+    fake = FakeStore(make_row(today if i % 5 == 0 else "2000-01-01", f"other{i}", "Corolla (1966-2025)", 2010 + i % 10)
+                     for i in range(100))
+    monkeypatch.setattr(storage, "_store", fake)
+    # Every request syncs the quota counters and starts with cold indexes
+    monkeypatch.setattr(rate_limits, "QUOTA_SYNC_SEC", 0)
+    monkeypatch.setattr(rate_limits, "_counter_day", None)
+    monkeypatch.setattr(cache_lookup, "_exact_version", None)
+    # The Authorization value is the user id
+    monkeypatch.setattr(app, "get_user_id_from_header", lambda authorization: authorization or "anonymous")
+    return fake
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breaker and AIMD limit state machines, and model calls while a
+circuit is open
+"""
+import asyncio
+import datetime
+import types
+
+import pytest
+
+import app
+import breaker
+import models_logic
+from breaker import AimdLimit, CircuitBreaker, ModelUnavailable, CLOSED, OPEN, HALF_OPEN
+from fake_gemini import FakeGemini
+from fake_store import install, make_request, make_row
+from settings import PRIMARY_MODEL, FALLBACK_MODEL
+
+
+class Clock:
+    """Stands in for time.monotonic inside breaker"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(breaker, "BREAKER_WINDOW", 10)
+    monkeypatch.setattr(breaker, "BREAKER_MIN_CALLS", 4)
+    monkeypatch.setattr(breaker, "BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(breaker, "BREAKER_SLOW_SEC", 30)
+    monkeypatch.setattr(breaker, "BREAKER_OPEN_SEC", 30)
+    monkeypatch.setattr(breaker, "DECREASE_COOLDOWN_SEC", 1.0)
+    return clock
+
+
+def _call(circuit: CircuitBreaker, ok: bool, seconds: float = 0.1):
+    circuit.allow()
+    circuit.record(ok, seconds)
+
+
+def _opened(clock) -> CircuitBreaker:
+    circuit = CircuitBreaker("m")
+    for _ in range(4):
+        _call(circuit, False)
+    assert circuit.state == OPEN
+    return circuit
+
+
+def test_opens_at_error_rate_after_min_calls(clock):
+    circuit = CircuitBreaker("m")
+    # Failures below BREAKER_MIN_CALLS never open it
+    for _ in range(3):
+        _call(circuit, False)
+    assert circuit.state == CLOSED
+    _call(circuit, True)
+    # 3 of 4 failed (>= 50%)
+    assert circuit.state == OPEN
+    with pytest.raises(ModelUnavailable):
+        circuit.allow()
+
+
+def test_stays_closed_below_error_rate(clock):
+    circuit = CircuitBreaker("m")
+    for ok in (True, True, True, False, True, False):
+        _call(circuit, ok)
+    assert circuit.state == CLOSED
+
+
+def test_slow_success_counts_as_failure(clock):
+    circuit = CircuitBreaker("m")
+    for _ in range(4):
+        _call(circuit, True, seconds=31)
+    assert circuit.state == OPEN
+
+
+def test_half_open_after_open_sec_with_one_probe(clock):
+    circuit = _opened(clock)
+    clock.now += 29
+    with pytest.raises(ModelUnavailable) as e:
+        circuit.allow()
+    assert e.value.retry_after == pytest.approx(1)
+    
+    clock.now += 1
+    circuit.allow()
+    assert circuit.state == HALF_OPEN
+    # Only the one probe goes through
+    with pytest.raises(ModelUnavailable):
+        circuit.allow()
+
+
+def test_probe_success_closes(clock):
+    circuit = _opened(clock)
+    clock.now += 30
+    _call(circuit, True)
+    assert circuit.state == CLOSED
+    assert circuit.stats()["recent_calls"] == 0
+    circuit.allow()
+
+
+def test_probe_failure_reopens(clock):
+    circuit = _opened(clock)
+    clock.now += 30
+    _call(circuit, False)
+    assert circuit.state == OPEN
+    assert circuit.wait() == pytest.approx(30)
+
+
+def test_abandoned_probe_lets_another_through(clock):
+    circuit = _opened(clock)
+    clock.now += 30
+    circuit.allow()
+    circuit.abandon()
+    circuit.allow()
+    assert circuit.state == HALF_OPEN
+
+
+def test_aimd_halves_once_per_cooldown(clock):
+    limit = AimdLimit(minimum=2, maximum=16)
+    for _ in range(3):
+        limit.acquire()
+    limit.release(False)
+    limit.release(False)
+    # A burst of failures halves the limit once
+    assert limit.limit == 8
+    
+    clock.now += 1.0
+    limit.release(True, seconds=31)
+    # A slow success is a failure too
+    assert limit.limit == 4
+    
+    for _ in range(5):
+        clock.now += 1.0
+        limit.acquire()
+        limit.release(False)
+    assert limit.limit == 2
+
+
+def test_aimd_grows_by_one_per_limit_of_successes(clock):
+    limit = AimdLimit(minimum=2, maximum=16)
+    limit.limit = 4.0
+    for _ in range(4):
+        limit.acquire()
+        limit.release(True, seconds=0.1)
+    # +1/limit per success: about one slot per limit's worth of calls
+    assert 4.9 < limit.limit < 5.0
+    
+    limit.limit = 16.0
+    limit.acquire()
+    limit.release(True)
+    assert limit.limit == 16
+
+
+def test_aimd_rejects_over_limit(clock):
+    limit = AimdLimit(minimum=2, maximum=2)
+    limit.acquire()
+    limit.acquire()
+    with pytest.raises(ModelUnavailable):
+        limit.acquire()
+    assert limit.stats() == {"limit": 2, "in_flight": 2, "rejected": 1}
+
+
+@pytest.fixture
+def open_circuits(monkeypatch):
+    circuits = {name: CircuitBreaker(name) for name in (PRIMARY_MODEL, FALLBACK_MODEL)}
+    monkeypatch.setattr(models_logic, "_breakers", circuits)
+    monkeypatch.setattr(models_logic, "_concurrency", AimdLimit())
+    monkeypatch.setattr(models_logic, "GEMINI_API_KEY", "fake")
+    monkeypatch.setattr(models_logic, "MODEL_HEDGE", False)
+    return circuits
+
+
+def _open(circuit: CircuitBreaker):
+    with circuit._lock:
+        circuit._open()
+
+
+def test_open_primary_goes_straight_to_fallback(open_circuits):
+    _open(open_circuits[PRIMARY_MODEL])
+    
+    async def main():
+        server = FakeGemini()
+        await server.start()
+        try:
+            return await models_logic.call_model_async("prompt"), server
+        finally:
+            await server.stop()
+    result, server = asyncio.run(main())
+    
+    assert result["served_by"] == FALLBACK_MODEL
+    assert server.outcomes(PRIMARY_MODEL) == []
+
+
+def test_open_circuits_serve_an_old_answer(open_circuits, monkeypatch):
+    store = install(monkeypatch)
+    # Too old for the cache or its stale window, within CACHE_OUTAGE_DAYS
+    old = (datetime.date.today() - datetime.timedelta(days=200)).isoformat()
+    store.rows.append(make_row(old, "someone", "Yaris", 2018))
+    for circuit in open_circuits.values():
+        _open(circuit)
+    
+    async def no_model(request):
+        raise AssertionError("model called with every circuit open")
+    monkeypatch.setattr(app, "analyze_with_model", no_model)
+    
+    class Connected:
+        async def is_disconnected(self):
+            return False
+    
+    response = asyncio.run(app.analyze_reliability(make_request("Yaris", 2018), Connected(), "outage-user"))
+    
+    assert response.source == "cache"
+    assert response.result.last_date == old
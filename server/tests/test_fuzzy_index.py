@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+The n-gram index must make the same hit decisions as the difflib scan it
+replaced: every value whose ratio reaches the threshold, and no other
+"""
+import difflib
+import os
+import random
+
+import pandas as pd
+import pytest
+
+from fuzzy_index import NgramIndex
+from cache_lookup import column_scores, score_candidates, cascade_hits, similarity, MATCH_THRESHOLDS
+from frames import type_results, categorize
+from text_utils import normalize_text
+
+
+HISTORY_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           "reliability_results.csv")
+
+
+SEEDS = ["corolla", "mazda3", "i35 / elantra", "golf", "octavia", "sportage", "ioniq 5",
+         "land cruiser", "cx-5", "3 series", "model y", "c-hr", "yaris cross", "picanto"]
+ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789 -/"
+
+
+def _mutate(rng: random.Random, s: str) -> str:
+    """Copy of s with a few random edits, so some values land near the threshold"""
+    chars = list(s)
+    for _ in range(rng.randint(0, 3)):
+        op = rng.choice("isd")
+        pos = rng.randrange(len(chars) + 1)
+        if op == "i":
+            chars.insert(pos, rng.choice(ALPHABET))
+        elif chars and pos < len(chars):
+            if op == "s":
+                chars[pos] = rng.choice(ALPHABET)
+            else:
+                del chars[pos]
+    return "".join(chars)
+
+
+def _names(rng: random.Random, count: int):
+    names = set()
+    while len(names) < count:
+        if rng.random() < 0.8:
+            names.add(_mutate(rng, rng.choice(SEEDS)))
+        else:
+            names.add("".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 14))))
+    return sorted(names)
+
+
+def _difflib_scan(values, query: str, threshold: float):
+    """The matcher before the index: score every value"""
+    out = {}
+    for v in values:
+        r = difflib.SequenceMatcher(None, query, v).ratio()
+        if r >= threshold:
+            out[v] = r
+    return out
+
+
+@pytest.mark.parametrize("threshold", list(MATCH_THRESHOLDS) + [0.9, 0.8, 0.6])
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_equal_difflib_scan(seed, threshold):
+    rng = random.Random(seed)
+    values = _names(rng, 400)
+    idx = NgramIndex()
+    for v in values:
+        idx.add(v)
+    
+    queries = [rng.choice(values) for _ in range(20)] + [_mutate(rng, rng.choice(SEEDS)) for _ in range(40)]
+    for query in queries:
+        assert idx.matches(query, threshold) == _difflib_scan(values, query, threshold), query
+
+
+def test_column_scores_equal_difflib_scan():
+    rng = random.Random(42)
+    raw = [rng.choice(_names(rng, 60)).upper() for _ in range(500)]
+    frame = pd.DataFrame({"model": raw})
+    categorical = pd.DataFrame({"model": pd.Series(raw).astype("category")})
+    
+    for floor in MATCH_THRESHOLDS:
+        for _ in range(20):
+            query = normalize_text(_mutate(rng, rng.choice(SEEDS)))
+            expected = [
+                r if r >= floor else 0.0
+                for r in (difflib.SequenceMatcher(None, query, normalize_text(v)).ratio() for v in raw)
+            ]
+            assert column_scores(frame, "model", query, floor).tolist() == pytest.approx(expected)
+            assert column_scores(categorical, "model", query, floor).tolist() == pytest.approx(expected)
+
+
+def _scan_cascade(recent, year, make, model, sub_model):
+    """The matcher before the index: similarity() on every row, per threshold"""
+    mk, md, sm = normalize_text(make), normalize_text(model), normalize_text(sub_model or "")
+    for sub in ([sm, ""] if sm else [""]):
+        for th in MATCH_THRESHOLDS:
+            mask = (
+                (pd.to_numeric(recent["year"], errors="coerce").astype("Int64") == int(year)) &
+                recent["make"].apply(lambda x: similarity(x, mk) >= th) &
+                recent["model"].apply(lambda x: similarity(x, md) >= th)
+            )
+            if sub and "sub_model" in recent.columns:
+                mask &= recent["sub_model"].apply(lambda x: similarity(x, sub) >= th)
+            if mask.any():
+                return sorted(recent.index[mask.fillna(False)]), bool(sub)
+    return [], False
+
+
+def _indexed_cascade(recent, year, make, model, sub_model):
+    scores = score_candidates(recent, year, make, model, sub_model)
+    for sub in ([True, False] if normalize_text(sub_model or "") else [False]):
+        hits = cascade_hits(recent, scores["row"] if sub else scores["row_no_sub"])
+        if not hits.empty:
+            return sorted(hits.index), sub
+    return [], False
+
+
+@pytest.mark.skipif(not os.path.exists(HISTORY_CSV), reason="no historical results in this checkout")
+@pytest.mark.parametrize("typed", [False, True])
+def test_historical_queries_hit_the_same_rows(typed):
+    raw = pd.read_csv(HISTORY_CSV, dtype=str, keep_default_na=False)
+    recent = categorize(type_results(raw.copy())) if typed else raw
+    
+    queries = []
+    for r in raw.to_dict("records"):
+        make, model, sub_model = r["make"], r["model"], r.get("sub_model", "")
+        # Each stored query, the label without its year range, and lower case,
+        # for its year and the years around it
+        for variant in {model, model.split(" (")[0], model.lower()}:
+            for year in (int(r["year"]) - 1, int(r["year"]), int(r["year"]) + 1):
+                queries.append((year, make, variant, sub_model))
+    
+    for query in queries:
+        assert _indexed_cascade(recent, *query) == _scan_cascade(raw, *query), query
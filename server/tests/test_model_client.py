@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+call_model_async against a local fake Gemini server: per-attempt timeout,
+total deadline, fallback, cancellation and hedging
+"""
+import asyncio
+import time
+from collections import deque
+
+import pytest
+
+import models_logic
+from breaker import AimdLimit, CircuitBreaker
+from fake_gemini import FakeGemini
+from settings import PRIMARY_MODEL, FALLBACK_MODEL
+
+
+@pytest.fixture
+def model_env(monkeypatch):
+    monkeypatch.setattr(models_logic, "GEMINI_API_KEY", "fake")
+    monkeypatch.setattr(models_logic, "MODEL_HEDGE", False)
+    monkeypatch.setattr(models_logic, "RETRIES", 2)
+    monkeypatch.setattr(models_logic, "RETRY_BACKOFF_SEC", 0.05)
+    monkeypatch.setattr(models_logic, "MODEL_ATTEMPT_TIMEOUT_SEC", 0.5)
+    monkeypatch.setattr(models_logic, "MODEL_TOTAL_TIMEOUT_SEC", 5.0)
+    # Fresh circuits and in-flight limit, so one test's failures stay there
+    monkeypatch.setattr(models_logic, "_breakers", {
+        name: CircuitBreaker(name) for name in (PRIMARY_MODEL, FALLBACK_MODEL)
+    })
+    monkeypatch.setattr(models_logic, "_concurrency", AimdLimit())
+    monkeypatch.setattr(models_logic, "_latencies", {})
+    monkeypatch.setattr(models_logic, "_recent_calls", deque(maxlen=200))
+    monkeypatch.setattr(models_logic, "_hedge_counts", {"hedged": 0, "hedge_won": 0})
+    return monkeypatch
+
+
+@pytest.fixture
+def hedge_env(model_env):
+    model_env.setattr(models_logic, "MODEL_HEDGE", True)
+    model_env.setattr(models_logic, "MODEL_HEDGE_AFTER_SEC", 0.2)
+    model_env.setattr(models_logic, "MODEL_HEDGE_MIN_SEC", 0.1)
+    model_env.setattr(models_logic, "MODEL_HEDGE_QUANTILE", 0.9)
+    model_env.setattr(models_logic, "MODEL_HEDGE_BUDGET", 0.1)
+    return model_env
+
+
+def _run(plans, scenario):
+    """Run scenario(server) with the fake serving plans"""
+    async def main():
+        server = FakeGemini()
+        server.plans = plans
+        await server.start()
+        try:
+            return await scenario(server)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+def test_attempt_timeout_retries_same_model(model_env):
+    async def scenario(server):
+        started = time.monotonic()
+        result = await models_logic.call_model_async("prompt")
+        return result, time.monotonic() - started, server
+    
+    result, elapsed, server = _run({PRIMARY_MODEL: ["hang", "ok"]}, scenario)
+    
+    assert result["served_by"] == PRIMARY_MODEL
+    # The hung attempt was abandoned after MODEL_ATTEMPT_TIMEOUT_SEC
+    assert server.outcomes(PRIMARY_MODEL) == ["cancelled", "ok"]
+    assert 0.5 <= elapsed < 1.5
+
+
+def test_primary_timeouts_fall_back(model_env):
+    async def scenario(server):
+        return await models_logic.call_model_async("prompt"), server
+    
+    result, server = _run({PRIMARY_MODEL: ["hang"], FALLBACK_MODEL: ["ok"]}, scenario)
+    
+    assert result["served_by"] == FALLBACK_MODEL
+    assert server.outcomes(PRIMARY_MODEL) == ["cancelled", "cancelled"]
+
+
+def test_total_deadline_bounds_the_call(model_env):
+    model_env.setattr(models_logic, "MODEL_TOTAL_TIMEOUT_SEC", 1.2)
+    
+    async def scenario(server):
+        started = time.monotonic()
+        with pytest.raises(RuntimeError):
+            await models_logic.call_model_async("prompt")
+        return time.monotonic() - started
+    
+    elapsed = _run({PRIMARY_MODEL: ["hang"], FALLBACK_MODEL: ["hang"]}, scenario)
+    
+    # Four 0.5 s attempts would take 2 s; the deadline cuts the last ones short
+    assert 1.2 <= elapsed < 1.7
+
+
+def test_cancelling_the_caller_cancels_the_upstream_call(model_env):
+    async def scenario(server):
+        task = asyncio.ensure_future(models_logic.call_model_async("prompt"))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Let the server see the cancelled RPC
+        await asyncio.sleep(0.2)
+        return server
+    
+    server = _run({PRIMARY_MODEL: ["hang"]}, scenario)
+    
+    assert server.outcomes(PRIMARY_MODEL) == ["cancelled"]
+    assert server.outcomes(FALLBACK_MODEL) == []
+    # A cancelled attempt neither counts against the circuit nor holds a slot
+    assert models_logic._breakers[PRIMARY_MODEL].stats()["recent_calls"] == 0
+    assert models_logic._concurrency.stats()["in_flight"] == 0
+
+
+def test_no_hedge_before_threshold(hedge_env):
+    async def scenario(server):
+        return await models_logic.call_model_async("prompt"), server
+    
+    result, server = _run({PRIMARY_MODEL: [0.1]}, scenario)
+    
+    assert result["served_by"] == PRIMARY_MODEL
+    assert server.outcomes(FALLBACK_MODEL) == []
+    assert models_logic._hedge_counts["hedged"] == 0
+
+
+def test_hedge_threshold_follows_observed_latency(hedge_env):
+    # Until 20 calls are seen the fixed MODEL_HEDGE_AFTER_SEC applies
+    assert models_logic.hedge_threshold() == 0.2
+    for _ in range(20):
+        models_logic._record_latency(PRIMARY_MODEL, 0.5)
+    assert models_logic.hedge_threshold() == 0.5
+    
+    async def scenario(server):
+        return await models_logic.call_model_async("prompt"), server
+    
+    # Slower than the fixed threshold, faster than the observed p90
+    result, server = _run({PRIMARY_MODEL: [0.3]}, scenario)
+    
+    assert result["served_by"] == PRIMARY_MODEL
+    assert server.outcomes(FALLBACK_MODEL) == []
+
+
+def test_first_valid_answer_wins_and_cancels_the_other(hedge_env):
+    async def scenario(server):
+        result = await models_logic.call_model_async("prompt")
+        # Let the server see the cancelled RPC
+        await asyncio.sleep(0.2)
+        return result, server
+    
+    result, server = _run({PRIMARY_MODEL: [2.0], FALLBACK_MODEL: ["ok"]}, scenario)
+    
+    assert result["served_by"] == FALLBACK_MODEL
+    assert server.outcomes(PRIMARY_MODEL) == ["cancelled"]
+    assert models_logic._hedge_counts == {"hedged": 1, "hedge_won": 1}
+
+
+def test_invalid_reply_does_not_win_the_race(hedge_env):
+    hedge_env.setattr(models_logic, "MODEL_HEDGE_AFTER_SEC", 0.05)
+    hedge_env.setattr(models_logic, "RETRY_BACKOFF_SEC", 0.2)
+    
+    async def scenario(server):
+        return await models_logic.call_model_async("prompt"), server
+    
+    # The primary answers first, but never with JSON
+    result, server = _run({PRIMARY_MODEL: ["junk"], FALLBACK_MODEL: [0.4]}, scenario)
+    
+    assert result["served_by"] == FALLBACK_MODEL
+    assert server.outcomes(PRIMARY_MODEL) == ["ok", "ok"]
+
+
+def test_hedge_budget_caps_extra_calls(hedge_env):
+    async def scenario(server):
+        results = await asyncio.gather(*[models_logic.call_model_async("prompt") for _ in range(5)])
+        return results, server
+    
+    results, server = _run({PRIMARY_MODEL: [0.35], FALLBACK_MODEL: [0.35]}, scenario)
+    
+    # Five slow calls at once (within the in-flight limit): the budget lets
+    # hedges through only while they stay under MODEL_HEDGE_BUDGET of recent
+    # calls (+1)
+    assert len(results) == 5
+    assert models_logic._hedge_counts["hedged"] == 2
+    assert len(server.outcomes(FALLBACK_MODEL)) == 2
+
+
+def test_hedged_call_fails_when_both_fail(hedge_env):
+    hedge_env.setattr(models_logic, "MODEL_TOTAL_TIMEOUT_SEC", 1.2)
+    
+    async def scenario(server):
+        started = time.monotonic()
+        with pytest.raises(RuntimeError):
+            await models_logic.call_model_async("prompt")
+        return time.monotonic() - started, server
+    
+    elapsed, server = _run({PRIMARY_MODEL: ["hang"], FALLBACK_MODEL: ["hang"]}, scenario)
+    
+    assert models_logic._hedge_counts == {"hedged": 1, "hedge_won": 0}
+    assert server.outcomes(FALLBACK_MODEL)
+    assert elapsed < 1.7
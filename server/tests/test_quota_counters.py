@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Per-worker quota counters: storage is read outside the counter lock, and
+a worker's own saves are counted once
+"""
+import datetime
+import threading
+import time
+
+import rate_limits
+from fake_store import install, make_row
+
+
+def test_slow_sync_does_not_block_quota_checks(monkeypatch):
+    store = install(monkeypatch)
+    rate_limits.get_remaining_quota("warm")
+    
+    release = threading.Event()
+    reading = threading.Event()
+    results_since = store.results_since
+    
+    def slow_results_since(*args):
+        reading.set()
+        release.wait(5)
+        return results_since(*args)
+    monkeypatch.setattr(store, "results_since", slow_results_since)
+    
+    store.rows.append(make_row(datetime.date.today().isoformat(), "other", "Camry", 2019))
+    syncing = threading.Thread(target=rate_limits.get_remaining_quota, args=("a",))
+    syncing.start()
+    assert reading.wait(5)
+    
+    # Served from the current counts while the other thread reads
+    started = time.monotonic()
+    rate_limits.get_remaining_quota("b")
+    rate_limits.record_result(make_row(datetime.date.today().isoformat(), "b", "Yaris", 2018))
+    assert time.monotonic() - started < 1
+    
+    release.set()
+    syncing.join(5)
+
+
+def test_own_saves_counted_once(monkeypatch):
+    store = install(monkeypatch)
+    today = datetime.date.today().isoformat()
+    user_before, global_before = rate_limits._counts("me")
+    
+    rate_limits.record_result(make_row(today, "me", "Yaris", 2018))
+    store.rows.append(make_row(today, "someone", "Camry", 2019))
+    assert rate_limits._counts("me") == (user_before + 1, global_before + 2)
+    assert rate_limits._counts("someone") == (1, global_before + 2)
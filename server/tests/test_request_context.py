@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Storage calls made by one /v1/analyze request, through its RequestContext
+"""
+import asyncio
+
+import pytest
+
+import app
+from fake_store import MODEL_RESULT, install, make_request as _request
+from settings import USER_DAILY_LIMIT, GLOBAL_DAILY_LIMIT
+
+
+class Connected:
+    """Starlette request stand-in for a client that stays connected"""
+    
+    async def is_disconnected(self):
+        return False
+
+
+@pytest.fixture
+def store(monkeypatch):
+    fake = install(monkeypatch)
+    contexts = []
+    
+    class RecordingContext(app.RequestContext):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            contexts.append(self)
+    
+    async def fake_model(request):
+        return dict(MODEL_RESULT), None
+    
+    monkeypatch.setattr(app, "RequestContext", RecordingContext)
+    monkeypatch.setattr(app, "analyze_with_model", fake_model)
+    fake.contexts = contexts
+    return fake
+
+
+def _analyze(store, request, user_id):
+    store.calls.clear()
+    store.contexts.clear()
+    response = asyncio.run(app.analyze_reliability(request, Connected(), user_id))
+    assert len(store.contexts) == 1
+    return response, store.contexts[0]
+
+
+def test_cache_hit_reads_storage_once_per_stage(store):
+    # Warm the exact index and the quota counters
+    warm, _ = _analyze(store, _request("Corolla (1966-2025)", 2015), "u1")
+    assert warm.source == "cache"
+    
+    response, ctx = _analyze(store, _request("Corolla (1966-2025)", 2015), "u1")
+    
+    assert response.source == "cache"
+    # The store version, read once and shared by the quota and cache stages
+    assert ctx.storage_reads == 1
+    assert store.calls == ["version"]
+
+
+def test_cache_miss_derives_quota_locally(store):
+    _analyze(store, _request("Corolla (1966-2025)", 2015), "u2")
+    
+    response, ctx = _analyze(store, _request("Camry", 2019), "u2")
+    
+    assert response.source == "model"
+    # Version, then the fuzzy candidates; the quota after the model call
+    # comes from the counts read at the start, not from another read
+    assert ctx.storage_reads == 2
+    # Saving the answer counts it in memory, without reading storage
+    assert store.calls == ["version", "recent_results"]
+    assert response.quota.user_left_today == USER_DAILY_LIMIT - 1
+    assert response.quota.global_left_today == GLOBAL_DAILY_LIMIT - 21
+    
+    # The next request reads the saved row back; it is not counted twice
+    repeat, _ = _analyze(store, _request("Camry", 2019), "u2")
+    assert repeat.source == "cache"
+    assert "results_since" in store.calls
+    assert repeat.quota.user_left_today == USER_DAILY_LIMIT - 1
+    assert repeat.quota.global_left_today == GLOBAL_DAILY_LIMIT - 21
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Rows written before the first snapshot load still show up in it
+"""
+from collections import deque
+
+import pytest
+
+import sheets_layer
+from settings import REQUIRED_HEADERS
+
+
+def _row(user_id):
+    row = dict.fromkeys(REQUIRED_HEADERS, "")
+    row.update(date="2026-01-01", user_id=user_id, make="Toyota", model="Corolla", year="2015")
+    return [row[k] for k in REQUIRED_HEADERS]
+
+
+class FakeSheet:
+    def __init__(self, rows):
+        self.values = [list(REQUIRED_HEADERS)] + rows
+    
+    def get_all_values(self):
+        return [list(r) for r in self.values]
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    sheet = FakeSheet([_row("synced")])
+    monkeypatch.setattr(sheets_layer, "connect_sheet", lambda: sheet)
+    monkeypatch.setattr(sheets_layer, "SHEET_INCREMENTAL_SYNC", False)
+    for name, value in [("_snapshot_df", None), ("_synced_df", None), ("_snapshot_loaded_at", 0.0),
+                        ("_snapshot_version", 0), ("_changes", deque(maxlen=512)), ("_last_row", 1),
+                        ("_local_rows", []), ("_unmerged", []), ("_next_sync_at", 0.0)]:
+        monkeypatch.setattr(sheets_layer, name, value)
+    return sheet
+
+
+def test_queued_write_before_load_is_in_snapshot(sheet):
+    sheets_layer._track_local_rows([[sheets_layer._PENDING, _row("queued")]])
+    # Anyone who read the version before the write sees it move
+    assert sheets_layer._snapshot_version == 1
+    
+    df = sheets_layer.sheet_to_df()
+    
+    assert list(df["user_id"]) == ["synced", "queued"]
+    assert sheets_layer.snapshot_version() == 2
+
+
+def test_written_row_before_load_is_not_doubled(sheet):
+    sheet.values.append(_row("written"))
+    sheets_layer._track_local_rows([[2, _row("written")]])
+    
+    df = sheets_layer.sheet_to_df()
+    
+    assert list(df["user_id"]) == ["synced", "written"]
+    assert sheets_layer._local_rows == []
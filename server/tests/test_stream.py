@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Quota reservations of /v1/analyze/stream: a model stream gives its
+reservation back unless the answer was delivered, even one never started
+"""
+import asyncio
+import datetime
+import json
+import uuid
+
+import pytest
+
+import app
+import limiter
+from fake_store import MODEL_RESULT, install, make_request
+
+
+@pytest.fixture
+def stream_env(monkeypatch):
+    install(monkeypatch)
+    releases = []
+    release = app.release_model_call
+    
+    def counting_release(user_id):
+        releases.append(user_id)
+        release(user_id)
+    
+    async def fake_stream(prompt):
+        text = json.dumps(MODEL_RESULT)
+        for i in range(0, len(text), 40):
+            yield text[i:i + 40]
+    
+    monkeypatch.setattr(app, "release_model_call", counting_release)
+    monkeypatch.setattr(app, "stream_model_async", fake_stream)
+    return releases
+
+
+def _reserved(user_id: str) -> int:
+    row = limiter.get_limiter()._connect().execute(
+        "SELECT used FROM daily WHERE day = ? AND key = ?",
+        (datetime.date.today().isoformat(), f"u:{user_id}")
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def _open_stream(user_id: str):
+    """Model stream response for a cache miss (its quota reserved)"""
+    response = asyncio.run(app.analyze_reliability_stream(make_request("Camry", 2019), user_id))
+    assert _reserved(user_id) == 1
+    return response
+
+
+def test_stream_closed_before_iteration_releases(stream_env):
+    user_id = uuid.uuid4().hex
+    response = _open_stream(user_id)
+    
+    async def client_gone():
+        await response.body_iterator.aclose()
+        await response.background()
+    asyncio.run(client_gone())
+    
+    assert stream_env == [user_id]
+    assert _reserved(user_id) == 0
+
+
+def test_stream_closed_midway_releases_once(stream_env):
+    user_id = uuid.uuid4().hex
+    response = _open_stream(user_id)
+    
+    async def client_gone():
+        await response.body_iterator.__anext__()
+        await response.body_iterator.aclose()
+        await response.background()
+    asyncio.run(client_gone())
+    
+    assert stream_env == [user_id]
+    assert _reserved(user_id) == 0
+
+
+def test_delivered_stream_keeps_reservation(stream_env):
+    user_id = uuid.uuid4().hex
+    response = _open_stream(user_id)
+    
+    async def read_all():
+        events = [event async for event in response.body_iterator]
+        await response.background()
+        return events
+    events = asyncio.run(read_all())
+    
+    assert events[-1].startswith("event: result")
+    assert stream_env == []
+    assert _reserved(user_id) == 1
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Recovery of rows spilled by a dead process: they are never only in memory
+"""
+import json
+import os
+
+import pytest
+
+import sheets_layer
+
+
+ROWS = [["2026-01-01", "u1", "Toyota", "Corolla"], ["2026-01-01", "u2", "Mazda", "3"]]
+
+
+def _dead_pid() -> int:
+    pid = 4_000_000
+    while sheets_layer._pid_alive(pid):
+        pid += 1
+    return pid
+
+
+@pytest.fixture
+def spill_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(sheets_layer, "SHEET_WRITE_BEHIND", True)
+    monkeypatch.setattr(sheets_layer, "SHEET_WRITE_SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(sheets_layer, "_queue", [])
+    monkeypatch.setattr(sheets_layer, "_flusher", None)
+    # No sheet here: the flusher thread has nothing to do
+    monkeypatch.setattr(sheets_layer, "_flush_loop", lambda: None)
+    with open(tmp_path / f"spill-{_dead_pid()}.jsonl", "w", encoding="utf-8") as f:
+        for row in ROWS:
+            f.write(json.dumps(row) + "\n")
+    return tmp_path
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_recovered_rows_move_to_own_spill_file(spill_dir):
+    sheets_layer.start_write_behind()
+    
+    assert os.listdir(spill_dir) == [f"spill-{os.getpid()}.jsonl"]
+    assert _read(spill_dir / f"spill-{os.getpid()}.jsonl") == ROWS
+    assert [row for _, row in sheets_layer._queue] == ROWS
+
+
+def test_failed_respill_leaves_rows_claimed(spill_dir, monkeypatch):
+    def disk_full(rows):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(sheets_layer, "_spill_append", disk_full)
+    
+    sheets_layer.start_write_behind()
+    
+    claimed = [name for name in os.listdir(spill_dir) if name.startswith(f"claim-{os.getpid()}-")]
+    assert len(claimed) == 1
+    assert _read(spill_dir / claimed[0]) == ROWS
+    assert sheets_layer._queue == []
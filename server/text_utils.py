@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+Text normalization helpers shared by the cache lookup and the catalog
+"""
+import re
+from typing import Any
+
+
+def normalize_text(s: Any) -> str:
+    """Normalize text for comparison"""
+    if s is None:
+        return ""
+    s = re.sub(r"\(.*?\)", " ", str(s))
+    s = re.sub(r"\s+", " ", s).strip().lower()
+    return s